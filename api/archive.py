@@ -0,0 +1,101 @@
+import json
+import zlib
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Expense, ExpenseArchive
+from .purge import delete_rows
+from .snapshots import mark_stale
+
+# Cold storage for old expenses.
+#
+# Expenses older than EXPENSE_ARCHIVE_AFTER_YEARS are moved out of api_expense (`manage.py
+# archive_expenses`, from cron) into ExpenseArchive chunks: up to EXPENSE_ARCHIVE_CHUNK_SIZE expenses of
+# one user, oldest first, as zlib-compressed JSON rows. The hot table stays the size of the recent
+# history, and the archive can live in a cheaper database (EXPENSE_ARCHIVE_DATABASE_URL, see
+# api/routers.py). Only the export reads the archive back; analytics, lists and sync cover the hot
+# table, and archiving leaves no tombstones, so clients that have the rows keep them. The expenses are
+# deleted with plain DELETE statements (see api/purge.py), which send no signals: the user's dashboard
+# snapshot is marked stale once the user is done.
+
+ARCHIVE_FIELDS = ['id', 'budget_id', 'name', 'amount', 'currency', 'created_at', 'category_id']
+
+
+def archive_cutoff(years=None, today=None):
+    years = years if years is not None else settings.EXPENSE_ARCHIVE_AFTER_YEARS
+    today = today or timezone.now().date()
+    try:
+        day = today.replace(year=today.year - years)
+    except ValueError:  # 29 February
+        day = today.replace(year=today.year - years, day=28)
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def pack(rows):
+    return zlib.compress(json.dumps(rows, cls=DjangoJSONEncoder, separators=(',', ':')).encode(), 9)
+
+
+def unpack(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def archive_user(user_id, before, chunk_size=None):
+    # Returns the number of expenses archived
+    chunk_size = chunk_size or settings.EXPENSE_ARCHIVE_CHUNK_SIZE
+    hot_db, archive_db = router.db_for_write(Expense), router.db_for_write(ExpenseArchive)
+    connection = connections[hot_db]
+    old = Expense.objects.filter(user_id=user_id, created_at__lt=before).order_by('created_at', 'id')
+    archived = 0
+    while True:
+        rows = [list(row) for row in old.values_list(*ARCHIVE_FIELDS)[:chunk_size]]
+        if not rows:
+            if archived:
+                mark_stale(user_id)
+            return archived
+        created = [row[5] for row in rows]
+        chunk = ExpenseArchive(user_id=user_id, first_day=created[0].date(), last_day=created[-1].date(),
+                               count=len(rows), data=pack(rows))
+        # The chunk commits before the delete: with the archive in another database, an interruption
+        # leaves expenses in both places (archived again by the next run, shown once by the export)
+        # rather than in neither
+        with transaction.atomic(using=hot_db):
+            with transaction.atomic(using=archive_db):
+                chunk.save(using=archive_db)
+            delete_rows(connection, Expense, [row[0] for row in rows])
+        archived += len(rows)
+
+
+def archive_expenses(years=None, chunk_size=None):
+    # Returns (users, expenses) archived
+    before = archive_cutoff(years)
+    user_ids = list(Expense.objects.filter(created_at__lt=before).order_by('user_id').values_list('user_id', flat=True).distinct())
+    expenses = 0
+    for user_id in user_ids:
+        expenses += archive_user(user_id, before, chunk_size)
+    return len(user_ids), expenses
+
+
+def archived_expenses(user_id):
+    """
+    The user's archived expenses, oldest first, as (id, date, category id, amount, name) like
+    ExpenseColumns.rows() plus the id. Chunks are decompressed one at a time.
+    """
+    fields = {name: index for index, name in enumerate(ARCHIVE_FIELDS)}
+    tz = timezone.get_current_timezone()
+    seen = set()  # the same expense can be in two chunks after an interrupted run
+    for data in ExpenseArchive.objects.filter(user_id=user_id).order_by('first_day', 'id').values_list('data', flat=True).iterator(chunk_size=20):
+        for row in unpack(data):
+            expense_id = row[fields['id']]
+            if expense_id in seen:
+                continue
+            seen.add(expense_id)
+            created_at = parse_datetime(row[fields['created_at']])
+            yield (expense_id, timezone.localtime(created_at, tz).date(), row[fields['category_id']],
+                   Decimal(row[fields['amount']]), row[fields['name']])
+
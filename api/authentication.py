@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .edge import edge_serving, use_user_file
+from .models import LazyUser
+from .telemetry import record_cache_access
+
+# JWT authentication that trusts the verified token claims instead of loading the User row on every
+# request. The views only need request.user's id, so request.user is a LazyUser carrying just the id;
+# the rest of the row is loaded on first access (e.g. is_staff for IsAdminUser).
+#
+# To keep deactivated / deleted users locked out, the user's active flag is cached for
+# JWT_USER_STATUS_CACHE_TTL seconds (one cheap lookup per user per TTL, refreshed immediately by the
+# User signals in api/signals.py). Set it to None to skip the check and trust the token alone until it expires.
+# The signals only reach the cache of the process that saved the user: for the lockout to be immediate
+# everywhere the default cache must be shared by the workers (see CACHES in the settings); with the default
+# per-process one, the other workers read the user row again within the TTL.
+#
+# On an edge server (EDGE_SERVING, see api/edge.py) this is also where the request's queries are switched
+# to the user's own file, the user row included.
+
+USER_STATUS_CACHE_KEY = 'auth:user-active:{}'
+
+
+def user_status_cache_ttl():
+    return getattr(settings, 'JWT_USER_STATUS_CACHE_TTL', 60)
+
+
+def set_user_status(user_id, is_active):
+    ttl = user_status_cache_ttl()
+    if ttl is not None:
+        cache.set(USER_STATUS_CACHE_KEY.format(user_id), is_active, ttl)
+
+
+def is_user_active(user_id):
+    ttl = user_status_cache_ttl()
+    if ttl is None:
+        return True
+    key = USER_STATUS_CACHE_KEY.format(user_id)
+    is_active = cache.get(key)
+    record_cache_access('jwt_user_status', is_active is not None)
+    if is_active is None:
+        # Deleted users count as inactive
+        is_active = User.objects.filter(pk=user_id, is_active=True).exists()
+        cache.set(key, is_active, ttl)
+    return is_active
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_FIELD != 'id' or api_settings.CHECK_REVOKE_TOKEN:
+            # These need fields from the user row anyway
+            return super().get_user(validated_token)
+
+        try:
+            user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if edge_serving():
+            use_user_file(user_id)
+
+        if not is_user_active(user_id):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return LazyUser.from_db(DEFAULT_DB_ALIAS, ['id'], [user_id])
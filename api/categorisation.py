@@ -0,0 +1,247 @@
+import re
+import threading
+from collections import OrderedDict, deque
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Category, Expense, SyncTombstone
+from .snapshots import mark_stale
+from .sync import current_change_seq, reserve_change_seqs
+
+# Category suggestions for expenses from their name.
+#
+# The matchers in EXPENSE_CATEGORY_MATCHERS are asked in order and the first suggestion wins:
+#   - UserHistoryMatcher: the category the user last picked for an expense with the same (normalised) name
+#   - KeywordMatcher: global keywords per category, compiled into an Aho-Corasick automaton so a name is
+#     matched against every keyword in a single pass over its words
+# A matcher is any class with a `source` name and `for_user(user_id)` returning a function from a
+# normalised name to a Category id (or None); anything else can be plugged in through the setting.
+
+NON_LETTER_PATTERN = re.compile(r'[\W\d_]+')
+
+DEFAULT_KEYWORDS = {
+    'Food': [
+        'breakfast', 'brunch', 'lunch', 'dinner', 'supper', 'snack', 'snacks', 'meal', 'food', 'coffee', 'kopi',
+        'tea', 'teh', 'bubble tea', 'milo', 'restaurant', 'cafe', 'hawker', 'food court', 'canteen', 'bakery',
+        'groceries', 'grocery', 'supermarket', 'fairprice', 'ntuc', 'cold storage', 'giant', 'sheng siong',
+        'grabfood', 'grab food', 'foodpanda', 'deliveroo', 'mcdonalds', 'mcdonald s', 'kfc', 'burger king',
+        'subway', 'starbucks', 'koi', 'liho', 'gong cha', 'chagee', 'haidilao', 'texas chicken', 'jollibee',
+        'pizza', 'sushi', 'ramen', 'noodles', 'rice', 'chicken rice', 'nasi lemak', 'prata', 'bbt',
+    ],
+    'Transport': [
+        'grab', 'gojek', 'tada', 'ryde', 'uber', 'lyft', 'taxi', 'cab', 'comfortdelgro', 'mrt', 'lrt', 'bus',
+        'train', 'ez link', 'ezlink', 'simplygo', 'transport', 'fare', 'petrol', 'fuel', 'parking', 'erp',
+        'toll', 'flight', 'airfare', 'scooter', 'bike',
+    ],
+    'Shopping': [
+        'shopee', 'lazada', 'amazon', 'taobao', 'qoo', 'uniqlo', 'zara', 'h m', 'cotton on', 'ikea', 'daiso',
+        'muji', 'popular', 'kinokuniya', 'clothes', 'shirt', 'shirts', 'pants', 'shoes', 'dress', 'bag',
+        'book', 'books', 'textbook', 'stationery', 'electronics', 'laptop', 'phone', 'headphones', 'challenger',
+        'courts', 'apple store', 'watsons', 'guardian', 'sephora', 'gift', 'shopping',
+    ],
+}
+
+
+def normalise_name(name):
+    return ' '.join(NON_LETTER_PATTERN.sub(' ', (name or '').lower()).split())
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over words: keywords (one or more words) only ever match whole words, and
+    walking a name's handful of words is much cheaper than walking its characters.
+    """
+
+    def __init__(self, keywords):
+        # keywords: iterable of (keyword, value)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword, value in keywords:
+            words = keyword.split()
+            state = 0
+            for word in words:
+                next_state = self.goto[state].get(word)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][word] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append((len(keyword), value))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(word, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def matches(self, text):
+        # (keyword length, value) for every keyword occurring in text
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for word in text.split():
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            if output[state]:
+                yield from output[state]
+
+
+class CompiledKeywords:
+    def __init__(self, keywords_by_category, category_ids):
+        self.automaton = KeywordAutomaton(
+            (normalise_name(keyword), category_ids[name.lower()])
+            for name, keywords in keywords_by_category.items() if name.lower() in category_ids
+            for keyword in keywords
+        )
+
+    def best_match(self, normalised):
+        # The category with the most matched characters, so "grab food" is Food rather than Transport
+        scores = {}
+        for length, category_id in self.automaton.matches(normalised):
+            scores[category_id] = scores.get(category_id, 0) + length
+        return max(scores, key=scores.get) if scores else None
+
+
+_compiled = None
+_compiled_lock = threading.Lock()
+
+
+def compiled_keywords():
+    global _compiled
+    if _compiled is None:
+        with _compiled_lock:
+            if _compiled is None:
+                category_ids = {name.lower(): pk for pk, name in Category.objects.values_list('id', 'name')}
+                keywords = getattr(settings, 'EXPENSE_CATEGORY_KEYWORDS', None) or DEFAULT_KEYWORDS
+                _compiled = CompiledKeywords(keywords, category_ids)
+    return _compiled
+
+
+def reset_keywords():
+    # Categories changed (see api/signals.py); recompiled on next use
+    global _compiled
+    _compiled = None
+
+
+class KeywordMatcher:
+    source = 'keywords'
+
+    def for_user(self, user_id):
+        return compiled_keywords().best_match
+
+
+class LearnedMapping:
+    # Normalised expense name -> category id of the user's latest expense with that name, kept up to date
+    # incrementally through the user's sync change_seq. A deleted expense (or budget) can have been the one
+    # a name was learned from, so a tombstone since the last update rebuilds the mapping from scratch.
+    def __init__(self):
+        self.categories = {}
+        self.change_seq = 0
+
+    def update(self, user_id, upto):
+        deleted = SyncTombstone.objects.filter(user_id=user_id, model__in=('expenses', 'budgets'),
+                                               change_seq__gt=self.change_seq, change_seq__lte=upto)
+        if self.change_seq and deleted.exists():
+            self.categories, self.change_seq = {}, 0
+        rows = Expense.objects.filter(user_id=user_id, category__isnull=False,
+                                      change_seq__gt=self.change_seq, change_seq__lte=upto) \
+            .order_by('change_seq') \
+            .values_list('name', 'category_id') \
+            .iterator(chunk_size=5000)
+        for name, category_id in rows:
+            key = normalise_name(name)
+            if key:
+                self.categories[key] = category_id
+        self.change_seq = upto
+
+
+class UserHistoryMatcher:
+    source = 'history'
+
+    def __init__(self):
+        self._mappings = OrderedDict()  # user_id -> LearnedMapping, least recently used first
+        self._lock = threading.Lock()
+
+    def mapping(self, user_id):
+        with self._lock:
+            mapping = self._mappings.pop(user_id, None) or LearnedMapping()
+            self._mappings[user_id] = mapping
+            while len(self._mappings) > getattr(settings, 'EXPENSE_CATEGORY_USER_CACHE_SIZE', 1000):
+                self._mappings.popitem(last=False)
+        upto = current_change_seq(user_id)
+        if upto > mapping.change_seq:
+            mapping.update(user_id, upto)
+        return mapping
+
+    def for_user(self, user_id):
+        return self.mapping(user_id).categories.get
+
+
+@lru_cache(maxsize=None)
+def get_matchers():
+    return [import_string(path)() for path in settings.EXPENSE_CATEGORY_MATCHERS]
+
+
+def categorise_names(user_id, names):
+    """
+    Suggested (category id, source) for each name, (None, None) where no matcher has one.
+    Batch mode: the per-user setup (one query for the learned mapping) is done once for all names.
+    """
+    matchers = [(matcher.source, matcher.for_user(user_id)) for matcher in get_matchers()]
+    suggestions = []
+    for name in names:
+        key = normalise_name(name)
+        suggestion = (None, None)
+        if key:
+            for source, match in matchers:
+                category_id = match(key)
+                if category_id is not None:
+                    suggestion = (category_id, source)
+                    break
+        suggestions.append(suggestion)
+    return suggestions
+
+
+def suggest_category(user_id, name):
+    return categorise_names(user_id, [name])[0][0]
+
+
+def recategorise_user(user_id, only_uncategorised=True, chunk_size=2000):
+    # Batch mode, e.g. after an import: applies the suggestions to the user's (uncategorised) expenses.
+    # The expenses are read in chunks and only the changes are kept; they are written once the read is done.
+    expenses = Expense.objects.filter(user_id=user_id)
+    if only_uncategorised:
+        expenses = expenses.filter(category__isnull=True)
+    rows = expenses.values_list('id', 'name', 'category_id').iterator(chunk_size=chunk_size)
+    changed = []  # (expense id, category id)
+    while chunk := list(islice(rows, chunk_size)):
+        suggestions = categorise_names(user_id, [name for _id, name, _category_id in chunk])
+        for (expense_id, _name, current), (category_id, _source) in zip(chunk, suggestions):
+            if category_id is not None and category_id != current:
+                changed.append((expense_id, category_id))
+    if not changed:
+        return 0
+    # bulk_update skips the pre_save signal, so stamp the sync change_seq here
+    now = timezone.now()
+    with transaction.atomic():
+        first = reserve_change_seqs(user_id, len(changed))
+        Expense.objects.bulk_update(
+            [Expense(id=expense_id, category_id=category_id, updated_at=now, change_seq=first + offset)
+             for offset, (expense_id, category_id) in enumerate(changed)],
+            ['category', 'updated_at', 'change_seq'], batch_size=1000,
+        )
+        mark_stale(user_id)
+    return len(changed)
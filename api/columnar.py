@@ -0,0 +1,83 @@
+from array import array
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+
+# Compact columnar representation of a user's expense history, for code paths that have to scan raw
+# rows (exports) rather than let the database aggregate; totals stay in SQL, which converts each
+# amount to the user's home currency (api/currency.py).
+#
+# A model instance costs ~1 KB per expense and a values() dict a few hundred bytes; here a row is
+# 8 (id) + 8 (amount in cents) + 4 (epoch day) + 2 (category code) bytes in typed arrays, plus the
+# name when it's asked for. Category codes are dense small ints assigned per load (category_ids maps
+# a code back to the Category id). Rows are streamed from values_list().iterator(), so the full list of
+# model instances never exists in memory.
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def to_epoch_day(value, tz):
+    return timezone.localtime(value, tz).date().toordinal() - EPOCH_ORDINAL
+
+
+def from_epoch_day(day):
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+
+def cents_to_decimal(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+class ExpenseColumns:
+    def __init__(self, with_names=False):
+        self.ids = array('q')
+        self.amount_cents = array('q')
+        self.days = array('i')
+        self.categories = array('h')
+        self.category_ids = []  # code -> Category id (None for uncategorised)
+        self.names = [] if with_names else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_queryset(cls, queryset, with_names=False, tz=None, chunk_size=5000):
+        tz = tz or timezone.get_current_timezone()
+        columns = cls(with_names=with_names)
+        fields = ['id', 'cents', 'created_at', 'category_id'] + (['name'] if with_names else [])
+        # Amounts are converted to integer cents in SQL, rounding first so 12.34 can't become 1233
+        rows = queryset.annotate(cents=Cast(Round(F('amount') * 100), BigIntegerField())) \
+            .order_by('created_at', 'id') \
+            .values_list(*fields) \
+            .iterator(chunk_size=chunk_size)
+
+        ids, cents, days, categories = columns.ids, columns.amount_cents, columns.days, columns.categories
+        codes = {}
+        for row in rows:
+            ids.append(row[0])
+            cents.append(row[1])
+            days.append(to_epoch_day(row[2], tz))
+            code = codes.get(row[3])
+            if code is None:
+                code = codes[row[3]] = len(columns.category_ids)
+                columns.category_ids.append(row[3])
+            categories.append(code)
+            if with_names:
+                columns.names.append(row[4])
+        return columns
+
+    def nbytes(self):
+        total = sum(column.itemsize * len(column) for column in (self.ids, self.amount_cents, self.days, self.categories))
+        if self.names is not None:
+            total += sum(len(name) for name in self.names)
+        return total
+
+    def rows(self):
+        # (date, category id or None, amount as Decimal, name) per expense, e.g. for exports
+        names = self.names if self.names is not None else [None] * len(self)
+        category_ids = self.category_ids
+        for day, code, cents, name in zip(self.days, self.categories, self.amount_cents, names):
+            yield from_epoch_day(day), category_ids[code], cents_to_decimal(cents), name
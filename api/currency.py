@@ -0,0 +1,214 @@
+import csv
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Max, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Round
+
+from .models import DashboardSnapshot, ExchangeRate, HomeCurrency
+
+# Currencies and FX conversion.
+#
+# Budget, Expense, Income and Goal amounts are stored in their own currency. Analytics are shown in the
+# user's home currency (HomeCurrency, DEFAULT_CURRENCY when not set), converting each amount at the rate
+# of its date. Rates come from a local ExchangeRate table loaded from a file (see load_rates), stored as
+# units of the currency per one FX_BASE_CURRENCY, the way the ECB and most feeds publish them; the rate
+# of a day is the latest one on or before it, so weekends and holidays use the last published rate.
+#
+# Two ways in:
+#   - in_home_currency(): an SQL expression for aggregates, the database looks the rates up (an index
+#     seek per foreign-currency row) so a sum over many rows never comes back to Python
+#   - rate_table(): the whole table in compact arrays in each worker, with memoised conversion factors,
+#     for the serializers converting the rows they already have. Each worker reloads it when the table's
+#     newest updated_at (or row count) changed, checked every FX_RATES_CHECK_SECONDS: the database is
+#     what all workers share, the default cache is per process.
+
+CURRENCY_PATTERN = re.compile(r'^[A-Z]{3}$')
+RATE_SCALE = 10 ** 8  # rates have 8 decimal places, kept in memory as integers
+CENT = Decimal('0.01')
+AMOUNT_FIELD = DecimalField(max_digits=20, decimal_places=2)
+RATE_FIELD = DecimalField(max_digits=18, decimal_places=8)
+
+
+def normalise_currency(code):
+    # ISO 4217 code of a currency we can convert (or the default one), raising ValueError otherwise
+    code = (code or '').strip().upper()
+    if not CURRENCY_PATTERN.match(code):
+        raise ValueError(f"Invalid currency code: {code!r}")
+    if code != settings.DEFAULT_CURRENCY and code not in rate_table().currencies():
+        raise ValueError(f"No exchange rates for {code}")
+    return code
+
+
+class RateTable:
+    def __init__(self, rows):
+        # rows: (currency, day, rate) ordered by currency and day
+        self.days = {}   # currency -> array of date ordinals
+        self.rates = {}  # currency -> array of rates * RATE_SCALE
+        for currency, day, rate in rows:
+            if currency not in self.days:
+                self.days[currency] = array('i')
+                self.rates[currency] = array('q')
+            self.days[currency].append(day.toordinal())
+            self.rates[currency].append(int(rate * RATE_SCALE))
+        self._factors = {}  # (from, to, day) -> factor, memoised: rows share a handful of days and currencies
+        self._lock = threading.Lock()
+
+    def currencies(self):
+        return {settings.FX_BASE_CURRENCY, *self.days}
+
+    def rate(self, currency, day):
+        # Latest rate on or before `day` (the first one for earlier days), None for a currency without rates
+        if currency == settings.FX_BASE_CURRENCY:
+            return Decimal(1)
+        days = self.days.get(currency)
+        if not days:
+            return None
+        index = max(bisect_right(days, day.toordinal()) - 1, 0)
+        return Decimal(self.rates[currency][index]).scaleb(-8)
+
+    def factor(self, source, target, day):
+        key = (source, target, day)
+        factor = self._factors.get(key)
+        if factor is None:
+            source_rate, target_rate = self.rate(source, day), self.rate(target, day)
+            # Same as in SQL: a currency without rates is taken 1:1
+            factor = (target_rate or Decimal(1)) / (source_rate or Decimal(1))
+            with self._lock:
+                if len(self._factors) >= 100000:
+                    self._factors.clear()
+                self._factors[key] = factor
+        return factor
+
+    def convert(self, amount, source, target, day):
+        if amount is None or source == target:
+            return amount
+        return (amount * self.factor(source, target, day)).quantize(CENT)
+
+
+_table = None
+_table_version = None
+_table_checked = None
+_table_lock = threading.Lock()
+
+
+def rates_version():
+    return tuple(ExchangeRate.objects.aggregate(updated=Max('updated_at'), count=Count('id')).values())
+
+
+def rate_table():
+    # Loaded on first use and again whenever the rates in the database changed (see load_rates)
+    global _table, _table_version, _table_checked
+    if _table is not None and time.monotonic() - _table_checked < settings.FX_RATES_CHECK_SECONDS:
+        return _table
+    with _table_lock:
+        if _table is None or time.monotonic() - _table_checked >= settings.FX_RATES_CHECK_SECONDS:
+            version = rates_version()
+            if _table is None or _table_version != version:
+                rows = ExchangeRate.objects.order_by('currency', 'day') \
+                    .values_list('currency', 'day', 'rate') \
+                    .iterator(chunk_size=5000)
+                _table, _table_version = RateTable(rows), version
+            _table_checked = time.monotonic()
+    return _table
+
+
+def rate_expression(currency, day):
+    # The rate of `currency` (a code or an OuterRef) on `day` in SQL, with the same fallbacks as RateTable.rate
+    rates = ExchangeRate.objects.filter(currency=currency)
+    return Coalesce(
+        Subquery(rates.filter(day__lte=day).order_by('-day').values('rate')[:1]),
+        Subquery(rates.order_by('day').values('rate')[:1]),
+        Value(Decimal(1)),
+        output_field=RATE_FIELD,
+    )
+
+
+def in_home_currency(home, amount='amount', currency='currency', date='created_at'):
+    """
+    SQL expression for the row's `amount` in the `home` currency at the rate of its `date`, rounded to
+    cents like RateTable.convert, e.g. Sum(in_home_currency('SGD')). Rows already in the home currency
+    are taken as they are, the rate subqueries only run for the others.
+    """
+    day = OuterRef(date)  # the rate of a day applies from its midnight
+    converted = F(amount) / rate_expression(OuterRef(currency), day)
+    if home != settings.FX_BASE_CURRENCY:
+        converted = converted * rate_expression(home, day)
+    return Case(When(**{currency: home}, then=F(amount)), default=Round(converted, 2), output_field=AMOUNT_FIELD)
+
+
+def home_currency(user_id):
+    # Read from the database each time (a primary key lookup), so a change is seen by every worker at once
+    return HomeCurrency.objects.filter(user_id=user_id).values_list('currency', flat=True).first() \
+        or settings.DEFAULT_CURRENCY
+
+
+def set_home_currency(user_id, currency):
+    # The caller marks the user's dashboard snapshot stale
+    currency = normalise_currency(currency)
+    HomeCurrency.objects.update_or_create(user_id=user_id, defaults={'currency': currency})
+    return currency
+
+
+def read_rates(file):
+    """
+    (currency, day, rate) rows from a CSV rates file, in either layout:
+      - long: a date,currency,rate header and one rate per line
+      - wide: a Date header followed by currency codes and one day per line, like the ECB's
+        eurofxref-hist.csv (empty and N/A cells are skipped)
+    Rates are units of the currency per one FX_BASE_CURRENCY.
+    """
+    reader = csv.reader(file)
+    header = [column.strip() for column in next(reader, [])]
+    lowered = [column.lower() for column in header]
+    long_layout = lowered[:3] == ['date', 'currency', 'rate']
+    if not lowered or lowered[0] != 'date':
+        raise ValueError("the rates file must start with a Date column")
+    for line_number, record in enumerate(reader, start=2):
+        if not record or not record[0].strip():
+            continue
+        try:
+            day = datetime.strptime(record[0].strip(), '%Y-%m-%d').date()
+            pairs = [(record[1], record[2])] if long_layout else zip(header[1:], record[1:])
+            for currency, value in pairs:
+                currency, value = currency.strip().upper(), value.strip()
+                if not currency or value in ('', 'N/A'):
+                    continue
+                if not CURRENCY_PATTERN.match(currency):
+                    raise ValueError(f"invalid currency {currency!r}")
+                rate = Decimal(value)
+                if rate <= 0:
+                    raise ValueError(f"invalid rate {value!r}")
+                yield currency, day, rate
+        except (ValueError, IndexError, InvalidOperation) as e:
+            raise ValueError(f"line {line_number}: {e}")
+
+
+def load_rates(rows, batch_size=5000):
+    # Upserts the rates, stamped so every worker reloads its rate table, and has the dashboards recomputed
+    global _table_checked
+    count = 0
+    batch = []
+    with transaction.atomic():
+        for currency, day, rate in rows:
+            batch.append(ExchangeRate(currency=currency, day=day, rate=rate))
+            if len(batch) >= batch_size:
+                count += _upsert(batch)
+                batch = []
+        if batch:
+            count += _upsert(batch)
+        DashboardSnapshot.objects.mark_stale()
+    _table_checked = float('-inf')  # this worker checks on its next use
+    return count
+
+
+def _upsert(batch):
+    ExchangeRate.objects.bulk_create(batch, update_conflicts=True, unique_fields=['currency', 'day'], update_fields=['rate', 'updated_at'])
+    return len(batch)
@@ -0,0 +1,195 @@
+from datetime import date
+
+from django.db.models import Sum
+from django.db.models.functions import ExtractMonth, ExtractWeek
+from django.utils.timezone import now
+
+from .currency import home_currency, in_home_currency, rate_table
+from .models import Budget, Expense, Income, Goal
+from .timebuckets import bucket_totals, average_per_bucket, bucket_start, previous_bucket, get_timezone
+
+# Computations behind the dashboard (analytics page, budget utilisation and goal progress).
+# Kept free of request handling so they can run both inside a view and in the snapshot workers.
+# Amounts are summed in the user's home currency, converted by the database (see api/currency.py).
+
+
+def spent_per_budget(expenses, home):
+    # Total of each budget's expenses in the home currency, one grouped query
+    return dict(expenses.values('budget_id').annotate(total=Sum(in_home_currency(home))).values_list('budget_id', 'total'))
+
+
+def budget_amount(budget, home, today):
+    # A budget is a limit for now, so it is converted at today's rate
+    return rate_table().convert(budget['amount'], budget['currency'], home, today)
+
+
+def compute_analytics(user, month, year):
+    home = home_currency(user.id)
+    amount = in_home_currency(home)
+
+    # 1. Most spent on category for the selected month
+    most_spent_category = Expense.objects.filter(user=user, created_at__year=year, created_at__month=month) \
+        .values('category__name') \
+        .annotate(total_spent=Sum(amount)) \
+        .order_by('-total_spent') \
+        .first()
+    
+    # 2. Least spent on category for the selected month
+    least_spent_category = Expense.objects.filter(user=user, created_at__year=year, created_at__month=month, category__isnull=False) \
+        .values('category__name') \
+        .annotate(total_spent=Sum(amount)) \
+        .order_by('total_spent') \
+        .first()
+
+    # 3. Average monthly spent (mean of the monthly totals over the last 12 months, not the mean expense)
+    tz = get_timezone()
+    today = now().astimezone(tz).date()
+    last_12_months = bucket_totals(Expense.objects.filter(user=user), 'month',
+                                   bucket_start(today, 'month').replace(year=today.year - 1), today, tz, amount_field=amount)[1:]
+    average_monthly_spent = average_per_bucket(last_12_months)
+
+    # 3a. Selected month compared against the previous month (works across year boundaries)
+    selected_month = date(year, month, 1)
+    month_comparison = bucket_totals(Expense.objects.filter(user=user), 'month',
+                                     previous_bucket(selected_month, 'month'), selected_month, tz, amount_field=amount)
+
+    # 4. Net income (total income - total expenses) for the selected month
+    total_income_selected_month = Income.objects.filter(user=user, created_at__year=year, created_at__month=month) \
+        .aggregate(total_income=Sum(amount))['total_income'] or 0
+
+    total_expenses_selected_month = Expense.objects.filter(user=user, created_at__year=year, created_at__month=month) \
+        .aggregate(total_expenses=Sum(amount))['total_expenses'] or 0
+
+    net_income_selected_month = total_income_selected_month - total_expenses_selected_month
+
+    # Additional Statistics
+    # 5. Spending per Month
+    spending_per_month = Expense.objects.filter(user=user) \
+        .annotate(month=ExtractMonth('created_at')) \
+        .values('month') \
+        .annotate(total_spent=Sum(amount)) \
+        .order_by('month')
+
+    # 4a. Net income (total income - total expenses) per month
+    total_income_per_month = Income.objects.filter(user=user) \
+        .annotate(month=ExtractMonth('created_at')) \
+        .values('month') \
+        .annotate(total_income=Sum(amount)) \
+        .order_by('month')
+
+    # Create a dictionary for easy lookup of expenses by month
+    expenses_dict = {expense['month']: expense['total_spent'] for expense in spending_per_month}
+
+    net_income_per_month = []
+    for income in total_income_per_month:
+        month_income = income['month']
+        total_income = income['total_income']
+        total_expenses = expenses_dict.get(month_income, 0)
+        net_income_per_month.append({
+            'month': month_income,
+            'net_income': total_income - total_expenses
+        })
+
+    # 6. Spending by Category for the selected month
+    spending_by_category = Expense.objects.filter(user=user, created_at__year=year, created_at__month=month) \
+        .values('category__name') \
+        .annotate(total_spent=Sum(amount)) \
+        .order_by('-total_spent')
+    
+    # 7. Total spending for the selected month
+    total_spent_selected_month = Expense.objects.filter(
+        user=user,
+        created_at__year=year, 
+        created_at__month=month
+    ).aggregate(total_spent=Sum(amount))['total_spent']
+
+    # 8. Spending by Category per Month
+    spending_by_category_per_month = Expense.objects.filter(user=user) \
+        .annotate(month=ExtractMonth('created_at')) \
+        .values('category__name', 'month') \
+        .annotate(total_spent=Sum(amount)) \
+        .order_by('category__name', 'month')
+    
+    # 9. Number of Budgets Exceeded for the Selected Month
+    budgets = list(Budget.objects.filter(user=user, created_at__year=year, created_at__month=month)
+                   .values('id', 'amount', 'currency'))
+    spent = spent_per_budget(Expense.objects.filter(budget__in=[budget['id'] for budget in budgets]), home)
+    budgets_exceeded = sum(1 for budget in budgets if (spent.get(budget['id']) or 0) > budget_amount(budget, home, today))
+
+    # 10. Weekly Expenses for the Selected Month
+    weekly_expenses = Expense.objects.filter(user=user, created_at__year=year, created_at__month=month) \
+        .annotate(week=ExtractWeek('created_at')) \
+        .values('week') \
+        .annotate(total_spent=Sum(amount)) \
+        .order_by('week')
+
+    return {
+        'currency': home,
+        'most_spent_category': most_spent_category,
+        'least_spent_category': least_spent_category,
+        'average_monthly_spent': average_monthly_spent,
+        'previous_month_total': month_comparison[0]['total'],
+        'month_over_month_change': month_comparison[-1]['change'],
+        'month_over_month_change_pct': month_comparison[-1]['change_pct'],
+        'net_income_current_month': net_income_selected_month,
+        'net_income_per_month': list(net_income_per_month),
+        'spending_per_month': list(spending_per_month),
+        'spending_by_category': list(spending_by_category),
+        'total_spent_current_month': total_spent_selected_month,
+        'spending_by_category_per_month': list(spending_by_category_per_month),
+        'budgets_exceeded': budgets_exceeded,
+        'weekly_expenses': list(weekly_expenses)
+    }
+
+
+def budget_utilisation(user):
+    home = home_currency(user.id)
+    today = now().date()
+    budgets = Budget.objects.filter(user=user) \
+        .values('id', 'name', 'amount', 'currency') \
+        .order_by('id')
+    spent = spent_per_budget(Expense.objects.filter(user=user), home)
+    results = []
+    for budget in budgets:
+        amount = budget_amount(budget, home, today)
+        total_spent = spent.get(budget['id']) or 0
+        results.append({
+            'id': budget['id'],
+            'name': budget['name'],
+            'amount': budget['amount'],
+            'currency': budget['currency'],
+            'home_amount': amount,
+            'total_spent': total_spent,
+            'utilisation_pct': round(total_spent / amount * 100, 2) if amount else None,
+        })
+    return results
+
+
+def goal_progress(user):
+    # Both amounts of a goal are in its own currency, the percentage doesn't depend on it
+    goals = Goal.objects.filter(user=user) \
+        .values('id', 'name', 'target_amount', 'current_amount', 'currency') \
+        .order_by('id')
+    return [{
+        'id': goal['id'],
+        'name': goal['name'],
+        'target_amount': goal['target_amount'],
+        'current_amount': goal['current_amount'],
+        'currency': goal['currency'],
+        'progress_pct': round(goal['current_amount'] / goal['target_amount'] * 100, 2) if goal['target_amount'] else None,
+        'achieved': goal['current_amount'] >= goal['target_amount'],
+    } for goal in goals]
+
+
+def compute_dashboard(user, month=None, year=None):
+    today = now().astimezone(get_timezone()).date()
+    month = month or today.month
+    year = year or today.year
+    return {
+        'month': month,
+        'year': year,
+        'currency': home_currency(user.id),
+        'analytics': compute_analytics(user, month, year),
+        'budgets': budget_utilisation(user),
+        'goals': goal_progress(user),
+    }
@@ -0,0 +1,248 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .fingerprints import NEAR_DUPLICATE_SIMILARITY, normalise_text, shingles, similarity
+from .models import DiscountBand, StudentDiscount
+from .serializers import StudentDiscountValuesSerializer
+from .telemetry import record_cache_access
+from .timebuckets import get_timezone, local_midnight
+
+# Ingestion of scraped channel messages into the student discount feed.
+#
+# Every message is normalised and fingerprinted (api/fingerprints.py) and collapsed into the entry it
+# duplicates: the same normalised text (content_hash) or a near-duplicate found through the MinHash band
+# keys. A repost that is newer than the entry replaces its text, date and links, so the feed keeps one
+# entry per deal showing the latest version of it. Ingesting the same messages again changes nothing.
+#
+# Messages are handled in batches: one query each for the known message ids, the exact hashes and the
+# band keys of the whole batch, then bulk inserts and updates.
+
+
+class Entry:
+    # A feed entry during ingestion, either already in the database or about to be created
+    def __init__(self, discount, shingle_set, keys):
+        self.discount = discount
+        self.shingles = shingle_set
+        self.keys = keys
+        self.is_new = discount.pk is None
+        self.changed = False
+
+
+def build_discount(message):
+    date = message.get('date') or timezone.now()
+    if isinstance(date, str):
+        date = parse_datetime(date)
+    discount = StudentDiscount(
+        message_id=message.get('id', 0),
+        channel_id=(message.get('peer_id') or {}).get('channel_id', 0),
+        message=message.get('message') or '',
+        date=date,
+    )
+    discount.extract_links()
+    return discount
+
+
+def ingest_messages(messages, batch_size=500):
+    stats = {'created': 0, 'updated': 0, 'duplicates': 0, 'skipped': 0}
+    for start in range(0, len(messages), batch_size):
+        with transaction.atomic():
+            _ingest_batch(messages[start:start + batch_size], stats)
+    if stats['created'] or stats['updated']:
+        bump_feed_version()
+    return stats
+
+
+def _ingest_batch(messages, stats):
+    known_ids = set(StudentDiscount.objects.filter(
+        message_id__in=[message.get('id', 0) for message in messages],
+    ).values_list('message_id', flat=True))
+
+    incoming = []
+    for message in messages:
+        if message.get('id', 0) in known_ids:
+            stats['skipped'] += 1
+            continue
+        discount = build_discount(message)
+        shingle_set, keys = discount.fingerprint()
+        if not keys:
+            # Service messages (joins, pins) and link-only posts
+            stats['skipped'] += 1
+            continue
+        incoming.append(Entry(discount, shingle_set, keys))
+    if not incoming:
+        return
+    # Oldest first, so a later repost updates the entry rather than the other way round
+    incoming.sort(key=lambda entry: entry.discount.date)
+
+    # Existing entries matching any message of the batch exactly or through a band key
+    entries = []
+    by_hash = {}
+    by_key = defaultdict(list)
+    band_rows = DiscountBand.objects.filter(key__in={key for entry in incoming for key in entry.keys}) \
+        .values_list('discount_id', 'key')
+    candidate_keys = defaultdict(list)
+    for discount_id, key in band_rows:
+        candidate_keys[discount_id].append(key)
+    candidates = StudentDiscount.objects.filter(content_hash__in={entry.discount.content_hash for entry in incoming}) \
+        | StudentDiscount.objects.filter(pk__in=candidate_keys)
+    for discount in candidates:
+        entry = Entry(discount, shingles(normalise_text(discount.message)), candidate_keys.get(discount.pk, []))
+        entries.append(entry)
+        by_hash.setdefault(discount.content_hash, entry)
+        for key in entry.keys:
+            by_key[key].append(entry)
+
+    for entry in incoming:
+        match = by_hash.get(entry.discount.content_hash) or _near_duplicate(entry, by_key)
+        if match is None:
+            entries.append(entry)
+            by_hash[entry.discount.content_hash] = entry
+            for key in entry.keys:
+                by_key[key].append(entry)
+            continue
+
+        stats['duplicates'] += 1
+        if entry.discount.date > match.discount.date:
+            current, latest = match.discount, entry.discount
+            for field in ('message_id', 'channel_id', 'message', 'date', 'channel_link', 'discount_link', 'content_hash'):
+                setattr(current, field, getattr(latest, field))
+            match.shingles, match.keys, match.changed = entry.shingles, entry.keys, True
+            by_hash[current.content_hash] = match
+            for key in entry.keys:
+                by_key[key].append(match)
+
+    created = [entry for entry in entries if entry.is_new]
+    updated = [entry for entry in entries if entry.changed and not entry.is_new]
+
+    StudentDiscount.objects.bulk_create([entry.discount for entry in created])
+    StudentDiscount.objects.bulk_update(
+        [entry.discount for entry in updated],
+        ['message_id', 'channel_id', 'message', 'date', 'channel_link', 'discount_link', 'content_hash'],
+    )
+    DiscountBand.objects.filter(discount__in=[entry.discount for entry in updated]).delete()
+    DiscountBand.objects.bulk_create([
+        DiscountBand(discount=entry.discount, key=key) for entry in [*created, *updated] for key in entry.keys
+    ])
+    stats['created'] += len(created)
+    stats['updated'] += len(updated)
+
+
+def _near_duplicate(entry, by_key):
+    best, best_similarity = None, NEAR_DUPLICATE_SIMILARITY
+    seen = set()
+    for key in entry.keys:
+        for candidate in by_key.get(key, ()):
+            if id(candidate) in seen:
+                continue
+            seen.add(id(candidate))
+            score = similarity(entry.shingles, candidate.shingles)
+            if score >= best_similarity:
+                best, best_similarity = candidate, score
+    return best
+
+
+# The feed (/student-discount/) is the same for every user, so its responses are cached in the shared
+# Django cache for DISCOUNT_FEED_CACHE_SECONDS, keyed by the parsed filters, and sent with a public
+# Cache-Control so a CDN or reverse proxy can serve it too. Ingesting new discounts bumps the feed
+# version in the cache key, which drops the cached pages at once where the cache is shared by all workers.
+
+FEED_VERSION_KEY = 'discount-feed:version'
+
+
+def feed_version():
+    return cache.get_or_set(FEED_VERSION_KEY, 1, None)
+
+
+def bump_feed_version():
+    try:
+        cache.incr(FEED_VERSION_KEY)
+    except ValueError:
+        cache.set(FEED_VERSION_KEY, 2, None)
+
+
+def parse_feed_filters(params):
+    """
+    Filters of the discount feed from the query string, raising ValueError for bad values:
+    since / until (YYYY-MM-DD, inclusive), channel (comma-separated channel ids),
+    has_link (true / false), limit (DISCOUNT_FEED_PAGE_SIZE when not given, at most DISCOUNT_FEED_MAX_LIMIT)
+    and offset.
+    """
+    filters = {}
+    for name in ('since', 'until'):
+        if params.get(name):
+            filters[name] = datetime.strptime(params[name], '%Y-%m-%d').date()
+    if params.get('channel'):
+        filters['channel'] = sorted({int(channel) for channel in params['channel'].split(',') if channel.strip()})
+    if params.get('has_link'):
+        has_link = params['has_link'].lower()
+        if has_link not in ('true', 'false'):
+            raise ValueError("has_link must be true or false")
+        filters['has_link'] = has_link == 'true'
+    limit = int(params['limit']) if params.get('limit') else settings.DISCOUNT_FEED_PAGE_SIZE
+    filters['limit'] = min(limit, settings.DISCOUNT_FEED_MAX_LIMIT)
+    if params.get('offset'):
+        filters['offset'] = int(params['offset'])
+    if filters['limit'] < 0 or filters.get('offset', 0) < 0:
+        raise ValueError("limit and offset must not be negative")
+    return filters
+
+
+def filter_feed(filters, with_channel=True):
+    tz = get_timezone()
+    queryset = StudentDiscount.objects.all()
+    if 'since' in filters:
+        queryset = queryset.filter(date__gte=local_midnight(filters['since'], tz))
+    if 'until' in filters:
+        queryset = queryset.filter(date__lt=local_midnight(filters['until'] + timedelta(days=1), tz))
+    if with_channel and 'channel' in filters:
+        queryset = queryset.filter(channel_id__in=filters['channel'])
+    if 'has_link' in filters:
+        # Same condition as the partial index on linked discounts; the link is '' or NULL when missing
+        linked = Q(discount_link__gt='')
+        queryset = queryset.filter(linked if filters['has_link'] else ~linked)
+    return queryset
+
+
+def feed_page(filters):
+    queryset = filter_feed(filters).order_by('-date', '-id')
+    offset = filters.get('offset', 0)
+    queryset = queryset[offset:offset + filters['limit']]
+    return StudentDiscountValuesSerializer(queryset).data
+
+
+def feed_facets(filters):
+    # Counts per channel in one grouped query, under every filter except the channel one (so the
+    # client can show how many discounts picking another channel would give)
+    rows = filter_feed(filters, with_channel=False) \
+        .values('channel_id') \
+        .annotate(count=Count('id'), with_link=Count('id', filter=Q(discount_link__gt=''))) \
+        .order_by('-count', 'channel_id')
+    channels = list(rows)
+    return {
+        'total': sum(row['count'] for row in channels),
+        'with_link': sum(row['with_link'] for row in channels),
+        'channels': channels,
+    }
+
+
+def cached_feed(kind, filters):
+    # kind is 'page' or 'facets' (the same for every page)
+    if kind == 'facets':
+        filters = {name: value for name, value in filters.items() if name not in ('limit', 'offset')}
+    key = f'discount-feed:{feed_version()}:{kind}:' + urlencode(sorted(
+        (name, ','.join(map(str, value)) if isinstance(value, list) else value) for name, value in filters.items()
+    ))
+    data = cache.get(key)
+    record_cache_access('discount_feed', data is not None)
+    if data is None:
+        data = feed_page(filters) if kind == 'page' else feed_facets(filters)
+        cache.set(key, data, settings.DISCOUNT_FEED_CACHE_SECONDS)
+    return data
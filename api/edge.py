@@ -0,0 +1,252 @@
+import functools
+import math
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import ConnectionHandler
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import Budget, Category, DashboardSnapshot, ExchangeRate, Expense, Goal, HomeCurrency, Income
+from .snapshots import get_snapshot, snapshot_payload, snapshots_enabled
+from .writequeue import coalescing_enabled, flush, read_snapshot
+
+# Per-user SQLite files for read-only ("edge") servers.
+#
+# `manage.py export_edge_files` writes one small SQLite file per active user with their budgets, expenses,
+# income, goals, home currency and dashboard rollup (their DashboardSnapshot row: the primary's when it is
+# up to date, computed otherwise), plus a common.sqlite3 with what all users share (categories, exchange
+# rates). Users are spread over a process pool; each file is written next to its final path and renamed
+# into place, so a server never opens a half-written one.
+#
+# The files have the models' own tables (from Django's schema editor), so a server started with
+# EDGE_SERVING runs the ordinary views on them. Its only database is common.sqlite3; once the request's JWT
+# names the user (api/authentication.py), the request's connection is switched to the user's file with
+# common.sqlite3 attached, opened read-only, immutable and memory-mapped. Nothing reaches the main database,
+# so edge servers can be added at will; they serve the data as of the last export, and refuse writes and
+# the endpoints the files can't answer (sync, export, imports...).
+
+SERVED_URL_NAMES = {
+    'budget-list', 'budget-detail', 'expense-list', 'expense-detail', 'income-list', 'goal-list-create',
+    'goal-detail', 'category-list', 'analytics', 'analytics-buckets', 'dashboard', 'currency-settings', 'metrics',
+}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def edge_serving():
+    return getattr(settings, 'EDGE_SERVING', False)
+
+
+def common_file(directory=None):
+    return Path(directory or settings.EDGE_FILES_DIR) / 'common.sqlite3'
+
+
+def user_file(user_id, directory=None):
+    # A thousand users per directory
+    return Path(directory or settings.EDGE_FILES_DIR) / 'users' / str(user_id // 1000) / f'{user_id}.sqlite3'
+
+
+def read_only_uri(path):
+    # immutable: a file never changes once renamed into place, so SQLite skips locking it altogether
+    return f'file:{path}?mode=ro&immutable=1'
+
+
+class UserFileMissing(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "This user's data is not on this server yet."
+    default_code = 'edge_file_missing'
+
+
+def use_user_file(user_id):
+    # The rest of the request reads the user's file
+    path = user_file(user_id)
+    if not path.exists():
+        raise UserFileMissing()
+    _switch_to(read_only_uri(path))
+
+
+def use_common_file():
+    _switch_to(read_only_uri(common_file()))
+
+
+def _switch_to(name):
+    # The connection object is this thread's own, but its settings dict is shared with the other threads':
+    # replaced, not changed. The next query opens the new file.
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.settings_dict['NAME'] != name:
+        connection.close()
+        connection.settings_dict = {**connection.settings_dict, 'NAME': name}
+
+
+def configure_connection(connection):
+    # On connection_created (api/signals.py)
+    common = read_only_uri(common_file())
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA mmap_size = {int(settings.EDGE_MMAP_BYTES)}')
+        if connection.settings_dict['NAME'] != common:
+            # The user's file has no category or rate tables, queries find them here
+            cursor.execute('ATTACH DATABASE %s AS common', [common])
+
+
+class EdgeServingMiddleware:
+    # Installed when EDGE_SERVING is on: only the GETs the files can answer reach the views
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            use_common_file()  # the thread's next request starts without a user
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in SAFE_METHODS:
+            return JsonResponse({'error': 'This server is read-only'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        if request.resolver_match.url_name not in SERVED_URL_NAMES:
+            return JsonResponse({'error': 'Not served by this server'}, status=status.HTTP_404_NOT_FOUND)
+        return None
+
+
+def file_connection(path):
+    # A Django connection to a SQLite file of our own, from a handler of its own (outside settings.DATABASES)
+    return ConnectionHandler({DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(path)}})[DEFAULT_DB_ALIAS]
+
+
+def model_rows(queryset):
+    return list(queryset.values_list(*[field.attname for field in queryset.model._meta.concrete_fields]))
+
+
+def instance_row(instance):
+    return [getattr(instance, field.attname) for field in instance._meta.concrete_fields]
+
+
+@functools.lru_cache
+def schema_sql(models):
+    # The CREATE TABLE / INDEX statements of `models` (a tuple), generated once per process. Collected rather
+    # than run: the schema editor would open its transaction on the `default` alias of the main database.
+    connection = file_connection(':memory:')
+    with connection.schema_editor(collect_sql=True, atomic=False) as editor:
+        for model in models:
+            editor.create_model(model)
+    connection.close()
+    return editor.collected_sql
+
+
+def write_file(path, tables):
+    # tables: (model, rows of its concrete fields' values). Returns the size of the file.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    tmp.unlink(missing_ok=True)
+    connection = file_connection(tmp)
+    try:
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            connection.disable_constraint_checking()  # the categories are in common.sqlite3
+            cursor.execute('PRAGMA journal_mode = OFF')  # a new file, only renamed into place once complete
+            cursor.execute('BEGIN')
+            for statement in schema_sql(tuple(model for model, _ in tables)):
+                cursor.execute(statement)
+            for model, rows in tables:
+                fields = model._meta.concrete_fields
+                sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                    qn(model._meta.db_table), ', '.join(qn(field.column) for field in fields), ', '.join(['%s'] * len(fields)),
+                )
+                cursor.executemany(sql, [[field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+                                         for row in rows])
+            cursor.execute('COMMIT')
+    finally:
+        connection.close()
+    os.replace(tmp, path)
+    return path.stat().st_size
+
+
+def user_tables(user_id):
+    # What the served endpoints read of the user, and their dashboard for the current month
+    user = User.objects.get(pk=user_id)
+    user.set_unusable_password()  # edge servers only check tokens
+    # The primary's snapshot when nothing was written since it was computed, else computed now
+    payload, rollup = get_snapshot(user) if snapshots_enabled() else (None, None)
+    if rollup is None or rollup.stale_since is not None:
+        start = time.perf_counter()
+        payload = snapshot_payload(user)
+        rollup = DashboardSnapshot(user_id=user_id, payload=payload, computed_at=timezone.now(),
+                                   compute_ms=(time.perf_counter() - start) * 1000)
+    return [
+        (User, [instance_row(user)]),
+        (HomeCurrency, model_rows(HomeCurrency.objects.filter(user_id=user_id))),
+        (Budget, model_rows(Budget.objects.filter(user_id=user_id))),
+        (Expense, model_rows(Expense.objects.filter(user_id=user_id))),
+        (Income, model_rows(Income.objects.filter(user_id=user_id))),
+        (Goal, model_rows(Goal.objects.filter(user_id=user_id))),
+        (DashboardSnapshot, [instance_row(rollup)]),
+    ]
+
+
+def export_user(user_id, directory=None):
+    with read_snapshot():  # the tables and the rollup as of one moment
+        tables = user_tables(user_id)
+    return write_file(user_file(user_id, directory), tables)
+
+
+def export_common(directory=None):
+    return write_file(common_file(directory), [
+        (Category, model_rows(Category.objects.order_by('id'))),
+        (ExchangeRate, model_rows(ExchangeRate.objects.order_by('currency', 'day'))),
+    ])
+
+
+def _export_users_in_worker(user_ids, directory):
+    try:
+        return sum(export_user(user_id, directory) for user_id in user_ids)
+    finally:
+        connections.close_all()
+
+
+def remove_other_files(directory, user_ids):
+    # Files of users deleted or deactivated since the last export
+    removed = 0
+    for path in (Path(directory) / 'users').glob('*/*.sqlite3'):
+        if int(path.stem) not in user_ids:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def export_edge_files(directory=None, workers=1, user_ids=None):
+    """
+    Writes common.sqlite3 and the files of `user_ids` into `directory`, or of every active user (removing
+    the files of the others). The users are split into batches spread over `workers` forked processes:
+    most of the time goes into the dashboard rollups and the SQLite writes, in Python, whatever the main
+    database. Returns (users, bytes written).
+    """
+    directory = Path(directory or settings.EDGE_FILES_DIR)
+    if coalescing_enabled():
+        flush()  # the writes still queued go into the files
+    size = export_common(directory)
+    everyone = user_ids is None
+    if everyone:
+        user_ids = list(User.objects.filter(is_active=True).order_by('id').values_list('id', flat=True))
+    batch_size = max(1, math.ceil(len(user_ids) / (workers * 4)))
+    batches = [user_ids[i:i + batch_size] for i in range(0, len(user_ids), batch_size)]
+
+    if workers > 1 and len(batches) > 1:
+        # Imported here rather than at module level, only the management command normally gets here
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            size += sum(executor.map(_export_users_in_worker, batches, [directory] * len(batches)))
+    else:
+        size += sum(export_user(user_id, directory) for user_id in user_ids)
+
+    if everyone:
+        remove_other_files(directory, set(user_ids))
+    return len(user_ids), size
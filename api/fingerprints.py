@@ -0,0 +1,79 @@
+import hashlib
+import re
+import unicodedata
+
+# Content fingerprints for the student discount feed (see api/discounts.py).
+#
+# The channels repost the same deal, often with small edits (another date line, different emoji,
+# a new short link), so a message gets two fingerprints:
+#   - content_hash: a hash of the normalised text, for exact reposts
+#   - MinHash band keys, for near-duplicates: the Jaccard similarity of two messages' word pairs
+#     is estimated by MinHash, and the signature is cut into bands (locality-sensitive hashing).
+#     Messages with a Jaccard similarity of 0.7 share at least one band key ~96% of the time, messages
+#     below 0.1 almost never do, so the candidates are found with one indexed `key IN (...)` lookup
+#     however big the table gets, and only those are compared exactly.
+
+SHINGLE_SIZE = 2
+MINHASH_BANDS = 8
+MINHASH_ROWS = 3
+NEAR_DUPLICATE_SIMILARITY = 0.7
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# Fixed (a, b) pairs for the hash permutations; they must never change once keys are stored
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(b'a%d' % i, digest_size=8).digest(), 'big') % (_MERSENNE_PRIME - 1) + 1,
+     int.from_bytes(hashlib.blake2b(b'b%d' % i, digest_size=8).digest(), 'big') % _MERSENNE_PRIME)
+    for i in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+
+URL_PATTERN = re.compile(r'(https?://|www\.|bit\.ly/|t\.me/)\S+', re.IGNORECASE)
+NON_WORD_PATTERN = re.compile(r'[^\w]+')
+LINK_TRAILING_CHARS = '.,;:!?)]}>\'"*'
+
+
+def normalise_text(text):
+    # Lowercased words only: links, emoji, punctuation and spacing don't make a message different
+    text = unicodedata.normalize('NFKC', text or '')
+    text = URL_PATTERN.sub(' ', text).lower()
+    return ' '.join(NON_WORD_PATTERN.sub(' ', text).split())
+
+
+def normalise_link(link):
+    # Drop punctuation and invisible characters picked up from the end of the sentence; the path of
+    # a short link is case-sensitive so only the host is lowercased
+    if not link:
+        return link
+    link = ''.join(char for char in link if unicodedata.category(char) not in ('Cf', 'Cc', 'So', 'Sk'))
+    link = link.rstrip(LINK_TRAILING_CHARS)
+    host, slash, path = link.partition('/')
+    return host.lower() + slash + path
+
+
+def content_hash(normalised):
+    return hashlib.blake2b(normalised.encode(), digest_size=16).hexdigest()
+
+
+def shingles(normalised):
+    words = normalised.split()
+    if len(words) <= SHINGLE_SIZE:
+        return {normalised}
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def similarity(a, b):
+    # Exact Jaccard similarity of two shingle sets
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def minhash_band_keys(shingle_set):
+    # One signed 64-bit key per band (stored in a BigIntegerField)
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), 'big')
+              for shingle in shingle_set]
+    signature = [min((a * h + b) % _MERSENNE_PRIME & _MAX_HASH for h in hashes) for a, b in _PERMUTATIONS]
+    keys = []
+    for band in range(MINHASH_BANDS):
+        rows = signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]
+        digest = hashlib.blake2b(repr((band, rows)).encode(), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'big', signed=True))
+    return keys
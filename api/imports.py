@@ -0,0 +1,314 @@
+import csv
+import hashlib
+import io
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .categorisation import categorise_names, normalise_name
+from .models import Budget, Expense, Income
+from .snapshots import mark_stale
+from .sync import reserve_change_seqs
+from .timebuckets import get_timezone, local_midnight
+
+# Bank statement import (CSV or OFX) into a budget's expenses and the user's income.
+#
+# The file is parsed as a stream, one statement line at a time, and written in batches of
+# IMPORT_BATCH_SIZE: each batch is checked against earlier imports with one indexed
+# `import_hash IN (...)` query and inserted with one executemany, so memory stays bounded by the batch size
+# and a 200k-row statement is a few hundred queries. Debits become expenses of the chosen budget
+# (categorised in batch, see api/categorisation.py), credits become income.
+#
+# import_hash is a hash of (date, amount, normalised name) plus the occurrence of that triple in the file,
+# so importing an overlapping statement again skips the rows already imported while two identical
+# coffees on the same day are still two expenses. Expenses and income entered by hand have no import_hash:
+# those of the batch's days are counted by (date, amount, normalised name) instead, and the n-th statement
+# line of a triple is skipped when the user entered it at least n times.
+
+OCCURRENCE_WINDOW_DAYS = 7
+OFX_TAG_PATTERN = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+AMOUNT_CLEANUP_PATTERN = re.compile(r'[^\d.,()+-]')
+
+
+class StatementError(ValueError):
+    pass
+
+
+class StatementRow:
+    __slots__ = ('line', 'day', 'amount', 'name')
+
+    def __init__(self, line, day, amount, name):
+        self.line = line
+        self.day = day
+        self.amount = amount  # negative for money going out
+        self.name = name
+
+
+def parse_amount(value):
+    value = AMOUNT_CLEANUP_PATTERN.sub('', value or '').replace(',', '')
+    negative = value.startswith('(') and value.endswith(')')
+    try:
+        amount = Decimal(value.strip('()'))
+    except InvalidOperation:
+        raise ValueError(f"invalid amount {value!r}")
+    return -amount if negative else amount
+
+
+def read_csv(stream, columns=None, date_format=None):
+    """
+    Yield StatementRows from a CSV statement with a header row. `columns` maps date, name and either
+    amount (signed) or debit / credit (both positive) to the header names of the file.
+    Unparseable rows yield a ValueError instead, so the caller can count and report them.
+    """
+    columns = columns or settings.IMPORT_CSV_COLUMNS
+    date_format = date_format or settings.IMPORT_CSV_DATE_FORMAT
+    reader = csv.DictReader(stream)
+    missing = [column for key, column in columns.items() if key in ('date', 'name') and column not in (reader.fieldnames or [])]
+    if missing or not ('amount' in columns or 'debit' in columns or 'credit' in columns):
+        raise StatementError(f"CSV is missing the columns {', '.join(missing) or 'amount'} (found: {', '.join(reader.fieldnames or [])})")
+
+    days = {}  # statements have many rows per day, parse each date once
+    for record in reader:
+        try:
+            text = record[columns['date']]
+            day = days.get(text)
+            if day is None:
+                day = days[text] = datetime.strptime(text.strip(), date_format).date()
+            if 'amount' in columns:
+                amount = parse_amount(record[columns['amount']])
+            else:
+                debit = record.get(columns.get('debit'), '') or ''
+                credit = record.get(columns.get('credit'), '') or ''
+                amount = parse_amount(credit) if credit.strip() else -parse_amount(debit)
+            yield StatementRow(reader.line_num, day, amount, (record[columns['name']] or '').strip()[:255])
+        except (ValueError, KeyError, TypeError) as e:
+            yield ValueError(f"line {reader.line_num}: {e}")
+
+
+def read_ofx(stream):
+    # OFX 1.x (SGML, closing tags optional) and 2.x (XML) alike: the STMTTRN blocks are scanned tag by
+    # tag, reading the file in chunks
+    transaction_fields, count, buffer = None, 0, ''
+    while True:
+        chunk = stream.read(64 * 1024)
+        buffer += chunk
+        # Keep a possibly incomplete tag at the end of the buffer for the next chunk
+        cut = len(buffer) if not chunk else buffer.rfind('<')
+        for closing, tag, value in OFX_TAG_PATTERN.findall(buffer[:cut]):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if not closing:
+                    transaction_fields = {}
+                elif transaction_fields is not None:
+                    count += 1
+                    yield _ofx_row(count, transaction_fields)
+                    transaction_fields = None
+            elif transaction_fields is not None and not closing:
+                transaction_fields[tag] = value.strip()
+        buffer = buffer[cut:]
+        if not chunk:
+            return
+
+
+def _ofx_row(number, fields):
+    try:
+        day = datetime.strptime(fields['DTPOSTED'][:8], '%Y%m%d').date()
+        name = fields.get('NAME') or fields.get('MEMO') or fields.get('PAYEE') or ''
+        return StatementRow(number, day, parse_amount(fields['TRNAMT']), name[:255])
+    except (ValueError, KeyError) as e:
+        return ValueError(f"transaction {number}: {e}")
+
+
+def import_hash(day, amount, normalised_name, occurrence):
+    key = f'{day.isoformat()}|{amount:.2f}|{normalised_name}|{occurrence}'
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+class StatementImport:
+    def __init__(self, user, budget, batch_size=None, progress=None, total_bytes=None):
+        self.user = user
+        self.budget = budget
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.progress = progress  # called with the summary after every batch
+        self.total_bytes = total_bytes
+        self.tz = get_timezone()
+        self.budget_ids = set(Budget.objects.filter(user=user).values_list('id', flat=True))
+        self.occurrences = {}  # date -> Counter of (amount, normalised name) -> rows seen so far
+        self.forgotten = set()  # dates whose counts were dropped, see write
+        self.summary = {'rows': 0, 'expenses': 0, 'income': 0, 'duplicates': 0, 'skipped': 0, 'errors': []}
+
+    def run(self, rows, position=None):
+        # `position` returns how far into the file the parser is (in bytes), for the progress reports
+        batch = []
+        for row in rows:
+            if isinstance(row, ValueError):
+                self.summary['skipped'] += 1
+                if len(self.summary['errors']) < 20:
+                    self.summary['errors'].append(str(row))
+                continue
+            if not row.amount:
+                self.summary['skipped'] += 1
+                continue
+            self.summary['rows'] += 1
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+                self.report(position)
+        if batch:
+            self.write(batch)
+        self.report(position)
+        if self.summary['expenses'] or self.summary['income']:
+            mark_stale(self.user.id)
+        return self.summary
+
+    def report(self, position):
+        if self.progress is not None:
+            done = position() if position else None
+            if done is not None and self.total_bytes:
+                self.summary['percent'] = round(min(100.0, done * 100 / self.total_bytes), 1)
+            self.progress(self.summary)
+
+    def write(self, batch):
+        hashes, keys = [], []
+        occurrences = self.occurrences
+        for row in batch:
+            if row.day in self.forgotten:
+                raise StatementError(f"line {row.line}: the statement must be in date order, {row.day} comes after "
+                                     f"lines more than {OCCURRENCE_WINDOW_DAYS} days later or earlier")
+            normalised = normalise_name(row.name)
+            counts = occurrences.get(row.day)
+            if counts is None:
+                counts = occurrences[row.day] = Counter()
+            key = (row.amount, normalised)
+            counts[key] += 1
+            hashes.append(import_hash(row.day, row.amount, normalised, counts[key]))
+            keys.append(((row.day, *key), counts[key]))
+        # Statements are in date order (one way or the other), so the counts of dates well away from
+        # the current rows are dropped to keep memory bounded however long the file is. A line of a date
+        # dropped would be numbered from 1 again and taken for an earlier import's: such a file is rejected.
+        current = batch[-1].day
+        for day in [day for day in occurrences if abs((day - current).days) > OCCURRENCE_WINDOW_DAYS]:
+            del occurrences[day]
+            self.forgotten.add(day)
+
+        connection = connections[router.db_for_write(Expense)]
+        seen = imported_hashes(connection, self.budget_ids, self.user.pk, hashes)
+        entered = entered_rows(self.user.pk, min(row.day for row in batch), max(row.day for row in batch), self.tz)
+
+        expenses, income = [], []
+        for row, row_hash, (key, occurrence) in zip(batch, hashes, keys):
+            if row_hash in seen or entered[key] >= occurrence:
+                self.summary['duplicates'] += 1
+            elif row.amount < 0:
+                expenses.append((row, row_hash))
+            else:
+                income.append((row, row_hash))
+        if not expenses and not income:
+            return
+
+        suggestions = categorise_names(self.user.id, [row.name for row, _hash in expenses])
+        ops = connection.ops
+        now = ops.adapt_datetimefield_value(timezone.now())
+        days = {}
+
+        def created_at(day):
+            # Statements have many rows per day, adapt each day once
+            value = days.get(day)
+            if value is None:
+                value = days[day] = ops.adapt_datetimefield_value(local_midnight(day, self.tz))
+            return value
+
+        def amount(value):
+            return ops.adapt_decimalfield_value(value, 10, 2)
+
+        currency = self.budget.currency  # a statement is one account, in the budget's currency
+
+        # Plain INSERTs rather than bulk_create: instantiating and preparing a model per row costs more than
+        # the insert itself at this volume. That also skips the pre_save signal, so change_seq is stamped here.
+        with transaction.atomic(using=connection.alias):
+            change_seq = reserve_change_seqs(self.user.id, len(expenses) + len(income))
+            insert_rows(connection, Expense, ['budget_id', 'user_id', 'name', 'amount', 'currency', 'created_at', 'updated_at', 'category_id', 'import_hash', 'change_seq'], [
+                (self.budget.pk, self.user.pk, row.name, amount(-row.amount), currency, created_at(row.day), now, category_id, row_hash, change_seq + offset)
+                for offset, ((row, row_hash), (category_id, _source)) in enumerate(zip(expenses, suggestions))
+            ])
+            change_seq += len(expenses)
+            insert_rows(connection, Income, ['user_id', 'name', 'amount', 'currency', 'created_at', 'updated_at', 'import_hash', 'change_seq'], [
+                (self.user.pk, row.name, amount(row.amount), currency, created_at(row.day), now, row_hash, change_seq + offset)
+                for offset, (row, row_hash) in enumerate(income)
+            ])
+        self.summary['expenses'] += len(expenses)
+        self.summary['income'] += len(income)
+
+
+def imported_hashes(connection, budget_ids, user_id, hashes):
+    # Which of `hashes` earlier imports of the user already wrote. Plain SQL on the covering
+    # (import_hash, owner) indexes, with the owner checked here: filtering on the user in SQL lets the
+    # planner walk all of the user's expenses instead, and compiling a queryset with thousands of IN
+    # values costs about as much as running it. `budget_ids` are the user's budgets that are not deleted.
+    quote = connection.ops.quote_name
+    seen = set()
+    size = connection.features.max_query_params or 1000
+    with connection.cursor() as cursor:
+        for start in range(0, len(hashes), size):
+            chunk = hashes[start:start + size]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'SELECT import_hash, budget_id FROM {quote(Expense._meta.db_table)} '
+                           f'WHERE import_hash IN ({placeholders})', chunk)
+            seen.update(row_hash for row_hash, budget_id in cursor.fetchall() if budget_id in budget_ids)
+            cursor.execute(f'SELECT import_hash, user_id FROM {quote(Income._meta.db_table)} '
+                           f'WHERE import_hash IN ({placeholders})', chunk)
+            seen.update(row_hash for row_hash, owner_id in cursor.fetchall() if owner_id == user_id)
+    return seen
+
+
+def entered_rows(user_id, first_day, last_day, tz):
+    # The user's expenses (of budgets not deleted) and income without an import_hash dated first_day..last_day,
+    # counted by (local date, signed amount, normalised name) like statement rows. By the (user, created_at)
+    # index for expenses; income has no date index but a user has little of it.
+    start, end = local_midnight(first_day, tz), local_midnight(last_day + timedelta(days=1), tz)
+    entered = Counter()
+    for model, sign in ((Expense, -1), (Income, 1)):
+        rows = model.objects.filter(user_id=user_id, import_hash__isnull=True, created_at__gte=start, created_at__lt=end)
+        for created_at, amount, name in rows.values_list('created_at', 'amount', 'name'):
+            entered[(timezone.localtime(created_at, tz).date(), sign * amount, normalise_name(name))] += 1
+    return entered
+
+
+def insert_rows(connection, model, columns, rows):
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table), ', '.join(quote(column) for column in columns), ', '.join(['%s'] * len(columns)),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def import_statement(file, user, budget, file_format=None, columns=None, date_format=None, progress=None, batch_size=None):
+    """
+    Import a statement from a binary file object (an upload or an open file). `file_format` is
+    'csv' or 'ofx', guessed from the file name when not given.
+    """
+    name = getattr(file, 'name', '') or ''
+    file_format = (file_format or name.rsplit('.', 1)[-1]).lower()
+    if file_format not in ('csv', 'ofx', 'qfx'):
+        raise StatementError("format must be csv or ofx")
+
+    total_bytes = getattr(file, 'size', None)
+    file = getattr(file, 'file', file)  # the underlying file of a Django upload
+    if total_bytes is None:
+        total_bytes = file.seek(0, io.SEEK_END)
+        file.seek(0)
+    stream = io.TextIOWrapper(file, encoding='utf-8-sig', errors='replace', newline='')
+    rows = read_csv(stream, columns, date_format) if file_format == 'csv' else read_ofx(stream)
+    try:
+        return StatementImport(user, budget, batch_size, progress, total_bytes).run(rows, file.tell)
+    finally:
+        stream.detach()  # the caller owns (and closes) the file
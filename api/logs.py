@@ -0,0 +1,63 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Structured (JSON lines) logging that never blocks a request on stdout: records are put on an
+# in-memory queue and written by a QueueListener thread.
+#
+# The listener is started per process on first use, so workers forked from a gunicorn --preload
+# master get their own (threads don't survive a fork).
+
+# LogRecord attributes that aren't user-supplied `extra` fields
+STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self._listener = None
+        self._pid = None
+
+    def _ensure_listener(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.queue = queue.Queue(self.queue.maxsize)  # don't inherit a forked parent's backlog
+            stream_handler = logging.StreamHandler(sys.stdout)
+            stream_handler.setFormatter(JSONFormatter())
+            self._listener = logging.handlers.QueueListener(self.queue, stream_handler, respect_handler_level=False)
+            self._listener.start()
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass  # drop rather than block the request when stdout can't keep up
+
+    def prepare(self, record):
+        # Like QueueHandler.prepare but keeps the formatted traceback separate from the message
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
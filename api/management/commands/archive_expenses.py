@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.archive import archive_cutoff, archive_expenses
+
+
+class Command(BaseCommand):
+    help = "Move expenses older than EXPENSE_ARCHIVE_AFTER_YEARS into compressed archive chunks (still in the export)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=settings.EXPENSE_ARCHIVE_AFTER_YEARS)
+        parser.add_argument('--chunk-size', type=int, default=settings.EXPENSE_ARCHIVE_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        users, expenses = archive_expenses(options['years'], options['chunk_size'])
+        before = archive_cutoff(options['years']).date()
+        self.stdout.write(self.style.SUCCESS(f"Archived {expenses} expenses from before {before} of {users} users"))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_databases, setup_test_environment, teardown_databases
+
+from api.query_plans import EXPECTATIONS_FILE, collect_plans, compare, create_fixture, load_expectations, save_expectations
+
+
+class Command(BaseCommand):
+    help = ("EXPLAIN the queries of the hot endpoints on a throwaway test database and fail when a plan regressed "
+            "against api/query_plans.json (a table read in full, an index no longer used)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--update', action='store_true', help="Store the current plans as the expectations")
+        parser.add_argument('--verbose-plans', action='store_true', help="Print every query with its plan")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        # A private cache, so which lookups are cached doesn't depend on an earlier run (nor leaks into the real cache)
+        cache_settings = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'query-plans'}}
+        try:
+            vendor = connection.vendor
+            with override_settings(CACHES=cache_settings):
+                results = collect_plans(create_fixture())
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        if options['verbose_plans']:
+            for name, result in results.items():
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                for sql, details, _scans, _indexes in result['queries']:
+                    self.stdout.write(f"  {sql[:200]}")
+                    for detail in details:
+                        self.stdout.write(f"    | {detail}")
+
+        if options['update']:
+            save_expectations(vendor, results)
+            self.stdout.write(self.style.SUCCESS(f"Stored the {vendor} plans of {len(results)} endpoints in {EXPECTATIONS_FILE}"))
+            return
+
+        expected = load_expectations().get(vendor)
+        if expected is None:
+            raise CommandError(f"No {vendor} expectations in {EXPECTATIONS_FILE} yet, run with --update first")
+        regressions, changes = compare(expected, results)
+        for change in changes:
+            self.stdout.write(self.style.WARNING(change))
+        if regressions:
+            self.stderr.write('\n\n'.join(regressions))
+            raise CommandError(f"{len(regressions)} endpoints have worse query plans; if that is intended, run with --update")
+        if changes:
+            self.stdout.write(self.style.WARNING("Plans changed without regressing, run with --update to keep them"))
+        self.stdout.write(self.style.SUCCESS(f"{len(results)} endpoints checked, no query plan regressed ({vendor})"))
@@ -0,0 +1,24 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.edge import export_edge_files
+
+
+class Command(BaseCommand):
+    help = "Write the per-user SQLite files that read-only edge servers answer from (see api/edge.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help="Where to write them (default EDGE_FILES_DIR)")
+        parser.add_argument('--workers', type=int, default=settings.EDGE_EXPORT_WORKERS,
+                            help="Processes to spread the users over")
+        parser.add_argument('--user', type=int, action='append', help="Only export these user ids")
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.EDGE_FILES_DIR
+        started = time.perf_counter()
+        users, size = export_edge_files(directory, workers=options['workers'], user_ids=options['user'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {users} users ({size / 1024 / 1024:.1f} MB) to {directory} in {time.perf_counter() - started:.1f}s"
+        ))
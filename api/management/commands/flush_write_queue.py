@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.writequeue import flush
+
+
+class Command(BaseCommand):
+    help = "Apply the queued goal savings and expenses (picks up writes a restarted worker didn't flush)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.WRITE_QUEUE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        applied = flush(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Applied {applied} queued writes"))
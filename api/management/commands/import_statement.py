@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.imports import StatementError, import_statement
+from api.models import Budget
+
+
+class Command(BaseCommand):
+    help = "Import a bank statement (CSV or OFX) into a budget's expenses and its owner's income"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--budget', type=int, required=True, help="Debits become expenses of this budget")
+        parser.add_argument('--format', choices=['csv', 'ofx'], help="Guessed from the file extension by default")
+        parser.add_argument('--columns', help='CSV column mapping as JSON, e.g. {"date": "Posted", "name": "Payee", "amount": "Value"}')
+        parser.add_argument('--date-format', help="strptime format of the CSV dates")
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        budget = Budget.objects.select_related('user').filter(pk=options['budget']).first()
+        if budget is None:
+            raise CommandError(f"Budget {options['budget']} not found")
+        columns = json.loads(options['columns']) if options['columns'] else None
+
+        def progress(summary):
+            percent = f"{summary['percent']:5.1f}% " if 'percent' in summary else ''
+            self.stderr.write(f"\r{percent}{summary['rows']} rows, {summary['expenses']} expenses, "
+                              f"{summary['income']} income, {summary['duplicates']} duplicates", ending='')
+
+        try:
+            with open(options['path'], 'rb') as file:
+                summary = import_statement(file, budget.user, budget, options['format'], columns,
+                                           options['date_format'], progress, options['batch_size'])
+        except StatementError as e:
+            raise CommandError(str(e))
+        self.stderr.write('')
+        for error in summary['errors']:
+            self.stderr.write(self.style.WARNING(f"Skipped {error}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['expenses']} expenses and {summary['income']} income "
+            f"({summary['duplicates']} duplicates, {summary['skipped']} skipped)"
+        ))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.currency import load_rates, read_rates
+
+
+class Command(BaseCommand):
+    help = "Load FX rates from a CSV file (date,currency,rate lines or the ECB's wide layout), replacing rates of the same days"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=settings.FX_RATES_FILE)
+
+    def handle(self, *args, **options):
+        if not options['path']:
+            raise CommandError("Give the rates file, or set FX_RATES_FILE")
+        try:
+            with open(options['path'], newline='') as file:
+                count = load_rates(read_rates(file))
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Loaded {count} exchange rates"))
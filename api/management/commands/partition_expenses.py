@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.partitioning import add_month_partitions, partition_counts, partition_expenses, partition_scheme
+
+
+class Command(BaseCommand):
+    help = ("Partition the expense table (PostgreSQL) by user hash or by month, add the coming months' partitions "
+            "(--extend, from cron), or show how it is partitioned")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', choices=['user', 'month'], help="Convert the table, copying every expense")
+        parser.add_argument('--partitions', type=int, default=settings.EXPENSE_PARTITIONS)
+        parser.add_argument('--extend', action='store_true', help="Add the partitions of the coming months")
+        parser.add_argument('--months-ahead', type=int, default=12)
+
+    def handle(self, *args, **options):
+        try:
+            if options['by']:
+                partition_expenses(options['by'], options['partitions'], options['months_ahead'])
+            elif options['extend']:
+                months = add_month_partitions(options['months_ahead'])
+                self.stdout.write(self.style.SUCCESS(f"Partitions in place for the next {months} months"))
+                return
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        scheme = partition_scheme()
+        if scheme is None:
+            self.stdout.write("The expense table is not partitioned")
+            return
+        counts = partition_counts()
+        self.stdout.write(self.style.SUCCESS(f"The expense table is partitioned by {scheme} into {len(counts)} partitions"))
+        for name, rows in counts.items():
+            self.stdout.write(f"  {name}: ~{max(rows, 0)} rows")
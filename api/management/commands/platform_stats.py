@@ -0,0 +1,33 @@
+import json
+import os
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.platform_stats import compute_platform_stats
+
+
+class Command(BaseCommand):
+    help = "Compute platform-wide spend, budget overrun and goal completion statistics"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Processes to spread the user-id partitions over (SQLite only)")
+        parser.add_argument('--partitions', type=int, help="Number of user-id ranges (default 4 per worker)")
+        parser.add_argument('--start', help="Only count expenses from this date (YYYY-MM-DD)")
+        parser.add_argument('--end', help="Only count expenses before this date (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        start = self.parse_date(options['start'])
+        end = self.parse_date(options['end'])
+        started = time.perf_counter()
+        stats = compute_platform_stats(workers=options['workers'], partitions=options['partitions'], start=start, end=end)
+        self.stdout.write(json.dumps(stats, indent=2))
+        self.stderr.write(f"Computed in {time.perf_counter() - started:.1f}s")
+
+    def parse_date(self, value):
+        if not value:
+            return None
+        return timezone.make_aware(datetime.strptime(value, '%Y-%m-%d'))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.purge import pending_budget_ids, purge_budget
+
+
+class Command(BaseCommand):
+    help = "Remove soft-deleted budgets and their expenses (picks up purges a restarted worker didn't finish)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.BUDGET_PURGE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        budget_ids = pending_budget_ids()
+        expenses = 0
+        for budget_id in budget_ids:
+            expenses += purge_budget(budget_id, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {len(budget_ids)} budgets and {expenses} expenses"))
@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from api.categorisation import recategorise_user
+
+
+class Command(BaseCommand):
+    help = "Fill in the category of uncategorised expenses (e.g. after an import) from the category suggestions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help="Only these user ids")
+        parser.add_argument('--all', action='store_true', help="Recategorise every expense, not just uncategorised ones")
+
+    def handle(self, *args, **options):
+        user_ids = options['user'] or list(User.objects.values_list('id', flat=True))
+        total = 0
+        for user_id in user_ids:
+            total += recategorise_user(user_id, only_uncategorised=not options['all'])
+        self.stdout.write(self.style.SUCCESS(f"Recategorised {total} expenses of {len(user_ids)} users"))
+
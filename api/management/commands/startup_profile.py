@@ -0,0 +1,47 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# What a gunicorn worker does before it can serve its first request
+BOOT_SNIPPET = (
+    "from django.core.wsgi import get_wsgi_application; get_wsgi_application(); "
+    "from django.urls import get_resolver; get_resolver().url_patterns"
+)
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+class Command(BaseCommand):
+    help = "Profile worker boot with python -X importtime and list the slowest imports"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25)
+        parser.add_argument('--sort', choices=['cumulative', 'self'], default='cumulative')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'backend.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOT_SNIPPET],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            self.stderr.write(result.stderr)
+            raise SystemExit(result.returncode)
+
+        imports = []
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match:
+                self_us, cumulative_us, indent, module = match.groups()
+                imports.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+
+        total_us = sum(self_us for _module, self_us, _cumulative, _depth in imports)
+        key = 2 if options['sort'] == 'cumulative' else 1
+        self.stdout.write(f"{len(imports)} modules imported in {total_us / 1000:.0f} ms\n")
+        self.stdout.write(f"{'module':<60}{'self ms':>10}{'cumulative ms':>15}")
+        for module, self_us, cumulative_us, depth in sorted(imports, key=lambda item: item[key], reverse=True)[:options['top']]:
+            self.stdout.write(f"{module:<60}{self_us / 1000:>10.1f}{cumulative_us / 1000:>15.1f}")
@@ -0,0 +1,94 @@
+# Generated by Django 5.0.7 on 2026-10-19 11:59
+
+import hashlib
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# The fingerprinting of api/fingerprints.py as it was when this migration was written, copied rather
+# than imported so later changes there don't change what this migration computes
+
+SHINGLE_SIZE = 2
+MINHASH_BANDS = 8
+MINHASH_ROWS = 3
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(b'a%d' % i, digest_size=8).digest(), 'big') % (_MERSENNE_PRIME - 1) + 1,
+     int.from_bytes(hashlib.blake2b(b'b%d' % i, digest_size=8).digest(), 'big') % _MERSENNE_PRIME)
+    for i in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+
+URL_PATTERN = re.compile(r'(https?://|www\.|bit\.ly/|t\.me/)\S+', re.IGNORECASE)
+NON_WORD_PATTERN = re.compile(r'[^\w]+')
+
+
+def normalise_text(text):
+    text = unicodedata.normalize('NFKC', text or '')
+    text = URL_PATTERN.sub(' ', text).lower()
+    return ' '.join(NON_WORD_PATTERN.sub(' ', text).split())
+
+
+def content_hash(normalised):
+    return hashlib.blake2b(normalised.encode(), digest_size=16).hexdigest()
+
+
+def shingles(normalised):
+    words = normalised.split()
+    if len(words) <= SHINGLE_SIZE:
+        return {normalised}
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash_band_keys(shingle_set):
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), 'big')
+              for shingle in shingle_set]
+    signature = [min((a * h + b) % _MERSENNE_PRIME & _MAX_HASH for h in hashes) for a, b in _PERMUTATIONS]
+    keys = []
+    for band in range(MINHASH_BANDS):
+        rows = signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]
+        digest = hashlib.blake2b(repr((band, rows)).encode(), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'big', signed=True))
+    return keys
+
+
+def fingerprint_discounts(apps, schema_editor):
+    # Fingerprint the discounts already loaded; existing duplicates are left as they are
+    StudentDiscount = apps.get_model('api', 'StudentDiscount')
+    DiscountBand = apps.get_model('api', 'DiscountBand')
+    discounts = list(StudentDiscount.objects.only('id', 'message'))
+    bands = []
+    for discount in discounts:
+        normalised = normalise_text(discount.message)
+        discount.content_hash = content_hash(normalised)
+        if normalised:
+            bands.extend(DiscountBand(discount_id=discount.id, key=key) for key in minhash_band_keys(shingles(normalised)))
+    StudentDiscount.objects.bulk_update(discounts, ['content_hash'], batch_size=500)
+    DiscountBand.objects.bulk_create(bands, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_budget_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentdiscount',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=32),
+        ),
+        migrations.CreateModel(
+            name='DiscountBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField(db_index=True)),
+                ('discount', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='api.studentdiscount')),
+            ],
+        ),
+        migrations.RunPython(fingerprint_discounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.7 on 2026-10-19 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_discount_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='studentdiscount',
+            index=models.Index(fields=['-date', '-id'], name='api_discount_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentdiscount',
+            index=models.Index(fields=['channel_id', '-date'], name='api_discount_channel_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentdiscount',
+            index=models.Index(condition=models.Q(('discount_link__gt', '')), fields=['-date'], name='api_discount_linked_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0.7 on 2026-10-19 12:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_expense_users(apps, schema_editor):
+    # One UPDATE with a correlated subquery, soft-deleted budgets included
+    Budget = apps.get_model('api', 'Budget')
+    Expense = apps.get_model('api', 'Expense')
+    owner = Budget.objects.filter(pk=models.OuterRef('budget_id')).values('user_id')[:1]
+    Expense.objects.filter(user__isnull=True).update(user_id=models.Subquery(owner))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_queued_writes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('first_day', models.DateField()),
+                ('last_day', models.DateField()),
+                ('count', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='expense',
+            name='api_expense_change_seq_idx',
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='user',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(fill_expense_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='expense',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'change_seq'], name='api_expense_change_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'created_at'], name='api_expense_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expensearchive',
+            index=models.Index(fields=['user_id', 'first_day'], name='api_expense_archive_user_idx'),
+        ),
+    ]
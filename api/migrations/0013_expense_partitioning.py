@@ -0,0 +1,62 @@
+from django.db import migrations
+
+# On PostgreSQL, api_expense becomes PARTITION BY HASH (user_id) in PARTITIONS partitions, so each user's
+# queries read the one partition holding the user; other databases keep the plain table. The layout is
+# fixed here rather than read from the settings, and the SQL is written out for the table as it is at
+# 0012, so the migration does the same whatever api/partitioning.py (which converts the table to another
+# layout later, see `manage.py partition_expenses`) becomes.
+#
+# The rows are copied in the migration's transaction, then the primary key, foreign keys and indexes are
+# recreated under the names Django gave them, so later migrations find them. The primary key becomes
+# (id, user_id): PostgreSQL requires the partition key in unique constraints.
+
+PARTITIONS = 16
+
+PARTITION_SQL = [
+    "ALTER TABLE api_expense RENAME TO api_expense_unpartitioned",
+    # Without INCLUDING IDENTITY: identity columns can't be used on partitioned tables before PostgreSQL 17
+    "CREATE TABLE api_expense (LIKE api_expense_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+    "PARTITION BY HASH (user_id)",
+    "CREATE SEQUENCE api_expense_partitioned_id_seq OWNED BY api_expense.id",
+    "ALTER TABLE api_expense ALTER COLUMN id SET DEFAULT nextval('api_expense_partitioned_id_seq')",
+    *(f"CREATE TABLE api_expense_p{remainder} PARTITION OF api_expense "
+      f"FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})" for remainder in range(PARTITIONS)),
+    "INSERT INTO api_expense SELECT * FROM api_expense_unpartitioned",
+    "SELECT setval('api_expense_partitioned_id_seq', COALESCE((SELECT MAX(id) FROM api_expense), 0) + 1, false)",
+    "DROP TABLE api_expense_unpartitioned",
+    "ALTER TABLE api_expense ADD CONSTRAINT api_expense_pkey PRIMARY KEY (id, user_id)",
+    "ALTER TABLE api_expense ADD CONSTRAINT api_expense_budget_id_be9a2522_fk_api_budget_id "
+    "FOREIGN KEY (budget_id) REFERENCES api_budget (id) DEFERRABLE INITIALLY DEFERRED",
+    "ALTER TABLE api_expense ADD CONSTRAINT api_expense_category_id_b6c9915d_fk_api_category_id "
+    "FOREIGN KEY (category_id) REFERENCES api_category (id) DEFERRABLE INITIALLY DEFERRED",
+    "ALTER TABLE api_expense ADD CONSTRAINT api_expense_user_id_ecce8007_fk_auth_user_id "
+    "FOREIGN KEY (user_id) REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED",
+    "CREATE INDEX api_expense_budget_id_be9a2522 ON api_expense (budget_id)",
+    "CREATE INDEX api_expense_category_id_b6c9915d ON api_expense (category_id)",
+    "CREATE INDEX api_expense_import_hash_idx ON api_expense (import_hash, budget_id) WHERE import_hash IS NOT NULL",
+    "CREATE INDEX api_expense_change_seq_idx ON api_expense (user_id, change_seq)",
+    "CREATE INDEX api_expense_user_created_idx ON api_expense (user_id, created_at)",
+]
+
+
+def partition_expenses(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        # Left alone if already partitioned by hand
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'api_expense'::regclass")
+        if cursor.fetchone():
+            return
+    for sql in PARTITION_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_expense_user_and_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_expenses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-19 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_expense_partitioning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dashboardsnapshot',
+            name='write_count',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
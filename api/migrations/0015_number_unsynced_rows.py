@@ -0,0 +1,47 @@
+from django.db import migrations
+
+# Rows written before 0005 kept change_seq 0, which no sync cursor (nor the category learner) reads past.
+# Number them per user after the user's current SyncCounter value, in id order, and advance the counters:
+# every device's next sync then returns them, a fresh one's included.
+
+MODELS = ['Budget', 'Expense', 'Income', 'Goal']
+BATCH_SIZE = 1000
+
+
+def number_unsynced_rows(apps, schema_editor):
+    SyncCounter = apps.get_model('api', 'SyncCounter')
+    # Locked, so writes landing meanwhile wait for the numbering (PostgreSQL; migrations run in a transaction)
+    counters = dict(SyncCounter.objects.select_for_update().values_list('user_id', 'value'))
+    numbered = set()
+    for name in MODELS:
+        model = apps.get_model('api', name)
+        rows = model._base_manager.filter(change_seq=0).order_by('id')  # soft-deleted budgets too
+        last_id = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id).values_list('id', 'user_id')[:BATCH_SIZE])
+            if not batch:
+                break
+            updates = []
+            for pk, user_id in batch:
+                counters[user_id] = counters.get(user_id, 0) + 1
+                numbered.add(user_id)
+                updates.append(model(pk=pk, change_seq=counters[user_id]))
+            model._base_manager.bulk_update(updates, ['change_seq'])
+            last_id = batch[-1][0]
+
+    existing = set(SyncCounter.objects.filter(user_id__in=numbered).values_list('user_id', flat=True))
+    SyncCounter.objects.bulk_update([SyncCounter(user_id=user_id, value=counters[user_id]) for user_id in existing],
+                                    ['value'], batch_size=BATCH_SIZE)
+    SyncCounter.objects.bulk_create([SyncCounter(user_id=user_id, value=counters[user_id]) for user_id in numbered - existing],
+                                    batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_dashboardsnapshot_write_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(number_unsynced_rows, migrations.RunPython.noop),
+    ]
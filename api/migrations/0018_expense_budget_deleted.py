@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+# Expenses of a soft-deleted budget are hidden on their own budget_deleted flag rather than through a join
+# on the budget. Its default is in the database too, for the plain INSERTs of api/imports.py.
+# Flag the expenses of the budgets already waiting to be purged.
+
+
+def flag_deleted_budgets(apps, schema_editor):
+    Budget = apps.get_model('api', 'Budget')
+    Expense = apps.get_model('api', 'Expense')
+    deleted = Budget._base_manager.filter(deleted_at__isnull=False).values('pk')
+    Expense._base_manager.filter(budget_id__in=deleted).update(budget_deleted=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_exchangerate_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='budget_deleted',
+            field=models.BooleanField(db_default=False, default=False),
+        ),
+        migrations.RunPython(flag_deleted_budgets, migrations.RunPython.noop),
+    ]
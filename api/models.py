@@ -1,56 +1,152 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from decimal import Decimal
 from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
 import json
 import re
 
+from .fingerprints import content_hash, minhash_band_keys, normalise_link, normalise_text, shingles
+
+def default_currency():
+    return settings.DEFAULT_CURRENCY
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
 
     def __str__(self):
         return self.name
 
-class Budget(models.Model):
+class SyncTrackedModel(models.Model):
+    # Rows that offline clients sync (see api/sync.py). The change_seq stamp is set by a pre_save signal
+    # (api/signals.py); saving in a transaction keeps the user's counter row locked until the row commits.
+    change_seq = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'change_seq'}
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+class BudgetManager(models.Manager):
+    # Soft-deleted budgets are hidden everywhere until api/purge.py removes them
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+class Budget(SyncTrackedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default=default_currency)  # ISO 4217, see api/currency.py
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = BudgetManager()
+    all_objects = models.Manager()  # including soft-deleted budgets
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'change_seq'], name='api_budget_change_seq_idx'),
+            # Only the budgets waiting to be purged are indexed
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='api_budget_deleted_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
-class Expense(models.Model):
+class ExpenseQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # Fills in the denormalised user from the budget, like Expense.save
+        objs = list(objs)
+        missing = {obj.budget_id for obj in objs if obj.user_id is None}
+        if missing:
+            owners = dict(Budget.all_objects.filter(pk__in=missing).values_list('pk', 'user_id'))
+            for obj in objs:
+                if obj.user_id is None:
+                    obj.user_id = owners.get(obj.budget_id)
+        return super().bulk_create(objs, *args, **kwargs)
+
+class ExpenseManager(models.Manager.from_queryset(ExpenseQuerySet)):
+    # Expenses of a soft-deleted budget disappear with it, on the expense's own flag so per-user
+    # queries don't join the budget
+    def get_queryset(self):
+        return super().get_queryset().filter(budget_deleted=False)
+
+class Expense(SyncTrackedModel):
     budget = models.ForeignKey(Budget, on_delete=models.CASCADE)
+    # The budget's user, so per-user queries don't go through the budget (and the table can be
+    # partitioned by user, see api/partitioning.py); the (user, created_at) index covers it
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     name = models.CharField(max_length=255)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    created_at = models.DateTimeField(auto_now_add=True)
+    currency = models.CharField(max_length=3, default=default_currency)
+    created_at = models.DateTimeField(default=timezone.now)  # set explicitly by statement imports
+    updated_at = models.DateTimeField(auto_now=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
+    import_hash = models.CharField(max_length=32, null=True, blank=True)  # dedupes statement imports (api/imports.py)
+    budget_deleted = models.BooleanField(default=False, db_default=False)  # set with the budget's deleted_at, see api/purge.py
+
+    objects = ExpenseManager()
+    all_objects = models.Manager.from_queryset(ExpenseQuerySet)()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'change_seq'], name='api_expense_change_seq_idx'),
+            models.Index(fields=['user', 'created_at'], name='api_expense_user_created_idx'),
+            models.Index(fields=['import_hash', 'budget'], condition=models.Q(import_hash__isnull=False), name='api_expense_import_hash_idx'),
+            # The expenses entered by hand on a statement's days, without walking the imported ones
+            models.Index(fields=['user', 'created_at'], condition=models.Q(import_hash__isnull=True), name='api_expense_entered_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.user_id is None and self.budget_id is not None:
+            self.user_id = self.budget.user_id
+        super().save(*args, **kwargs)
 
-class Income(models.Model):
+
+class Income(SyncTrackedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    created_at = models.DateTimeField(auto_now_add=True)
+    currency = models.CharField(max_length=3, default=default_currency)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    import_hash = models.CharField(max_length=32, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'change_seq'], name='api_income_change_seq_idx'),
+            models.Index(fields=['import_hash', 'user'], condition=models.Q(import_hash__isnull=False), name='api_income_import_hash_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
     
 
-class Goal(models.Model):
+class Goal(SyncTrackedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     target_amount = models.DecimalField(max_digits=10, decimal_places=2)
     current_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    currency = models.CharField(max_length=3, default=default_currency)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['user', 'change_seq'], name='api_goal_change_seq_idx')]
+
     def __str__(self):
         return self.name
 
@@ -77,13 +173,38 @@ class StudentDiscount(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     channel_link = models.URLField(blank=True, null=True)
     discount_link = models.URLField(blank=True, null=True)
+    # Fingerprint of the normalised text for duplicate detection (see api/fingerprints.py)
+    content_hash = models.CharField(max_length=32, blank=True, default='', db_index=True)
+
+    class Meta:
+        # For the feed filters (see api/discounts.py), all newest first
+        indexes = [
+            models.Index(fields=['-date', '-id'], name='api_discount_date_idx'),
+            models.Index(fields=['channel_id', '-date'], name='api_discount_channel_date_idx'),
+            models.Index(fields=['-date'], condition=models.Q(discount_link__gt=''), name='api_discount_linked_idx'),
+        ]
 
     def __str__(self):
         return f"StudentDiscount {self.message_id}"
 
     def save(self, *args, **kwargs):
         self.extract_links()
-        super().save(*args, **kwargs)
+        _shingles, keys = self.fingerprint()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # The ingestion (api/discounts.py) writes the band keys of its rows in bulk
+            self.bands.all().delete()
+            DiscountBand.objects.bulk_create([DiscountBand(discount=self, key=key) for key in keys])
+
+    def fingerprint(self):
+        # Sets content_hash and returns the shingles and MinHash band keys of the message (see api/fingerprints.py),
+        # both empty for a message without words
+        normalised = normalise_text(self.message)
+        self.content_hash = content_hash(normalised)
+        if not normalised:
+            return set(), []
+        shingle_set = shingles(normalised)
+        return shingle_set, minhash_band_keys(shingle_set)
 
     def extract_links(self):
         bitly_pattern = re.compile(r'bit\.ly/\S+')
@@ -95,14 +216,14 @@ class StudentDiscount(models.Model):
         # Extract bit.ly link
         bitly_match = bitly_pattern.search(self.message)
         if bitly_match:
-            self.discount_link = bitly_match.group(0)
+            self.discount_link = normalise_link(bitly_match.group(0))
         else:
             self.discount_link = ""
 
         # Extract Telegram link
         telegram_match = telegram_pattern.search(self.message)
         if telegram_match:
-            self.channel_link = telegram_match.group(0)
+            self.channel_link = normalise_link(telegram_match.group(0))
         else:
             self.channel_link = None
 
@@ -114,21 +235,163 @@ class StudentDiscount(models.Model):
 
     @staticmethod
     def load_messages_from_json():
+        # Reposts of a deal already in the feed are collapsed into it (see api/discounts.py)
+        from .discounts import ingest_messages
+
         try:
             with open('api/telegram-scraper/channel_messages.json', 'r') as file:
                 messages = json.load(file)
 
-            for msg in messages:
-                channel_id = msg.get('peer_id', {}).get('channel_id', 0)  # Default to 0 if not found
-                date = msg.get('date', timezone.now())  # Use current time if date is not found
-                student_discount = StudentDiscount(
-                    message_id=msg.get('id', 0),  # Use 0 if id is not found
-                    channel_id=channel_id,
-                    message=msg.get('message', ''),  # Use empty string if message is not found
-                    date=date,
-                )
-                student_discount.save()
+            stats = ingest_messages(messages)
+            print(f"Loaded {stats['created']} new discounts, collapsed {stats['duplicates']} duplicates, "
+                  f"skipped {stats['skipped']} already loaded or empty messages.")
         except FileNotFoundError:
             print("The file channel_messages.json was not found.")
         except json.JSONDecodeError:
-            print("Error decoding JSON from channel_messages.json.")
\ No newline at end of file
+            print("Error decoding JSON from channel_messages.json.")
+
+
+class DiscountBand(models.Model):
+    # MinHash band keys of a StudentDiscount, to find near-duplicate messages with an index lookup
+    discount = models.ForeignKey(StudentDiscount, on_delete=models.CASCADE, related_name='bands')
+    key = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f"DiscountBand {self.discount_id}"
+
+
+class DashboardSnapshotQuerySet(models.QuerySet):
+    def mark_stale(self):
+        # stale_since keeps the time of the first write since the refresh, write_count counts every one
+        now = timezone.now()
+        return self.update(stale_since=Coalesce('stale_since', Value(now, output_field=models.DateTimeField())),
+                           write_count=F('write_count') + 1)
+
+class DashboardSnapshot(models.Model):
+    # Precomputed dashboard payload (see api/snapshots.py), refreshed in the background after writes settle
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='dashboard_snapshot')
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    computed_at = models.DateTimeField()
+    compute_ms = models.FloatField(default=0)
+    stale_since = models.DateTimeField(null=True, blank=True)  # set on the first write after computed_at
+    write_count = models.BigIntegerField(default=0)  # a refresh only clears stale_since if no write landed meanwhile
+
+    objects = DashboardSnapshotQuerySet.as_manager()
+
+    def __str__(self):
+        return f"DashboardSnapshot {self.user_id}"
+
+    def is_stale(self):
+        return self.stale_since is not None
+
+
+class SyncCounter(models.Model):
+    # Per-user change sequence for delta sync (see api/sync.py)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"SyncCounter {self.user_id}"
+
+
+class SyncTombstone(models.Model):
+    # Records a hard delete so offline clients can drop the row on their next sync
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    change_seq = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'change_seq'], name='api_tombstone_change_seq_idx')]
+
+    def __str__(self):
+        return f"SyncTombstone {self.model} {self.object_id}"
+
+
+class QueuedWrite(models.Model):
+    # A write acknowledged to the client but not applied yet (see api/writequeue.py)
+    SAVINGS = 'savings'
+    EXPENSE = 'expense'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10)
+    target_id = models.BigIntegerField()  # the goal savings go to, the budget of an expense
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    payload = models.JSONField(default=dict)  # expense name, currency and category (when given)
+    created_at = models.DateTimeField(default=timezone.now)  # also the expense's created_at
+
+    class Meta:
+        # The merged reads and the claim of a user's writes; with target_id, a goal's or budget's
+        indexes = [models.Index(fields=['user', 'kind', 'target_id'], name='api_queued_write_user_idx')]
+
+    def __str__(self):
+        return f"QueuedWrite {self.kind} {self.target_id}"
+
+
+class ImportProgress(models.Model):
+    # Progress of the user's running (or last) statement import (see api/imports.py), in the database so
+    # the /imports/progress/ polls see it whichever worker process serves them
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    summary = models.JSONField(default=dict)
+    done = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"ImportProgress {self.user_id}"
+
+
+class ExpenseArchive(models.Model):
+    # A chunk of a user's expenses older than EXPENSE_ARCHIVE_AFTER_YEARS, moved out of api_expense and
+    # stored compressed (see api/archive.py). Possibly in another database (api/routers.py), so the
+    # user is a plain id rather than a foreign key.
+    user_id = models.BigIntegerField()
+    first_day = models.DateField()
+    last_day = models.DateField()
+    count = models.IntegerField()
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['user_id', 'first_day'], name='api_expense_archive_user_idx')]
+
+    def __str__(self):
+        return f"ExpenseArchive {self.user_id} {self.first_day}..{self.last_day}"
+
+
+class HomeCurrency(models.Model):
+    # The currency a user's analytics are shown in, when it isn't DEFAULT_CURRENCY
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    currency = models.CharField(max_length=3)
+
+    def __str__(self):
+        return f"HomeCurrency {self.user_id} {self.currency}"
+
+
+class ExchangeRate(models.Model):
+    # Units of `currency` per one FX_BASE_CURRENCY on `day`, loaded from a rates file (see api/currency.py)
+    currency = models.CharField(max_length=3)
+    day = models.DateField()
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+    # The newest one tells the workers their rate table is out of date
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        # Also the index behind the rate lookups: latest day on or before a date, per currency
+        constraints = [models.UniqueConstraint(fields=['currency', 'day'], name='api_exchange_rate_unique')]
+
+    def __str__(self):
+        return f"ExchangeRate {self.currency} {self.day}"
+
+
+class LazyUser(User):
+    # User built from verified JWT claims without a query (see api/authentication.py).
+    # Only the id is known up front; the first access to any other field loads the whole row at once
+    # instead of one query per deferred field.
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        if fields is not None and self.get_deferred_fields():
+            fields = [f.attname for f in self._meta.concrete_fields]
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
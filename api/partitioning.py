@@ -0,0 +1,142 @@
+from datetime import date
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from .models import Expense
+
+# PostgreSQL declarative partitioning of api_expense. Migration 0013 partitions it by user into 16 partitions;
+# `manage.py partition_expenses` converts it to another layout (or a table left unpartitioned) later.
+#
+#   - by user: PARTITION BY HASH (user_id) into N partitions. Every per-user query filters on
+#     expense.user_id, so the planner prunes it to the one partition holding the user, and each
+#     partition's indexes stay 1/N the size of the table's.
+#   - by month: PARTITION BY RANGE (created_at), one partition per month plus a default one. Queries of
+#     a date range (a month's analytics, the time buckets) read only those months; per-user queries
+#     without dates read every partition. New months are added ahead with --extend, from cron.
+#
+# The conversion copies the table (partitioned or not) into the new one in a single transaction (writes to
+# expenses wait for it), then recreates the indexes and foreign keys Django knows about from the model, under
+# the same names, so later migrations find them. The primary key becomes (id, partition key): PostgreSQL
+# requires the partition key in unique constraints. Nothing references an expense, and Django only ever
+# looks expenses up by id, so that is invisible to the ORM.
+
+SCHEMES = {
+    'user': ('HASH (user_id)', 'user_id'),
+    'month': ('RANGE (created_at)', 'created_at'),
+}
+
+
+def partition_scheme(using=DEFAULT_DB_ALIAS):
+    # 'user', 'month' or None
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pt.partstrat FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = %s AND pg_table_is_visible(c.oid)", [Expense._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return {'h': 'user', 'r': 'month'}.get(row[0]) if row else None
+
+
+def add_months(day, months):
+    # The first of the month `months` after the month of `day`
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_starts(first, last):
+    month = first.replace(day=1)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def month_partition_sql(table, month):
+    # Month boundaries in UTC, like the created_at values
+    return (f"CREATE TABLE IF NOT EXISTS {table}_{month:%Y_%m} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{add_months(month, 1).isoformat()} 00:00:00+00')")
+
+
+def partition_expenses(scheme, partitions=16, months_ahead=12, using=DEFAULT_DB_ALIAS):
+    """
+    Convert api_expense into a table partitioned by `scheme` ('user' or 'month'): `partitions` hash
+    partitions, or one partition per month from the oldest expense to `months_ahead` months from now.
+    """
+    with connections[using].schema_editor() as editor:
+        partition_table(editor, Expense, scheme, partitions, months_ahead)
+
+
+def partition_table(editor, model, scheme, partitions, months_ahead):
+    connection = editor.connection
+    if connection.vendor != 'postgresql':
+        raise ValueError(f"Partitioning needs PostgreSQL, not {connection.vendor}")
+    if scheme not in SCHEMES:
+        raise ValueError(f"scheme must be one of {', '.join(SCHEMES)}")
+    strategy, key = SCHEMES[scheme]
+    table = model._meta.db_table
+    current = partition_scheme(connection.alias)
+    previous = list(partition_counts(connection.alias)) if current else []
+    if current == scheme and (scheme == 'month' or len(previous) == partitions):
+        raise ValueError(f"{table} is already partitioned by {scheme}")
+    old, sequence = f'{table}_old', f'{table}_partitioned_id_seq'
+
+    # The partitions of the old table too, out of the way of the new ones' names
+    editor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    for name in previous:
+        editor.execute(f"ALTER TABLE {name} RENAME TO {name}_old")
+    # Without INCLUDING IDENTITY: identity columns can't be used on partitioned tables before
+    # PostgreSQL 17, the id comes from a plain sequence instead (the old table's, once partitioned)
+    editor.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY {strategy}")
+    editor.execute(f"CREATE SEQUENCE IF NOT EXISTS {sequence}")
+    editor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+    editor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+    if scheme == 'user':
+        for remainder in range(partitions):
+            editor.execute(f"CREATE TABLE {table}_p{remainder} PARTITION OF {table} "
+                           f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})")
+    else:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT MIN(created_at) FROM {old}")
+            oldest = cursor.fetchone()[0]
+        today = timezone.now().date()
+        for month in month_starts(oldest.date() if oldest else today, add_months(today, months_ahead)):
+            editor.execute(month_partition_sql(table, month))
+        editor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    editor.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    editor.execute(f"SELECT setval('{sequence}', COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+    editor.execute(f"DROP TABLE {old}")
+
+    editor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, {key})")
+    for field in model._meta.local_fields:
+        if field.remote_field and field.db_constraint:
+            editor.execute(editor._create_fk_sql(model, field, '_fk_%(to_table)s_%(to_column)s'))
+        if field.db_index and not field.unique:
+            editor.execute(editor._create_index_sql(model, fields=[field]))
+    for index in model._meta.indexes:
+        editor.execute(index.create_sql(model, editor))
+
+
+def add_month_partitions(months_ahead=12, using=DEFAULT_DB_ALIAS):
+    # For a table partitioned by month: the partitions of the coming months, before rows land in the default one
+    if partition_scheme(using) != 'month':
+        raise ValueError(f"{Expense._meta.db_table} is not partitioned by month")
+    today = timezone.now().date()
+    months = list(month_starts(today, add_months(today, months_ahead)))
+    with connections[using].schema_editor() as editor:
+        for month in months:
+            editor.execute(month_partition_sql(Expense._meta.db_table, month))
+    return len(months)
+
+
+def partition_counts(using=DEFAULT_DB_ALIAS):
+    # partition name -> estimated rows, for the status output
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, c.reltuples::bigint FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s ORDER BY c.relname", [Expense._meta.db_table],
+        )
+        return dict(cursor.fetchall())
@@ -0,0 +1,198 @@
+import math
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import BigIntegerField, Count, F, Max, Min, Q, Sum
+from django.db.models.functions import Cast, Round
+
+from .models import Budget, Category, Expense, Goal
+
+# Platform-wide statistics (spend distribution per category, budget overrun rate, goal completion)
+# computed with grouped queries over the whole Expense / Budget / Goal tables instead of running the
+# per-user analytics once per user.
+#
+# The work is split into user-id ranges. Each partition streams its grouped rows (one row per
+# user and category) into fixed-size quantile sketches, so memory stays bounded however many expenses
+# there are; the partial results are then merged. With SQLite, which runs every query on a single
+# core, the partitions are spread over a process pool.
+
+
+class QuantileSketch:
+    """
+    Mergeable streaming quantile sketch with a fixed relative error (a DDSketch: values are counted
+    in logarithmically sized buckets). Memory is bounded by the range of the values, not their count:
+    about 1,200 buckets cover 1 cent to 100 million dollars at 1% relative error.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = defaultdict(int)
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self.log_gamma)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] += count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def summary(self, scale=100):
+        # Values are tracked in cents, reported in currency units
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'total': round(self.total / scale, 2),
+            'mean': round(self.total / self.count / scale, 2),
+            'p50': round(self.quantile(0.5) / scale, 2),
+            'p90': round(self.quantile(0.9) / scale, 2),
+            'p99': round(self.quantile(0.99) / scale, 2),
+        }
+
+
+class PartialStats:
+    def __init__(self):
+        self.users_with_spend = 0
+        self.expenses = 0
+        self.spend_per_user = QuantileSketch()
+        self.spend_per_category = defaultdict(QuantileSketch)
+        self.budgets = 0
+        self.budgets_overrun = 0
+        self.goals = 0
+        self.goals_completed = 0
+
+    def merge(self, other):
+        self.users_with_spend += other.users_with_spend
+        self.expenses += other.expenses
+        self.spend_per_user.merge(other.spend_per_user)
+        for category_id, sketch in other.spend_per_category.items():
+            self.spend_per_category[category_id].merge(sketch)
+        self.budgets += other.budgets
+        self.budgets_overrun += other.budgets_overrun
+        self.goals += other.goals
+        self.goals_completed += other.goals_completed
+        return self
+
+
+def compute_partition(user_range, start=None, end=None):
+    lo, hi = user_range
+    stats = PartialStats()
+
+    expenses = Expense.objects.filter(user_id__gte=lo, user_id__lt=hi)
+    if start:
+        expenses = expenses.filter(created_at__gte=start)
+    if end:
+        expenses = expenses.filter(created_at__lt=end)
+    # One row per (user, category), in cents so the sketches work on integers
+    rows = expenses.values('user_id', 'category_id') \
+        .annotate(cents=Cast(Round(Sum('amount') * 100), BigIntegerField()), expenses=Count('id')) \
+        .order_by('user_id') \
+        .values_list('user_id', 'category_id', 'cents', 'expenses') \
+        .iterator(chunk_size=5000)
+
+    current_user, user_total = None, 0
+    for user_id, category_id, cents, count in rows:
+        if user_id != current_user:
+            if current_user is not None:
+                stats.spend_per_user.add(user_total)
+            current_user, user_total = user_id, 0
+            stats.users_with_spend += 1
+        user_total += cents
+        stats.expenses += count
+        stats.spend_per_category[category_id].add(cents)
+    if current_user is not None:
+        stats.spend_per_user.add(user_total)
+
+    budgets = Budget.objects.filter(user_id__gte=lo, user_id__lt=hi)
+    stats.budgets = budgets.count()
+    stats.budgets_overrun = budgets.annotate(total_spent=Sum('expense__amount')) \
+        .filter(total_spent__gt=F('amount')) \
+        .count()
+
+    goals = Goal.objects.filter(user_id__gte=lo, user_id__lt=hi).aggregate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(current_amount__gte=F('target_amount'))),
+    )
+    stats.goals = goals['total']
+    stats.goals_completed = goals['completed']
+    return stats
+
+
+def _compute_partition_in_worker(user_range, start, end):
+    try:
+        return compute_partition(user_range, start, end)
+    finally:
+        connections.close_all()
+
+
+def user_ranges(partitions):
+    bounds = User.objects.aggregate(lo=Min('id'), hi=Max('id'))
+    if bounds['lo'] is None:
+        return []
+    lo, hi = bounds['lo'], bounds['hi'] + 1
+    step = max(1, math.ceil((hi - lo) / partitions))
+    return [(start, min(start + step, hi)) for start in range(lo, hi, step)]
+
+
+def compute_platform_stats(workers=1, partitions=None, start=None, end=None):
+    partitions = partitions or max(1, workers * 4)
+    ranges = user_ranges(partitions)
+    stats = PartialStats()
+
+    if workers > 1 and connections['default'].vendor == 'sqlite':
+        # Imported here rather than at module level, only the management command normally gets here
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            for partial in executor.map(_compute_partition_in_worker, ranges, [start] * len(ranges), [end] * len(ranges)):
+                stats.merge(partial)
+    else:
+        # Other databases parallelise a grouped scan themselves; partitions still bound memory
+        for user_range in ranges:
+            stats.merge(compute_partition(user_range, start, end))
+
+    category_names = dict(Category.objects.values_list('id', 'name'))
+    return {
+        'users': User.objects.count(),
+        'users_with_spend': stats.users_with_spend,
+        'expenses': stats.expenses,
+        'spend_per_user': stats.spend_per_user.summary(),
+        'spend_per_category': {
+            category_names.get(category_id, 'Uncategorised'): sketch.summary()
+            for category_id, sketch in sorted(stats.spend_per_category.items(), key=lambda item: item[0] or 0)
+        },
+        'budgets': stats.budgets,
+        'budget_overrun_rate': round(stats.budgets_overrun / stats.budgets, 4) if stats.budgets else None,
+        'goals': stats.goals,
+        # Redeemed goals are deleted, so this is the completion rate of the goals still open
+        'goal_completion_rate': round(stats.goals_completed / stats.goals, 4) if stats.goals else None,
+    }
@@ -0,0 +1,115 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.utils import timezone
+
+from .models import Budget, Expense
+from .sync import record_tombstone
+
+logger = logging.getLogger(__name__)
+
+# Soft delete and background purge of budgets.
+# Deleting a budget through the ORM makes Django's collector load every expense of the budget and
+# send a post_delete signal per row before deleting them, so the request time grows with the size
+# of the budget. Instead the request only stamps deleted_at, flags the expenses budget_deleted in a single
+# UPDATE (the default managers hide the budget and its expenses from then on) and records the sync tombstone; the rows are removed afterwards in
+# batches of BUDGET_PURGE_BATCH_SIZE, each its own short transaction.
+#
+# The batches are plain DELETE ... WHERE id IN (...) statements run through a cursor, not the collector: nothing
+# references an expense, and the per-row signals have nothing to do for a budget that is already
+# deleted as far as sync and the dashboard snapshot are concerned.
+
+
+def purge_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def soft_delete_budget(budget):
+    with transaction.atomic():
+        budget.deleted_at = timezone.now()
+        # The pre/post_save signals stamp change_seq and mark the dashboard snapshot stale
+        budget.save(update_fields=['deleted_at', 'updated_at'])
+        Expense.all_objects.filter(budget_id=budget.pk).update(budget_deleted=True)
+        record_tombstone(budget.user_id, budget)
+    if purge_setting('BUDGET_PURGE_ASYNC', True):
+        # Otherwise left to `manage.py purge_deleted_budgets`
+        transaction.on_commit(lambda: purger.schedule(budget.pk))
+
+
+def delete_rows(connection, model, ids, condition=''):
+    # DELETE ... WHERE pk IN (ids) [AND condition], bypassing the collector; returns the rows deleted
+    quote = connection.ops.quote_name
+    sql = 'DELETE FROM {} WHERE {} IN ({}){}'.format(
+        quote(model._meta.db_table), quote(model._meta.pk.column), ', '.join(['%s'] * len(ids)),
+        f' AND {condition}' if condition else '',
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(ids))
+        return cursor.rowcount
+
+
+def purge_budget(budget_id, batch_size=None):
+    # Returns the number of expenses removed; the budget row goes last so an interrupted purge is
+    # picked up again by the next run
+    batch_size = batch_size or purge_setting('BUDGET_PURGE_BATCH_SIZE', 1000)
+    connection = connections[router.db_for_write(Expense)]
+    expenses = Expense.all_objects.filter(budget_id=budget_id)
+    deleted = 0
+    while True:
+        ids = list(expenses.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        deleted += delete_rows(connection, Expense, ids)
+    delete_rows(connection, Budget, [budget_id], 'deleted_at IS NOT NULL')
+    return deleted
+
+
+def pending_budget_ids():
+    return list(Budget.all_objects.filter(deleted_at__isnull=False).order_by('deleted_at').values_list('pk', flat=True))
+
+
+class BudgetPurger:
+    def __init__(self):
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stats = {'budgets_purged': 0, 'expenses_purged': 0, 'failed': 0}
+
+    def _get_executor(self):
+        # One thread, so purges don't compete with requests for the database (created lazily, see
+        # SnapshotScheduler)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='budget-purge')
+        return self._executor
+
+    def schedule(self, budget_id):
+        with self._lock:
+            if budget_id in self._pending:
+                return
+            self._pending.add(budget_id)
+        self._get_executor().submit(self._run, budget_id)
+
+    def _run(self, budget_id):
+        try:
+            deleted = purge_budget(budget_id)
+            with self._lock:
+                self._stats['budgets_purged'] += 1
+                self._stats['expenses_purged'] += deleted
+        except Exception:
+            with self._lock:
+                self._stats['failed'] += 1
+            logger.exception("Purge failed for budget %s", budget_id)
+        finally:
+            with self._lock:
+                self._pending.discard(budget_id)
+            close_old_connections()
+
+    def metrics(self):
+        with self._lock:
+            return {'pending': len(self._pending), **self._stats}
+
+
+purger = BudgetPurger()
@@ -0,0 +1,228 @@
+import difflib
+import json
+import re
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import views
+from .currency import load_rates
+from .models import Budget, Category, Expense, Goal, Income
+
+# Query plan regression check for the hot endpoints: part of the test suite (api/tests/test_query_plans.py);
+# `manage.py check_query_plans` runs it on its own, prints the plans and stores new expectations.
+#
+# Each endpoint is called on a small fixture and every SELECT it runs is EXPLAINed. A plan is reduced to
+# two facts that survive database upgrades and fixture sizes: the tables read in full (a table scan, or
+# a scan of a whole index) and the indexes used. The facts of every endpoint are compared against the
+# expectations in api/query_plans.json, per database vendor: a table that starts being read in full or
+# an index that is no longer used is a regression; plans that only got better just ask for --update.
+
+EXPECTATIONS_FILE = __file__.rsplit('.', 1)[0] + '.json'
+SQLITE_ALIAS_PATTERN = re.compile(r'"(\w+)" (?:AS )?"?([A-Z]\d+)\b')
+
+# Endpoint name -> (view, query string). Reads only: the endpoints whose plans matter at scale.
+ENDPOINTS = {
+    'analytics': (views.analytics, {'month': 3, 'year': 2024}),
+    'analytics-buckets': (views.time_buckets, {'period': 'month', 'start': '2024-01-01', 'end': '2024-06-30'}),
+    'dashboard': (views.dashboard, {}),
+    'expense-list': (views.ExpenseListCreateView.as_view(), {}),
+    'expense-list-by-budget': (views.ExpenseListCreateView.as_view(), {'id': 'budget'}),
+    'expense-viewset-list': (views.ExpenseViewSet.as_view({'get': 'list'}), {}),
+    'budget-list': (views.BudgetListCreateView.as_view(), {}),
+    'income-list': (views.IncomeListCreateView.as_view(), {}),
+    'export': (views.ExportDataView.as_view(), {}),
+    'sync': (views.sync, {'since': 0}),
+}
+
+
+def create_fixture():
+    # A few users with a bit of everything, so the planner has more than one user's rows to skip
+    day = timezone.now().date() - timedelta(days=60)
+    load_rates((currency, day + timedelta(days=offset), Decimal(rate))
+               for currency, rate in (('USD', '1.08'), ('SGD', '1.45')) for offset in range(30))
+    categories = list(Category.objects.all())
+    users = [User.objects.create_user(f'plans-{i}', password='plans-password') for i in range(3)]
+    for user in users:
+        for b in range(3):
+            budget = Budget.objects.create(user=user, name=f'Budget {b}', amount=Decimal('300.00'), category=categories[b % len(categories)])
+            for e in range(20):
+                Expense.objects.create(budget=budget, name=f'Expense {e}', amount=Decimal(e + 1), category=categories[e % len(categories)],
+                                       currency='USD' if e % 4 == 0 else budget.currency)
+        Income.objects.create(user=user, name='Allowance', amount=Decimal('500.00'))
+        Goal.objects.create(user=user, name='Laptop', target_amount=Decimal('1500.00'))
+    return users[0]
+
+
+def capture_selects(run):
+    queries = []
+
+    def wrapper(execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            queries.append((sql, tuple(params or ())))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        run()
+    return queries
+
+
+def sqlite_plan(sql, params):
+    aliases = {alias: table for table, alias in SQLITE_ALIAS_PATTERN.findall(sql)}
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        details = [row[-1] for row in cursor.fetchall()]
+    tables = set(connection.introspection.table_names())
+    scans, indexes = set(), set()
+    for detail in details:
+        # e.g. "SCAN api_category", "SEARCH e USING INDEX api_expense_import_hash_idx (import_hash=?)",
+        # "SCAN U0 USING COVERING INDEX api_exchange_rate_unique"
+        words = detail.split()
+        if len(words) < 2 or words[0] not in ('SCAN', 'SEARCH'):
+            continue
+        table = aliases.get(words[1], words[1])
+        if table not in tables:
+            continue  # subqueries, CTEs, constant rows
+        if words[0] == 'SCAN':
+            scans.add(table)
+        if 'INDEX' in words:
+            index = words[words.index('INDEX') + 1]
+            indexes.add(f'{table}.{index}' if index.startswith('sqlite_autoindex') else index)
+        elif 'PRIMARY' in words or 'ROWID' in words:
+            indexes.add(f'{table}.pk')
+    return details, scans, indexes
+
+
+def partition_parents():
+    # Partition (table or index) -> its partitioned parent, so a plan reads the same whichever partition
+    # the fixture's user falls in (api/partitioning.py)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT c.relname, p.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                       "JOIN pg_class p ON p.oid = i.inhparent")
+        return dict(cursor.fetchall())
+
+
+def postgresql_plan(sql, params):
+    # With sequential scans discouraged, so the plan shows whether an index *can* serve the query
+    # rather than what the planner prefers for a fixture of a few rows
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    parents = partition_parents()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    details, scans, indexes = [], set(), set()
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        details.append(' '.join(filter(None, [node['Node Type'], node.get('Index Name'), node.get('Relation Name')])))
+        relation = parents.get(node.get('Relation Name'), node.get('Relation Name'))
+        if node['Node Type'] == 'Seq Scan':
+            scans.add(relation)
+        elif node.get('Index Name'):
+            indexes.add(parents.get(node['Index Name'], node['Index Name']))
+            if node['Node Type'] in ('Index Scan', 'Index Only Scan') and not node.get('Index Cond') and relation:
+                scans.add(relation)
+        nodes.extend(node.get('Plans', []))
+    return details, scans, indexes
+
+
+PLAN_READERS = {
+    'sqlite': sqlite_plan,
+    'postgresql': postgresql_plan,
+}
+
+
+def collect_plans(user):
+    """
+    {endpoint: {'scans': [...], 'indexes': [...], 'queries': [(sql, plan details, scans, indexes), ...]}}
+    for every endpoint in ENDPOINTS, called as `user`.
+    """
+    read_plan = PLAN_READERS.get(connection.vendor)
+    if read_plan is None:
+        raise ValueError(f"No query plan reader for {connection.vendor}")
+    factory = APIRequestFactory()
+    budget = Budget.objects.filter(user=user).order_by('id').first()
+    results = {}
+    for name, (view, params) in ENDPOINTS.items():
+        params = {key: budget.id if value == 'budget' else value for key, value in params.items()}
+        request = factory.get('/', params)
+        force_authenticate(request, user=user)
+        # Always computed, never served from a snapshot
+        with override_settings(DASHBOARD_SNAPSHOTS_ENABLED=False):
+            response = None
+
+            def call():
+                nonlocal response
+                response = view(request)
+                getattr(response, 'render', lambda: None)()
+            queries = capture_selects(call)
+        if response.status_code != 200:
+            raise ValueError(f"{name} answered {response.status_code}")
+        scans, indexes, planned = set(), set(), []
+        for sql, query_params in queries:
+            details, query_scans, query_indexes = read_plan(sql, query_params)
+            scans |= query_scans
+            indexes |= query_indexes
+            planned.append((sql, details, query_scans, query_indexes))
+        results[name] = {'scans': sorted(scans), 'indexes': sorted(indexes), 'queries': planned}
+    return results
+
+
+def load_expectations():
+    try:
+        with open(EXPECTATIONS_FILE) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_expectations(vendor, results):
+    expectations = load_expectations()
+    expectations[vendor] = {name: {'scans': result['scans'], 'indexes': result['indexes']} for name, result in results.items()}
+    with open(EXPECTATIONS_FILE, 'w') as file:
+        json.dump(expectations, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def compare(expected, results):
+    """
+    Returns (regressions, changes): readable reports of the endpoints whose plans got worse, and of those
+    that only changed for the better (or are new / gone).
+    """
+    regressions, changes = [], []
+    for name in sorted(set(expected) | set(results)):
+        if name not in results or name not in expected:
+            changes.append(f"{name}: {'no longer checked' if name in expected else 'no expectations yet'}")
+            continue
+        want, got = expected[name], results[name]
+        new_scans = sorted(set(got['scans']) - set(want['scans']))
+        lost_indexes = sorted(set(want['indexes']) - set(got['indexes']))
+        if not new_scans and not lost_indexes:
+            if want['scans'] != got['scans'] or want['indexes'] != got['indexes']:
+                changes.append(f"{name}: plans improved\n" + facts_diff(name, want, got))
+            continue
+
+        lines = [f"{name}: query plan regressed"]
+        lines += [f"  now reads all of {table}" for table in new_scans]
+        lines += [f"  no longer uses index {index}" for index in lost_indexes]
+        lines.append(facts_diff(name, want, got))
+        # The queries behind a new scan; which query lost an index can't be told, so then all of them
+        for sql, details, query_scans, query_indexes in got['queries']:
+            if lost_indexes or set(new_scans) & query_scans:
+                lines.append(f"  query: {sql[:300]}{'...' if len(sql) > 300 else ''}")
+                lines += [f"    | {detail}" for detail in details]
+        regressions.append('\n'.join(lines))
+    return regressions, changes
+
+
+def facts_diff(name, want, got):
+    def render(facts):
+        return [f"scan {table}" for table in facts['scans']] + [f"index {index}" for index in facts['indexes']]
+    diff = difflib.unified_diff(render(want), render(got), f'{name} (expected)', f'{name} (now)', lineterm='', n=len(render(want)))
+    return '\n'.join(f"  {line}" for line in diff)
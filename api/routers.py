@@ -0,0 +1,25 @@
+from django.conf import settings
+
+# ExpenseArchive goes to the EXPENSE_ARCHIVE_DATABASE alias when one is configured (see api/archive.py),
+# and nothing else does; without one, everything stays in the default database.
+
+
+class ExpenseArchiveRouter:
+    def archive_database(self, model):
+        if model._meta.label == 'api.ExpenseArchive':
+            return settings.EXPENSE_ARCHIVE_DATABASE
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.archive_database(model)
+
+    def db_for_write(self, model, **hints):
+        return self.archive_database(model)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        alias = settings.EXPENSE_ARCHIVE_DATABASE
+        if alias is None:
+            return None
+        if app_label == 'api' and model_name == 'expensearchive':
+            return db == alias
+        return db != alias
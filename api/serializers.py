@@ -1,5 +1,9 @@
+from datetime import timezone as dt_timezone
+
 from django.contrib.auth.models import User
+from django.utils import timezone
 from rest_framework import serializers
+from .currency import home_currency, normalise_currency, rate_table
 from .models import Budget, Expense, Income, Category, Goal, StudentDiscount
 
 class UserSerializer(serializers.ModelSerializer):
@@ -9,7 +13,6 @@ class UserSerializer(serializers.ModelSerializer):
         extra_kwargs = {"password": {"write_only": True}}
 
     def create(self, validated_data):
-        print(validated_data)
         user = User.objects.create_user(**validated_data)
         return user
 
@@ -18,39 +21,78 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name']
 
-class BudgetSerializer(serializers.ModelSerializer):
+class CurrencyMixin:
+    # currency is validated against the known exchange rates; home_amount is the amount in the requesting
+    # user's home currency (at the rate of the row's date, today's for budgets), see api/currency.py
+    converted_date_field = 'created_at'
+
+    def create(self, validated_data):
+        # Without a currency: the user's home currency
+        request = self.context.get('request')
+        if 'currency' not in validated_data and request is not None:
+            validated_data['currency'] = home_currency(request.user.id)
+        return super().create(validated_data)
+
+    def validate_currency(self, value):
+        try:
+            return normalise_currency(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+    def get_home_amount(self, obj):
+        request = self.context.get('request')
+        if request is None or obj.amount is None:
+            return None
+        day = getattr(obj, self.converted_date_field) if self.converted_date_field else timezone.now()
+        # Looked up once for all the rows of a list (the context is the list serializer's)
+        if 'home_currency' not in self.context:
+            self.context['home_currency'] = home_currency(request.user.id)
+        amount = rate_table().convert(obj.amount, obj.currency, self.context['home_currency'], day.astimezone(dt_timezone.utc).date())
+        return f"{amount:.2f}"
+
+class BudgetSerializer(CurrencyMixin, serializers.ModelSerializer):
+    converted_date_field = None
+    home_amount = serializers.SerializerMethodField()
 
     class Meta:
         model = Budget
-        fields = ["id", "user", "name", "amount", "created_at"]
+        fields = ["id", "user", "name", "amount", "currency", "home_amount", "created_at"]
         read_only_fields = ["id", "user", "created_at"]
 
-class ExpenseSerializer(serializers.ModelSerializer):
-    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
+class ExpenseSerializer(CurrencyMixin, serializers.ModelSerializer):
+    # Suggested from the name when left out (see api/categorisation.py)
+    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), required=False, allow_null=True)
+    home_amount = serializers.SerializerMethodField()
 
     class Meta:
         model = Expense
-        fields = ["id", "budget", "name", "amount", "created_at", "category"]
+        fields = ["id", "budget", "name", "amount", "currency", "home_amount", "created_at", "category"]
         read_only_fields = ["id", "created_at"]
     
     def create(self, validated_data):
         # Ensure the budget belongs to the authenticated user
         budget = validated_data.get('budget')
         request = self.context.get('request')
-        if budget.user != request.user:
+        if budget.user_id != request.user.id:
             raise serializers.ValidationError("This budget does not belong to the authenticated user.")
+        validated_data.setdefault('currency', budget.currency)
+        if 'category' not in validated_data:
+            from .categorisation import suggest_category  # imports api.sync, which imports this module
+            validated_data['category_id'] = suggest_category(request.user.id, validated_data.get('name'))
         return super().create(validated_data)
 
-class IncomeSerializer(serializers.ModelSerializer):
+class IncomeSerializer(CurrencyMixin, serializers.ModelSerializer):
+    home_amount = serializers.SerializerMethodField()
+
     class Meta:
         model = Income
-        fields = ["id", "name", "amount", "created_at"]
+        fields = ["id", "name", "amount", "currency", "home_amount", "created_at"]
         read_only_fields = ["id", "created_at"]
 
-class GoalSerializer(serializers.ModelSerializer):
+class GoalSerializer(CurrencyMixin, serializers.ModelSerializer):
     class Meta:
         model = Goal
-        fields = ['id', 'name', 'target_amount', 'current_amount', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'target_amount', 'current_amount', 'currency', 'created_at', 'updated_at']
         read_only_fields = ['id', 'current_amount', 'created_at', 'updated_at']
 
 
@@ -60,3 +102,84 @@ class StudentDiscountSerializer(serializers.ModelSerializer):
         model = StudentDiscount
         fields = ["message_id", "channel_id", "message", "date", "created_at", "channel_link", "discount_link"]
         read_only_fields = ["message_id", "channel_id", "message", "date", "created_at", "channel_link", "discount_link"]
+
+
+# Read-only serializers for the hot list endpoints.
+# They work on `.values()` rows instead of model instances, skipping model instantiation and the
+# per-field machinery of ModelSerializer, and produce the same representation as the serializers above
+# (decimals as fixed-point strings, datetimes as ISO 8601 in the current timezone).
+class ValuesSerializer:
+    fields = []
+    decimal_fields = []
+    datetime_fields = []
+    # With a home currency, `amount` is also given as home_amount (see CurrencyMixin)
+    converts_amount = False
+    converted_date_field = 'created_at'
+
+    def __init__(self, queryset, home_currency=None):
+        self.queryset = queryset
+        self.home_currency = home_currency if self.converts_amount else None
+
+    @property
+    def data(self):
+        return self.represent(self.rows())
+
+    def rows(self):
+        return self.queryset.values(*self.fields).iterator(chunk_size=2000)
+
+    def represent(self, rows):
+        # `rows` as the API returns them, from .values() rows or dicts shaped like them
+        decimal_fields = self.decimal_fields
+        datetime_fields = self.datetime_fields
+        tz = timezone.get_current_timezone()
+        home = self.home_currency
+        if home is not None:
+            convert = rate_table().convert
+            date_field = self.converted_date_field
+            today = timezone.now().astimezone(dt_timezone.utc).date()
+        represented = []
+        for row in rows:
+            if home is not None:
+                day = row[date_field].astimezone(dt_timezone.utc).date() if date_field else today
+                row['home_amount'] = convert(row['amount'], row['currency'], home, day)
+            for field in decimal_fields:
+                value = row.get(field)
+                if value is not None:
+                    row[field] = f"{value:.2f}"
+            for field in datetime_fields:
+                value = row[field]
+                if value is not None:
+                    value = value.astimezone(tz).isoformat()
+                    if value.endswith('+00:00'):
+                        value = value[:-6] + 'Z'
+                    row[field] = value
+            represented.append(row)
+        return represented
+
+class BudgetValuesSerializer(ValuesSerializer):
+    fields = ["id", "user", "name", "amount", "currency", "created_at"]
+    decimal_fields = ["amount", "home_amount"]
+    datetime_fields = ["created_at"]
+    converts_amount = True
+    converted_date_field = None
+
+class ExpenseValuesSerializer(ValuesSerializer):
+    fields = ["id", "budget", "name", "amount", "currency", "created_at", "category"]
+    decimal_fields = ["amount", "home_amount"]
+    datetime_fields = ["created_at"]
+    converts_amount = True
+
+class IncomeValuesSerializer(ValuesSerializer):
+    fields = ["id", "name", "amount", "currency", "created_at"]
+    decimal_fields = ["amount", "home_amount"]
+    datetime_fields = ["created_at"]
+    converts_amount = True
+
+class GoalValuesSerializer(ValuesSerializer):
+    fields = ['id', 'name', 'target_amount', 'current_amount', 'currency', 'created_at', 'updated_at']
+    decimal_fields = ['target_amount', 'current_amount']
+    datetime_fields = ['created_at', 'updated_at']
+
+class StudentDiscountValuesSerializer(ValuesSerializer):
+    fields = ["message_id", "channel_id", "message", "date", "created_at", "channel_link", "discount_link"]
+    datetime_fields = ["date", "created_at"]
@@ -0,0 +1,80 @@
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .authentication import set_user_status
+from .categorisation import reset_keywords
+from .edge import configure_connection, edge_serving
+from .models import Budget, Category, Expense, ExpenseArchive, Goal, Income
+from .snapshots import mark_stale
+from .sync import next_change_seq, record_tombstone
+
+# Any write to a user's data stamps it with the user's next sync change_seq (deletes leave a tombstone)
+# and invalidates their dashboard snapshot; changes to a user keep the JWT user-status cache current,
+# changes to the categories recompile the category keyword matcher; on an edge server, every new connection
+# to the per-user files is set up for them
+
+
+def owner_id(instance):
+    return instance.user_id
+
+
+def is_cascade(instance, origin):
+    # Deleted as a side effect of deleting something else (e.g. a budget's expenses)
+    origin_model = getattr(origin, 'model', type(origin))  # origin is an instance or a queryset
+    return origin is not None and origin_model is not type(instance)
+
+
+@receiver(pre_save, sender=Budget)
+@receiver(pre_save, sender=Expense)
+@receiver(pre_save, sender=Income)
+@receiver(pre_save, sender=Goal)
+def stamp_change_seq(sender, instance, **kwargs):
+    instance.change_seq = next_change_seq(owner_id(instance))
+
+
+@receiver(post_save, sender=Budget)
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Income)
+@receiver(post_save, sender=Goal)
+def user_data_saved(sender, instance, **kwargs):
+    mark_stale(owner_id(instance))
+
+
+@receiver(post_delete, sender=Budget)
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+@receiver(post_delete, sender=Goal)
+def user_data_deleted(sender, instance, **kwargs):
+    if is_cascade(instance, kwargs.get('origin')):
+        # The budget's own signal covers it
+        return
+    user_id = owner_id(instance)
+    record_tombstone(user_id, instance)
+    mark_stale(user_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    set_user_status(instance.pk, instance.is_active)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    set_user_status(instance.pk, False)
+    # Not a foreign key (it can be in another database), so not deleted by the cascade
+    ExpenseArchive.objects.filter(user_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def categories_changed(sender, **kwargs):
+    reset_keywords()
+
+
+@receiver(connection_created)
+def database_connected(sender, connection, **kwargs):
+    if edge_serving() and connection.alias == DEFAULT_DB_ALIAS:
+        configure_connection(connection)
@@ -0,0 +1,151 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .dashboard import compute_dashboard
+from .models import DashboardSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Background refresh of DashboardSnapshot rows.
+# A write marks the user's snapshot stale and (re)starts a per-user debounce timer; once the user's
+# writes have settled the recompute is handed to a small worker pool. A thread pool rather than a
+# process pool: the work is almost entirely DB round trips, and threads share the worker's
+# Django setup and connection handling.
+
+
+def snapshots_enabled():
+    return getattr(settings, 'DASHBOARD_SNAPSHOTS_ENABLED', True)
+
+
+class SnapshotScheduler:
+    def __init__(self, debounce_seconds, workers):
+        self.debounce_seconds = debounce_seconds
+        self.workers = workers
+        self._executor = None
+        self._timers = {}    # user_id -> pending debounce timer
+        self._queued = set()  # user ids submitted to the pool but not finished yet
+        self._lock = threading.Lock()
+        self._stats = {'computed': 0, 'failed': 0, 'compute_ms_total': 0.0, 'compute_ms_max': 0.0}
+
+    def _get_executor(self):
+        # Created lazily so nothing is started in a process that never writes (and so it's
+        # created after a gunicorn fork rather than inherited from the master)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='dashboard-snapshot')
+        return self._executor
+
+    def schedule(self, user_id):
+        with self._lock:
+            timer = self._timers.pop(user_id, None)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(self.debounce_seconds, self._submit, args=(user_id,))
+            timer.daemon = True
+            self._timers[user_id] = timer
+            timer.start()
+
+    def _submit(self, user_id):
+        with self._lock:
+            self._timers.pop(user_id, None)
+            if user_id in self._queued:
+                # Already waiting in the pool; it will read the latest data when it runs
+                return
+            self._queued.add(user_id)
+        self._get_executor().submit(self._run, user_id)
+
+    def _run(self, user_id):
+        try:
+            with self._lock:
+                self._queued.discard(user_id)
+            refresh_snapshot(user_id)
+        except Exception:
+            with self._lock:
+                self._stats['failed'] += 1
+            logger.exception("Dashboard snapshot refresh failed for user %s", user_id)
+        finally:
+            close_old_connections()
+
+    def record(self, compute_ms):
+        with self._lock:
+            self._stats['computed'] += 1
+            self._stats['compute_ms_total'] += compute_ms
+            self._stats['compute_ms_max'] = max(self._stats['compute_ms_max'], compute_ms)
+
+    def metrics(self):
+        with self._lock:
+            computed = self._stats['computed']
+            return {
+                'debouncing': len(self._timers),
+                'queue_depth': len(self._queued),
+                'computed': computed,
+                'failed': self._stats['failed'],
+                'compute_ms_avg': round(self._stats['compute_ms_total'] / computed, 2) if computed else None,
+                'compute_ms_max': round(self._stats['compute_ms_max'], 2),
+            }
+
+
+scheduler = SnapshotScheduler(
+    debounce_seconds=getattr(settings, 'DASHBOARD_SNAPSHOT_DEBOUNCE_SECONDS', 5),
+    workers=getattr(settings, 'DASHBOARD_SNAPSHOT_WORKERS', 2),
+)
+
+
+def snapshot_payload(user):
+    # The dashboard as the API renders it (Decimals as numbers), so a payload served from the JSON column
+    # has the same types as one computed for the request
+    return json.loads(json.dumps(compute_dashboard(user), cls=JSONEncoder))
+
+
+def refresh_snapshot(user_id):
+    user = User.objects.get(pk=user_id)
+    # The writes counted so far are in what we compute; one that lands meanwhile bumps write_count and
+    # keeps the snapshot stale
+    seen = DashboardSnapshot.objects.filter(user_id=user_id).values_list('write_count', flat=True).first()
+    started_at = timezone.now()
+    start = time.perf_counter()
+    payload = snapshot_payload(user)
+    compute_ms = (time.perf_counter() - start) * 1000
+    snapshot, created = DashboardSnapshot.objects.get_or_create(
+        user_id=user_id,
+        defaults={'payload': payload, 'computed_at': started_at, 'compute_ms': compute_ms},
+    )
+    if not created:
+        DashboardSnapshot.objects.filter(pk=snapshot.pk).update(
+            payload=payload, computed_at=started_at, compute_ms=compute_ms,
+        )
+        DashboardSnapshot.objects.filter(pk=snapshot.pk, write_count=seen).update(stale_since=None)
+    scheduler.record(compute_ms)
+    return payload
+
+
+def mark_stale(user_id):
+    if not snapshots_enabled():
+        return
+    DashboardSnapshot.objects.filter(user_id=user_id).mark_stale()
+    # Only start the timer once the write is actually committed, otherwise the worker could read old data
+    transaction.on_commit(lambda: scheduler.schedule(user_id))
+
+
+def get_snapshot(user):
+    # Returns (payload, snapshot) or (None, None) if there is no usable snapshot and the caller
+    # should compute synchronously
+    snapshot = DashboardSnapshot.objects.filter(user=user).first()
+    if snapshot is None:
+        return None, None
+    today = timezone.now().astimezone(timezone.get_current_timezone()).date()
+    if snapshot.payload.get('month') != today.month or snapshot.payload.get('year') != today.year:
+        return None, None
+    max_staleness = getattr(settings, 'DASHBOARD_SNAPSHOT_MAX_STALENESS_SECONDS', 60)
+    if snapshot.stale_since and (timezone.now() - snapshot.stale_since).total_seconds() > max_staleness:
+        # The background refresh should have run by now (worker busy or restarted), don't serve it
+        return None, None
+    return snapshot.payload, snapshot
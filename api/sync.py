@@ -0,0 +1,128 @@
+from django.db import transaction
+from django.db.models import F
+
+from .models import Budget, Expense, Income, Goal, SyncCounter, SyncTombstone
+from .serializers import BudgetValuesSerializer, ExpenseValuesSerializer, IncomeValuesSerializer, GoalValuesSerializer
+
+# Delta sync for offline clients.
+#
+# Every write to a user's budgets, expenses, income or goals stamps the row with the next value of the
+# user's SyncCounter (change_seq), and every delete leaves a SyncTombstone with its own change_seq.
+# A client keeps the cursor from its last sync and asks for everything with change_seq > cursor.
+#
+# The counter is bumped with UPDATE ... SET value = value + 1, which locks the user's counter row until
+# the writing transaction commits, so a user's changes commit in change_seq order and a cursor can never
+# skip over a change that commits later. Deleting a budget only leaves a tombstone for the budget,
+# clients drop its expenses along with it.
+
+SYNC_MODELS = {
+    'budgets': Budget,
+    'expenses': Expense,
+    'income': Income,
+    'goals': Goal,
+}
+
+
+def next_change_seq(user_id):
+    return reserve_change_seqs(user_id, 1)
+
+
+def reserve_change_seqs(user_id, count):
+    # `count` consecutive values, returns the first; for bulk writes that don't go through the pre_save
+    # signal (call it inside the transaction doing the writes so the counter row stays locked)
+    with transaction.atomic():
+        updated = SyncCounter.objects.filter(user_id=user_id).update(value=F('value') + count)
+        if not updated:
+            SyncCounter.objects.get_or_create(user_id=user_id)
+            SyncCounter.objects.filter(user_id=user_id).update(value=F('value') + count)
+        return SyncCounter.objects.filter(user_id=user_id).values_list('value', flat=True).get() - count + 1
+
+
+def current_change_seq(user_id):
+    return SyncCounter.objects.filter(user_id=user_id).values_list('value', flat=True).first() or 0
+
+
+def record_tombstone(user_id, instance):
+    model = next(name for name, model in SYNC_MODELS.items() if isinstance(instance, model))
+    SyncTombstone.objects.create(
+        user_id=user_id, model=model, object_id=instance.pk, change_seq=next_change_seq(user_id),
+    )
+
+
+class BudgetSyncSerializer(BudgetValuesSerializer):
+    fields = BudgetValuesSerializer.fields + ['updated_at', 'change_seq']
+    datetime_fields = ['created_at', 'updated_at']
+
+class ExpenseSyncSerializer(ExpenseValuesSerializer):
+    fields = ExpenseValuesSerializer.fields + ['updated_at', 'change_seq']
+    datetime_fields = ['created_at', 'updated_at']
+
+class IncomeSyncSerializer(IncomeValuesSerializer):
+    fields = IncomeValuesSerializer.fields + ['updated_at', 'change_seq']
+    datetime_fields = ['created_at', 'updated_at']
+
+class GoalSyncSerializer(GoalValuesSerializer):
+    fields = GoalValuesSerializer.fields + ['change_seq']
+
+SYNC_SERIALIZERS = {
+    'budgets': BudgetSyncSerializer,
+    'expenses': ExpenseSyncSerializer,
+    'income': IncomeSyncSerializer,
+    'goals': GoalSyncSerializer,
+}
+
+
+def sync_querysets(user):
+    return {
+        'budgets': Budget.objects.filter(user=user),
+        'expenses': Expense.objects.filter(user=user),
+        'income': Income.objects.filter(user=user),
+        'goals': Goal.objects.filter(user=user),
+    }
+
+
+def changes_since(user, cursor, limit=1000):
+    """
+    Everything that changed for `user` after `cursor`, as a compact payload: for each table the field
+    names once plus a list of value rows, and the ids deleted per table.
+
+    At most `limit` rows per table are returned; when a table has more, the new cursor stops at the
+    last change that fits and `has_more` tells the client to ask again.
+    """
+    upper = current_change_seq(user.id)
+
+    changed = {}
+    truncated_at = []
+    for name, queryset in sync_querysets(user).items():
+        rows = SYNC_SERIALIZERS[name](
+            queryset.filter(change_seq__gt=cursor, change_seq__lte=upper).order_by('change_seq')[:limit + 1]
+        ).data
+        if len(rows) > limit:
+            truncated_at.append(rows[limit - 1]['change_seq'])
+        changed[name] = rows
+
+    tombstones = list(
+        SyncTombstone.objects.filter(user=user, change_seq__gt=cursor, change_seq__lte=upper)
+        .order_by('change_seq')
+        .values_list('model', 'object_id', 'change_seq')[:limit + 1]
+    )
+    if len(tombstones) > limit:
+        truncated_at.append(tombstones[limit - 1][2])
+
+    has_more = bool(truncated_at)
+    if has_more:
+        upper = min(truncated_at)
+
+    payload = {'cursor': upper, 'has_more': has_more}
+    for name, rows in changed.items():
+        fields = SYNC_SERIALIZERS[name].fields
+        payload[name] = {
+            'fields': fields,
+            'rows': [[row[field] for field in fields] for row in rows if row['change_seq'] <= upper],
+        }
+    deleted = {name: [] for name in SYNC_MODELS}
+    for model, object_id, change_seq in tombstones:
+        if change_seq <= upper:
+            deleted[model].append(object_id)
+    payload['deleted'] = deleted
+    return payload
@@ -0,0 +1,210 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+# Per-process performance telemetry, exposed in Prometheus text format at /metrics:
+#   - request latency histograms per URL name (from api/urls.py), method and status
+#   - DB queries and DB time per request, per URL name
+#   - cache hit / miss counts (record_cache_access is called wherever we read a cache)
+#   - the dashboard snapshot, throttling and budget purge gauges
+#
+# gunicorn runs several worker processes, each with its own counters. When TELEMETRY_MULTIPROC_DIR
+# is set every worker periodically writes its counters to <dir>/<pid>.json and /metrics sums the
+# files of all workers, so whichever worker answers the scrape reports the whole server.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self.buckets = {}     # histogram name -> bucket bounds
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self.buckets[name] = buckets
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(buckets) + 2)
+            # Counts are per bucket here (values above the last bound only go in the count)
+            # and made cumulative when rendered
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def dump(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()],
+                'buckets': {name: list(buckets) for name, buckets in self.buckets.items()},
+            }
+
+
+registry = Registry()
+_last_flush = 0.0
+
+
+def multiproc_dir():
+    return getattr(settings, 'TELEMETRY_MULTIPROC_DIR', None)
+
+
+def flush(force=False):
+    # Write this process's counters for the other workers' /metrics (at most once a second)
+    global _last_flush
+    directory = multiproc_dir()
+    now = time.monotonic()
+    if not directory or (not force and now - _last_flush < getattr(settings, 'TELEMETRY_FLUSH_SECONDS', 1)):
+        return
+    _last_flush = now
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as file:
+        json.dump(registry.dump(), file)
+    os.replace(path + '.tmp', path)
+
+
+def collect():
+    # Merged counters of every worker (or just this process without a multiprocess directory)
+    directory = multiproc_dir()
+    if not directory:
+        dumps = [registry.dump()]
+    else:
+        flush(force=True)
+        dumps = []
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            try:
+                with open(path) as file:
+                    dumps.append(json.load(file))
+            except (OSError, ValueError):
+                continue  # being replaced right now, or a worker died mid-write
+
+    counters, histograms, buckets = {}, {}, {}
+    for dump in dumps:
+        buckets.update(dump['buckets'])
+        for name, labels, value in dump['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in dump['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [0] * len(values))
+            for index, value in enumerate(values):
+                merged[index] += value
+    return counters, histograms, buckets
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels) + '}'
+
+
+def render_prometheus(gauges=None):
+    counters, histograms, buckets = collect()
+    lines = []
+
+    for name in sorted({name for name, _labels in counters}):
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{format_labels(labels)} {value}')
+
+    for name in sorted({name for name, _labels in histograms}):
+        lines.append(f'# TYPE {name} histogram')
+        bounds = buckets[name]
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(bounds, values):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {values[-1]}')
+            lines.append(f'{name}_sum{format_labels(labels)} {values[-2]}')
+            lines.append(f'{name}_count{format_labels(labels)} {values[-1]}')
+
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def record_cache_access(cache_name, hit):
+    registry.inc('pennywise_cache_requests_total', (('cache', cache_name), ('result', 'hit' if hit else 'miss')))
+
+
+class TelemetryMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0, 0.0]
+
+        def count_queries(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries[0] += 1
+                queries[1] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        labels = (('view', view), ('method', request.method), ('status', str(response.status_code)))
+        registry.observe('pennywise_http_request_duration_seconds', elapsed, LATENCY_BUCKETS, labels)
+        registry.observe('pennywise_db_queries_per_request', queries[0], QUERY_COUNT_BUCKETS, (('view', view),))
+        registry.inc('pennywise_db_query_duration_seconds_total', (('view', view),), queries[1])
+        flush()
+        return response
+
+
+def metrics_view(request):
+    # Plain Django view (no DRF auth/throttling) so Prometheus can scrape it with METRICS_TOKEN. Without a
+    # token set, only staff logged in to the admin see it (there are no sessions on an edge server); to
+    # anyone else it doesn't exist.
+    from .edge import edge_serving
+
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponseForbidden()
+    elif edge_serving() or not request.user.is_staff:
+        raise Http404
+
+    from .purge import purger
+    from .snapshots import scheduler
+    from .throttling import throttle_metrics
+
+    snapshot_metrics = scheduler.metrics()
+    throttling = throttle_metrics()
+    # Per-process gauges (the worker answering the scrape)
+    gauges = {
+        'pennywise_snapshot_queue_depth': snapshot_metrics['queue_depth'],
+        'pennywise_snapshot_debouncing': snapshot_metrics['debouncing'],
+        'pennywise_snapshot_compute_ms_max': snapshot_metrics['compute_ms_max'],
+        'pennywise_throttle_in_flight': throttling['in_flight'],
+        'pennywise_budget_purge_pending': purger.metrics()['pending'],
+    }
+    return HttpResponse(render_prometheus(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
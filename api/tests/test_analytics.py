@@ -0,0 +1,99 @@
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api.models import Budget, Expense
+from api.tests import unthrottled
+from api.timebuckets import average_per_bucket, bucket_totals
+
+
+def at(year, month, day, hour=12):
+    return datetime(year, month, day, hour, tzinfo=dt_timezone.utc)
+
+
+class BucketTotalsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buckets', password='buckets-password')
+        self.budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'))
+
+    def expense(self, amount, created_at):
+        Expense.objects.create(budget=self.budget, name='expense', amount=Decimal(amount), created_at=created_at)
+
+    def test_months_with_gaps_and_changes(self):
+        self.expense('10.00', at(2024, 1, 5))
+        self.expense('20.00', at(2024, 3, 5))
+        self.expense('5.00', at(2024, 3, 20))
+        buckets = bucket_totals(Expense.objects.filter(user=self.user), 'month', date(2024, 1, 1), date(2024, 3, 31),
+                                ZoneInfo('UTC'))
+        self.assertEqual([b['bucket'] for b in buckets], [date(2024, 1, 1), date(2024, 2, 1), date(2024, 3, 1)])
+        self.assertEqual([b['total'] for b in buckets], [Decimal('10.00'), Decimal('0'), Decimal('25.00')])
+        self.assertEqual([b['count'] for b in buckets], [1, 0, 2])
+        self.assertEqual([b['change'] for b in buckets], [Decimal('10.00'), Decimal('-10.00'), Decimal('25.00')])
+        self.assertEqual(buckets[1]['change_pct'], Decimal('-100.00'))
+        self.assertIsNone(buckets[2]['change_pct'])
+
+    def test_first_bucket_compared_with_the_one_before_the_range(self):
+        self.expense('40.00', at(2023, 12, 31))
+        self.expense('10.00', at(2024, 1, 1))
+        buckets = bucket_totals(Expense.objects.filter(user=self.user), 'month', date(2024, 1, 1), date(2024, 1, 31),
+                                ZoneInfo('UTC'))
+        self.assertEqual(buckets[0]['change'], Decimal('-30.00'))
+        self.assertEqual(buckets[0]['change_pct'], Decimal('-75.00'))
+
+    def test_boundaries_in_the_given_timezone(self):
+        # 23:00 UTC on Jan 31st is already February in Singapore
+        self.expense('10.00', at(2024, 1, 31, hour=23))
+        buckets = bucket_totals(Expense.objects.filter(user=self.user), 'month', date(2024, 1, 1), date(2024, 2, 29),
+                                ZoneInfo('Asia/Singapore'))
+        self.assertEqual([b['total'] for b in buckets], [Decimal('0'), Decimal('10.00')])
+
+    def test_without_gap_filling(self):
+        self.expense('10.00', at(2024, 1, 5))
+        buckets = bucket_totals(Expense.objects.filter(user=self.user), 'week', date(2024, 1, 1), date(2024, 1, 31),
+                                ZoneInfo('UTC'), fill_gaps=False)
+        self.assertEqual([b['bucket'] for b in buckets], [date(2024, 1, 1)])
+
+    def test_bad_ranges(self):
+        queryset = Expense.objects.filter(user=self.user)
+        with self.assertRaises(ValueError):
+            bucket_totals(queryset, 'month', date(2024, 2, 1), date(2024, 1, 1))
+        with self.assertRaises(ValueError):
+            bucket_totals(queryset, 'fortnight', date(2024, 1, 1), date(2024, 2, 1))
+        with self.assertRaises(ValueError):
+            bucket_totals(queryset, 'day', date(2000, 1, 1), date(2024, 1, 1))
+
+    def test_average_ignores_the_months_before_the_first_expense(self):
+        buckets = [{'total': Decimal('0'), 'count': 0}, {'total': Decimal('30'), 'count': 1}, {'total': Decimal('0'), 'count': 0}]
+        self.assertEqual(average_per_bucket(buckets), Decimal('15.00'))
+        self.assertIsNone(average_per_bucket(buckets[:1]))
+
+
+@unthrottled
+class AnalyticsParametersTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('analytics', password='analytics-password'))
+
+    def test_month_and_year(self):
+        for params in ({'month': 3, 'year': 2024}, {'month': 'March', 'year': 2024}, {'month': 1, 'year': 2}):
+            self.assertEqual(self.client.get('/api/analytics/', params).status_code, 200, params)
+
+    def test_bad_month_or_year(self):
+        for params in ({'month': 0}, {'month': 13}, {'month': 'abc'}, {'year': 'abc'}, {'year': 0}, {'year': 1},
+                       {'year': 10000}):
+            response = self.client.get('/api/analytics/', params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
+
+    def test_ranges_at_the_ends_of_the_calendar(self):
+        for params in ({'start': '0001-01-01', 'end': '0001-01-05', 'period': 'day'},
+                       {'start': '9999-12-25', 'end': '9999-12-31', 'period': 'day'},
+                       {'start': '9999-01-01', 'end': '9999-12-31', 'period': 'year'},
+                       {'end': '0001-01-05'}):
+            response = self.client.get('/api/analytics/buckets/', params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
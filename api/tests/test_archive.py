@@ -0,0 +1,65 @@
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from openpyxl import load_workbook
+from rest_framework.test import APIClient
+
+from api.archive import archive_cutoff, archive_expenses, archive_user, archived_expenses
+from api.models import Budget, DashboardSnapshot, Expense, ExpenseArchive
+from api.snapshots import refresh_snapshot
+from api.tests import unthrottled
+
+
+def at(year, month, day):
+    return datetime(year, month, day, 12, tzinfo=dt_timezone.utc)
+
+
+@unthrottled
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('archive', password='archive-password')
+        self.budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'))
+        self.old = [Expense.objects.create(budget=self.budget, name=f'old {i}', amount=Decimal('1.50'),
+                                           created_at=at(2018, 1, i + 1)) for i in range(5)]
+        self.recent = Expense.objects.create(budget=self.budget, name='recent', amount=Decimal('9.99'),
+                                             created_at=at(2024, 3, 1))
+
+    def test_cutoff(self):
+        self.assertEqual(archive_cutoff(3, date(2024, 3, 15)).date(), date(2021, 3, 15))
+        self.assertEqual(archive_cutoff(1, date(2024, 2, 29)).date(), date(2023, 2, 28))
+
+    def test_archive_in_chunks(self):
+        self.assertEqual(archive_user(self.user.id, at(2020, 1, 1), chunk_size=2), 5)
+        self.assertEqual(list(Expense.objects.filter(user=self.user)), [self.recent])
+        chunks = ExpenseArchive.objects.filter(user_id=self.user.id).order_by('first_day')
+        self.assertEqual([(c.first_day, c.last_day, c.count) for c in chunks], [
+            (date(2018, 1, 1), date(2018, 1, 2), 2), (date(2018, 1, 3), date(2018, 1, 4), 2), (date(2018, 1, 5), date(2018, 1, 5), 1),
+        ])
+        self.assertEqual([(row[0], row[1], row[3], row[4]) for row in archived_expenses(self.user.id)],
+                         [(e.id, e.created_at.date(), e.amount, e.name) for e in self.old])
+
+        # Nothing left to archive
+        self.assertEqual(archive_expenses(years=3), (0, 0))
+
+    def test_interrupted_run_is_read_once(self):
+        archive_user(self.user.id, at(2020, 1, 1))
+        # As left by a run interrupted between the chunk and the delete
+        ExpenseArchive.objects.create(user_id=self.user.id, first_day=date(2018, 1, 1), last_day=date(2018, 1, 5),
+                                      count=5, data=ExpenseArchive.objects.get(user_id=self.user.id).data)
+        self.assertEqual(len(list(archived_expenses(self.user.id))), 5)
+
+    def test_marks_the_snapshot_stale(self):
+        refresh_snapshot(self.user.id)
+        archive_user(self.user.id, at(2020, 1, 1))
+        self.assertTrue(DashboardSnapshot.objects.get(user=self.user).is_stale())
+
+    def test_export_includes_archived_expenses(self):
+        archive_user(self.user.id, at(2020, 1, 1))
+        client = APIClient()
+        client.force_authenticate(self.user)
+        workbook = load_workbook(BytesIO(client.get('/api/export/').content))
+        names = [row[3] for row in workbook['Expenses'].values][1:]
+        self.assertEqual(names, [e.name for e in self.old] + ['recent'])
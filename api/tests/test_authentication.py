@@ -0,0 +1,84 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.authentication import USER_STATUS_CACHE_KEY, ClaimsJWTAuthentication
+from api.models import LazyUser
+from api.tests import unthrottled
+
+
+@unthrottled
+class ClaimsJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('claims', password='claims-password', email='claims@example.com')
+        self.addCleanup(cache.delete, USER_STATUS_CACHE_KEY.format(self.user.id))
+
+    def authenticate(self, user=None):
+        request = RequestFactory().get('/api/budgets/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user or self.user)}')
+        return ClaimsJWTAuthentication().authenticate(request)[0]
+
+    def get(self, token=None):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token or AccessToken.for_user(self.user)}')
+        return client.get('/api/budgets/')
+
+    def test_user_loaded_on_first_use(self):
+        self.authenticate()  # the status is cached from here on
+        with CaptureQueriesContext(connection) as queries:
+            user = self.authenticate()
+        self.assertEqual(len(queries), 0)
+        self.assertIsInstance(user, LazyUser)
+        self.assertEqual(user.id, self.user.id)
+
+        # Any other field loads the whole row, once
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual((user.username, user.email, user.is_staff), ('claims', 'claims@example.com', False))
+        self.assertEqual(len(queries), 1)
+
+    def test_inactive_and_deleted_users(self):
+        self.assertEqual(self.get().status_code, 200)
+        # The User signals update the cached status at once, not after JWT_USER_STATUS_CACHE_TTL
+        self.user.is_active = False
+        self.user.save()
+        self.assertIs(cache.get(USER_STATUS_CACHE_KEY.format(self.user.id)), False)
+        self.assertEqual(self.get().status_code, 401)
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.get().status_code, 200)
+        token, user_id = AccessToken.for_user(self.user), self.user.id
+        self.user.delete()
+        self.assertIs(cache.get(USER_STATUS_CACHE_KEY.format(user_id)), False)
+        self.assertEqual(self.get(token).status_code, 401)
+
+    def test_status_read_from_the_database(self):
+        # Changed without the signals (another process's cache, a queryset update): found once the entry expires
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        cache.delete(USER_STATUS_CACHE_KEY.format(self.user.id))
+        self.assertEqual(self.get().status_code, 401)
+
+    @override_settings(JWT_USER_STATUS_CACHE_TTL=None)
+    def test_token_alone(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsInstance(self.authenticate(), LazyUser)
+        self.assertEqual(len(queries), 0)
+
+    def test_fallback_to_the_user_row(self):
+        # Revocable tokens need the password hash: the whole row is loaded up front, as by simplejwt
+        with mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True):
+            user = self.authenticate()
+            self.assertNotIsInstance(user, LazyUser)
+            self.assertEqual(user.username, 'claims')
+            self.user.is_active = False
+            self.user.save()
+            with self.assertRaises(AuthenticationFailed) as raised:
+                self.authenticate()
+        self.assertEqual(raised.exception.detail['code'], 'user_inactive')
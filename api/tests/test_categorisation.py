@@ -0,0 +1,80 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from api.categorisation import KeywordAutomaton, categorise_names, get_matchers, normalise_name, recategorise_user
+from api.models import Budget, Category, DashboardSnapshot, Expense
+from api.snapshots import refresh_snapshot
+from api.sync import current_change_seq
+
+
+class KeywordAutomatonTests(TestCase):
+    def test_whole_words(self):
+        automaton = KeywordAutomaton([('tea', 'tea'), ('bubble tea', 'bubble tea'), ('grab', 'grab'),
+                                      ('grab food', 'grab food'), ('food court', 'food court')])
+        self.assertEqual(sorted(value for _length, value in automaton.matches('grab food court bubble tea')),
+                         ['bubble tea', 'food court', 'grab', 'grab food', 'tea'])
+        self.assertEqual(list(automaton.matches('steam teas grabbed')), [])
+        self.assertEqual(list(automaton.matches('')), [])
+
+    def test_normalise_name(self):
+        self.assertEqual(normalise_name('  McDonald\'s #12 Lunch!! '), 'mcdonald s lunch')
+        self.assertEqual(normalise_name(None), '')
+
+
+class CategorisationTests(TestCase):
+    def setUp(self):
+        # The matchers keep each user's learned mapping in memory, and ids can be reused after a rollback
+        get_matchers.cache_clear()
+        self.addCleanup(get_matchers.cache_clear)
+        self.user = User.objects.create_user('categories', password='categories-password')
+        self.budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'))
+        self.food, self.transport, self.shopping = (Category.objects.get(name=name) for name in ('Food', 'Transport', 'Shopping'))
+
+    def expense(self, name, category=None):
+        return Expense.objects.create(budget=self.budget, name=name, amount=Decimal('1.00'), category=category)
+
+    def test_keywords(self):
+        self.assertEqual(categorise_names(self.user.id, ['Lunch at the hawker', 'GRAB FOOD', 'Grab to school', 'Rent', '']), [
+            (self.food.id, 'keywords'), (self.food.id, 'keywords'), (self.transport.id, 'keywords'), (None, None), (None, None),
+        ])
+
+    def test_history_comes_first(self):
+        self.expense('Kopi', self.shopping)
+        self.assertEqual(categorise_names(self.user.id, ['kopi!']), [(self.shopping.id, 'history')])
+        # The latest expense of a name wins, picked up incrementally
+        self.expense('KOPI', self.transport)
+        self.assertEqual(categorise_names(self.user.id, ['kopi']), [(self.transport.id, 'history')])
+        # Other users' history isn't used
+        other = User.objects.create_user('other', password='other-password')
+        self.assertEqual(categorise_names(other.id, ['kopi']), [(self.food.id, 'keywords')])
+
+    def test_deleted_expenses_are_forgotten(self):
+        first = self.expense('Kopi', self.shopping)
+        self.assertEqual(categorise_names(self.user.id, ['kopi']), [(self.shopping.id, 'history')])
+        second = self.expense('Kopi', self.transport)
+        self.assertEqual(categorise_names(self.user.id, ['kopi']), [(self.transport.id, 'history')])
+        second.delete()
+        self.assertEqual(categorise_names(self.user.id, ['kopi']), [(self.shopping.id, 'history')])
+        first.delete()
+        self.assertEqual(categorise_names(self.user.id, ['kopi']), [(self.food.id, 'keywords')])
+
+    def test_recategorise_user(self):
+        refresh_snapshot(self.user.id)
+        lunch, bus, rent = self.expense('Lunch'), self.expense('Bus to school'), self.expense('Rent')
+        shoes = self.expense('Shoes', self.food)
+        before = current_change_seq(self.user.id)
+        self.assertEqual(recategorise_user(self.user.id, chunk_size=2), 2)
+        self.assertEqual([Expense.objects.get(pk=e.pk).category_id for e in (lunch, bus, rent, shoes)],
+                         [self.food.id, self.transport.id, None, self.food.id])
+        self.assertEqual(sorted(Expense.objects.filter(pk__in=[lunch.pk, bus.pk]).values_list('change_seq', flat=True)),
+                         [before + 1, before + 2])
+        self.assertTrue(DashboardSnapshot.objects.get(user=self.user).is_stale())
+
+        # All of them: the user's own pick for the shoes is learned, and wins over the keywords
+        self.assertEqual(recategorise_user(self.user.id, only_uncategorised=False), 0)
+        shoes.delete()
+        self.expense('shoes')
+        self.assertEqual(recategorise_user(self.user.id), 1)
+        self.assertEqual(Expense.objects.get(name='shoes').category_id, self.shopping.id)
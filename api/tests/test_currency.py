@@ -0,0 +1,121 @@
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.db.models import Sum
+from django.utils import timezone
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from api.currency import RateTable, in_home_currency, load_rates, rate_table, read_rates
+from api.models import Budget, DashboardSnapshot, ExchangeRate, Expense, HomeCurrency
+from api.snapshots import refresh_snapshot
+from api.tests import unthrottled
+
+RATES = [
+    ('SGD', date(2024, 3, 1), Decimal('1.45')),
+    ('SGD', date(2024, 3, 4), Decimal('1.46')),
+    ('USD', date(2024, 3, 1), Decimal('1.08')),
+]
+
+
+@override_settings(FX_BASE_CURRENCY='EUR', DEFAULT_CURRENCY='SGD')
+class RateTableTests(TestCase):
+    def setUp(self):
+        self.table = RateTable(RATES)
+
+    def test_rate_of_a_day(self):
+        self.assertEqual(self.table.rate('SGD', date(2024, 3, 1)), Decimal('1.45'))
+        # Weekends use the last rate before, days before the first rate the first one
+        self.assertEqual(self.table.rate('SGD', date(2024, 3, 3)), Decimal('1.45'))
+        self.assertEqual(self.table.rate('SGD', date(2024, 3, 10)), Decimal('1.46'))
+        self.assertEqual(self.table.rate('SGD', date(2023, 1, 1)), Decimal('1.45'))
+        self.assertEqual(self.table.rate('EUR', date(2024, 3, 1)), Decimal(1))
+        self.assertIsNone(self.table.rate('JPY', date(2024, 3, 1)))
+
+    def test_convert(self):
+        day = date(2024, 3, 2)
+        self.assertEqual(self.table.convert(Decimal('10.00'), 'USD', 'SGD', day), Decimal('13.43'))
+        self.assertEqual(self.table.convert(Decimal('10.00'), 'EUR', 'SGD', day), Decimal('14.50'))
+        self.assertEqual(self.table.convert(Decimal('14.50'), 'SGD', 'EUR', day), Decimal('10.00'))
+        self.assertEqual(self.table.convert(Decimal('10.00'), 'SGD', 'SGD', day), Decimal('10.00'))
+        self.assertEqual(self.table.convert(Decimal('10.00'), 'JPY', 'EUR', day), Decimal('10.00'))  # no rates: 1:1
+        self.assertIsNone(self.table.convert(None, 'USD', 'SGD', day))
+
+
+class ReadRatesTests(TestCase):
+    def test_long_layout(self):
+        rows = list(read_rates(StringIO('date,currency,rate\n2024-03-01,sgd,1.45\n\n2024-03-01,USD,1.08\n')))
+        self.assertEqual(rows, [('SGD', date(2024, 3, 1), Decimal('1.45')), ('USD', date(2024, 3, 1), Decimal('1.08'))])
+
+    def test_wide_layout(self):
+        rows = list(read_rates(StringIO('Date,USD,SGD,\n2024-03-04,1.09,N/A,\n2024-03-01,1.08,1.45,\n')))
+        self.assertEqual(rows, [('USD', date(2024, 3, 4), Decimal('1.09')), ('USD', date(2024, 3, 1), Decimal('1.08')),
+                                ('SGD', date(2024, 3, 1), Decimal('1.45'))])
+
+    def test_bad_files(self):
+        for text in ('Currency,Rate\nSGD,1.45\n', 'Date,SGD\n2024-03-01,-1\n', 'Date,SGD\n01/03/2024,1.45\n',
+                     'Date,S1\n2024-03-01,1.45\n', 'Date,SGD\n2024-03-01,abc\n'):
+            with self.assertRaises(ValueError, msg=text):
+                list(read_rates(StringIO(text)))
+
+
+@unthrottled
+@override_settings(FX_BASE_CURRENCY='EUR', DEFAULT_CURRENCY='SGD')
+class ConversionTests(TestCase):
+    def setUp(self):
+        load_rates(RATES)
+        self.user = User.objects.create_user('currency', password='currency-password')
+        self.budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'), currency='SGD')
+
+    def tearDown(self):
+        # The rates are rolled back, the worker's rate table has to follow
+        load_rates([])
+
+    def expense(self, amount, currency, day):
+        return Expense.objects.create(budget=self.budget, name='expense', amount=Decimal(amount), currency=currency,
+                                      created_at=datetime(day.year, day.month, day.day, 12, tzinfo=dt_timezone.utc))
+
+    def test_sql_matches_the_rate_table(self):
+        expenses = [self.expense('10.00', 'USD', date(2024, 3, 2)), self.expense('3.33', 'EUR', date(2024, 3, 5)),
+                    self.expense('7.00', 'SGD', date(2024, 3, 5)), self.expense('1.00', 'JPY', date(2024, 3, 5)),
+                    self.expense('2.50', 'USD', date(2024, 2, 1))]
+        for home in ('SGD', 'EUR', 'USD'):
+            converted = Expense.objects.filter(user=self.user).order_by('id').annotate(home=in_home_currency(home))
+            expected = [rate_table().convert(e.amount, e.currency, home, e.created_at.date()) for e in expenses]
+            self.assertEqual([row.home for row in converted], expected, home)
+            total = Expense.objects.filter(user=self.user).aggregate(total=Sum(in_home_currency(home)))['total']
+            self.assertEqual(total, sum(expected), home)
+
+    def test_loading_rates_reloads_the_table(self):
+        refresh_snapshot(self.user.id)
+        table = rate_table()
+        load_rates([('USD', date(2024, 3, 4), Decimal('1.10'))])
+        self.assertIsNot(rate_table(), table)
+        self.assertEqual(rate_table().rate('USD', date(2024, 3, 5)), Decimal('1.10'))
+        self.assertTrue(DashboardSnapshot.objects.get(user=self.user).is_stale())
+
+    @override_settings(FX_RATES_CHECK_SECONDS=0)
+    def test_changes_by_other_workers(self):
+        # As left by load_fx_rates or a currency PUT in another process, which this one's memory knows nothing of
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(rate_table().rate('USD', date(2024, 3, 5)), Decimal('1.08'))
+        ExchangeRate.objects.filter(currency='USD').update(rate=Decimal('1.10'), updated_at=timezone.now())
+        self.assertEqual(rate_table().rate('USD', date(2024, 3, 5)), Decimal('1.10'))
+        ExchangeRate.objects.filter(currency='USD').delete()
+        self.assertIsNone(rate_table().rate('USD', date(2024, 3, 5)))
+
+        self.assertEqual(client.get('/api/currency/').json()['home_currency'], 'SGD')
+        HomeCurrency.objects.create(user=self.user, currency='EUR')
+        self.assertEqual(client.get('/api/currency/').json()['home_currency'], 'EUR')
+
+    def test_home_currency_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/currency/').json(), {'home_currency': 'SGD', 'currencies': ['EUR', 'SGD', 'USD']})
+        self.assertEqual(client.put('/api/currency/', {'currency': 'usd'}).json()['home_currency'], 'USD')
+        self.assertEqual(client.get('/api/currency/').json()['home_currency'], 'USD')
+        for currency in ('JPY', 'dollars', ''):
+            self.assertEqual(client.put('/api/currency/', {'currency': currency}).status_code, 400, currency)
@@ -0,0 +1,126 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from api.discounts import bump_feed_version, feed_version, ingest_messages
+from api.models import DiscountBand, StudentDiscount
+from api.tests import unthrottled
+
+
+DEAL = ('Students get 20 percent off all drinks at the campus cafe from Monday to Friday when you show '
+        'your student card at the counter before noon')
+
+
+def at(day, hour=12):
+    return datetime(2024, 7, day, hour, tzinfo=dt_timezone.utc)
+
+
+def message(message_id, text, day, channel_id=100):
+    return {'id': message_id, 'peer_id': {'channel_id': channel_id}, 'message': text, 'date': at(day).isoformat()}
+
+
+@unthrottled
+@override_settings(TIME_ZONE='UTC', DISCOUNT_FEED_PAGE_SIZE=3, DISCOUNT_FEED_MAX_LIMIT=4)
+class DiscountFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()  # cached pages of other tests' rows
+        self.addCleanup(cache.clear)
+        rows = [(1, 100, 'Free fries with any burger bit.ly/fries', at(1)),
+                (2, 100, 'Half price bubble tea this weekend', at(2)),
+                (3, 200, 'Student meal at 5 dollars bit.ly/meal', at(3)),
+                (4, 200, 'Cinema tickets at 8 dollars on weekdays', at(4)),
+                (5, 300, 'Ten percent off laptops bit.ly/laptop', at(5))]
+        for message_id, channel_id, message, date in rows:
+            StudentDiscount.objects.create(message_id=message_id, channel_id=channel_id, message=message, date=date)
+        self.client = APIClient()
+
+    def feed(self, **params):
+        response = self.client.get('/api/student-discount/', params)
+        self.assertEqual(response.status_code, 200, params)
+        return [row['message_id'] for row in response.json()]
+
+    def test_filters(self):
+        self.assertEqual(self.feed(since='2024-07-02', until='2024-07-03'), [3, 2])
+        self.assertEqual(self.feed(channel='100,300'), [5, 2, 1])
+        self.assertEqual(self.feed(has_link='true'), [5, 3, 1])
+        self.assertEqual(self.feed(has_link='false', channel='200'), [4])
+        for params in ({'since': '07/01/2024'}, {'channel': 'abc'}, {'has_link': 'yes'}, {'limit': '-1'}, {'offset': 'x'}):
+            self.assertEqual(self.client.get('/api/student-discount/', params).status_code, 400, params)
+
+    def test_paging(self):
+        # Newest first, DISCOUNT_FEED_PAGE_SIZE without a limit and never more than DISCOUNT_FEED_MAX_LIMIT
+        self.assertEqual(self.feed(), [5, 4, 3])
+        self.assertEqual(self.feed(offset=3), [2, 1])
+        self.assertEqual(self.feed(limit=2, offset=1), [4, 3])
+        self.assertEqual(self.feed(limit=100), [5, 4, 3, 2])
+        response = self.client.get('/api/student-discount/')
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_facets(self):
+        # Under every filter but the channel one, and the same for every page
+        response = self.client.get('/api/student-discount/facets/', {'channel': '100', 'since': '2024-07-02', 'limit': 1})
+        self.assertEqual(response.json(), {'total': 4, 'with_link': 2, 'channels': [
+            {'channel_id': 200, 'count': 2, 'with_link': 1},
+            {'channel_id': 100, 'count': 1, 'with_link': 0},
+            {'channel_id': 300, 'count': 1, 'with_link': 1},
+        ]})
+
+    def test_cached_until_the_feed_version_changes(self):
+        self.assertEqual(self.feed(), [5, 4, 3])
+        StudentDiscount.objects.create(message_id=6, channel_id=300, message='Free gym trial for students', date=at(6))
+        self.assertEqual(self.feed(), [5, 4, 3])
+        bump_feed_version()
+        self.assertEqual(self.feed(), [6, 5, 4])
+
+
+class DiscountIngestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_duplicates_collapse(self):
+        stats = ingest_messages([
+            message(1, DEAL + ' bit.ly/cafe', 1),
+            message(2, '🔥 ' + DEAL.upper() + '!! bit.ly/cafe2', 1, channel_id=200),  # exact: same words
+            message(3, DEAL + ' this week only', 1),  # near-duplicate
+            message(4, 'Free entry to the museum on Sundays for all students with a valid card', 1),
+            message(5, '', 1),  # service message
+        ])
+        self.assertEqual(stats, {'created': 2, 'updated': 0, 'duplicates': 2, 'skipped': 1})
+        self.assertEqual(StudentDiscount.objects.count(), 2)
+        self.assertEqual(DiscountBand.objects.count(), 16)
+
+    def test_reingest_changes_nothing(self):
+        messages = [message(1, DEAL, 1), message(2, DEAL + ' this week only', 2)]
+        ingest_messages(messages)
+        rows = list(StudentDiscount.objects.values())
+        version = feed_version()
+        # The entry is the newer message now, the older one is matched again and only counted
+        self.assertEqual(ingest_messages(messages), {'created': 0, 'updated': 0, 'duplicates': 1, 'skipped': 1})
+        self.assertEqual(list(StudentDiscount.objects.values()), rows)
+        self.assertEqual(feed_version(), version)
+
+    def test_newer_repost_replaces_the_entry(self):
+        ingest_messages([message(1, DEAL + ' bit.ly/old', 1)])
+        version = feed_version()
+        stats = ingest_messages([message(2, DEAL + ' this week only bit.ly/new', 3), message(3, DEAL, 2)])
+        self.assertEqual(stats, {'created': 0, 'updated': 1, 'duplicates': 2, 'skipped': 0})
+        discount = StudentDiscount.objects.get()
+        self.assertEqual((discount.message_id, discount.date, discount.discount_link), (2, at(3), 'bit.ly/new'))
+        self.assertEqual(discount.bands.count(), 8)
+        self.assertNotEqual(feed_version(), version)
+
+        # An older one is only counted
+        stats = ingest_messages([message(4, DEAL + ' bit.ly/older', 1)])
+        self.assertEqual(stats, {'created': 0, 'updated': 0, 'duplicates': 1, 'skipped': 0})
+        self.assertEqual(StudentDiscount.objects.get().message_id, 2)
+
+    def test_rows_saved_outside_the_ingestion(self):
+        # save() writes the same fingerprints, so a near-duplicate repost is found
+        StudentDiscount.objects.create(message_id=1, channel_id=100, message=DEAL, date=at(1))
+        self.assertEqual(DiscountBand.objects.count(), 8)
+        stats = ingest_messages([message(2, DEAL + ' this week only', 2)])
+        self.assertEqual((stats['created'], stats['updated']), (0, 1))
+        self.assertEqual(StudentDiscount.objects.get().message_id, 2)
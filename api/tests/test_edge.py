@@ -0,0 +1,130 @@
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.edge import EdgeServingMiddleware, common_file, export_edge_files, user_file
+from api.models import Budget, Category, DashboardSnapshot, Expense, Goal
+from api.snapshots import mark_stale, refresh_snapshot, snapshot_payload
+from api.writequeue import queue_savings
+
+# Run in a child process started with EDGE_SERVING: GETs as the user, printed as {path: [status, body]}
+SERVE_SCRIPT = '''
+import json, os, sys
+import django
+django.setup()
+from rest_framework.test import APIClient
+client = APIClient()
+client.credentials(HTTP_AUTHORIZATION='Bearer ' + os.environ['EDGE_TEST_TOKEN'])
+results = {}
+for path in sys.argv[1:]:
+    response = client.generic(path.split(' ')[0], path.split(' ')[1])
+    results[path] = [response.status_code, response.json() if response.content else None]
+print(json.dumps(results))
+'''
+
+
+def rows(path, sql):
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return connection.execute(sql).fetchall()
+    finally:
+        connection.close()
+
+
+class EdgeExportTests(TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.user = User.objects.create_user('edge', password='edge-password')
+        self.budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'))
+        for amount in ('12.00', '3.50'):
+            Expense.objects.create(budget=self.budget, name='Lunch', amount=Decimal(amount))
+        self.goal = Goal.objects.create(user=self.user, name='Laptop', target_amount=Decimal('1500.00'))
+        self.other = User.objects.create_user('other', password='other-password')
+
+    def test_files(self):
+        inactive = User.objects.create_user('inactive', password='inactive-password', is_active=False)
+        leftover = user_file(inactive.id, self.directory)
+        leftover.parent.mkdir(parents=True, exist_ok=True)
+        leftover.write_bytes(b'')
+
+        users, size = export_edge_files(self.directory)
+        self.assertEqual(users, 2)
+        self.assertFalse(leftover.exists())
+        path = user_file(self.user.id, self.directory)
+        self.assertEqual(size, common_file(self.directory).stat().st_size + path.stat().st_size
+                         + user_file(self.other.id, self.directory).stat().st_size)
+        self.assertEqual(sorted(Decimal(str(amount)) for amount, in rows(path, 'SELECT amount FROM api_expense')),
+                         [Decimal('3.5'), Decimal('12')])
+        (user_id, password), = rows(path, 'SELECT id, password FROM auth_user')
+        self.assertEqual(user_id, self.user.id)
+        self.assertTrue(password.startswith('!'))  # unusable: edge servers only check tokens
+        self.assertEqual(rows(path, 'SELECT COUNT(*) FROM api_budget'), [(1,)])
+        self.assertEqual(rows(common_file(self.directory), 'SELECT COUNT(*) FROM api_category'), [(Category.objects.count(),)])
+        self.assertEqual(list(self.directory.rglob('*.tmp')), [])
+
+    def test_rollup_is_up_to_date(self):
+        refresh_snapshot(self.user.id)
+        computed_at = DashboardSnapshot.objects.get(user=self.user).computed_at
+        export_edge_files(self.directory, user_ids=[self.user.id])
+        path = user_file(self.user.id, self.directory)
+        self.assertEqual(len(rows(path, 'SELECT computed_at FROM api_dashboardsnapshot')), 1)
+        self.assertEqual(rows(path, 'SELECT computed_at FROM api_dashboardsnapshot')[0][0][:19],
+                         computed_at.strftime('%Y-%m-%d %H:%M:%S'))
+
+        # Stale on the primary: computed for the file
+        Expense.objects.create(budget=self.budget, name='Dinner', amount=Decimal('20.00'))
+        mark_stale(self.user.id)
+        export_edge_files(self.directory, user_ids=[self.user.id])
+        payload, = rows(path, 'SELECT payload FROM api_dashboardsnapshot')[0]
+        self.assertEqual(json.loads(payload), snapshot_payload(self.user))
+
+    @override_settings(WRITE_COALESCING_ENABLED=True)
+    def test_queued_writes_are_exported(self):
+        queue_savings(self.goal, Decimal('25.00'))
+        export_edge_files(self.directory, user_ids=[self.user.id])
+        self.assertEqual(rows(user_file(self.user.id, self.directory), 'SELECT current_amount FROM api_goal'), [(25,)])
+
+    def test_served_by_an_edge_server(self):
+        export_edge_files(self.directory)
+        child = subprocess.run(
+            [sys.executable, '-c', SERVE_SCRIPT, 'GET /api/budgets/', 'GET /api/expenses/', 'GET /api/dashboard/',
+             'POST /api/budgets/', 'GET /api/sync/'],
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'backend.settings', 'EDGE_SERVING': 'true',
+                 'EDGE_FILES_DIR': str(self.directory), 'EDGE_TEST_TOKEN': str(AccessToken.for_user(self.user))},
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=60,
+        )
+        self.assertEqual(child.returncode, 0, child.stderr)
+        results = json.loads(child.stdout.strip().splitlines()[-1])
+        self.assertEqual(results['GET /api/budgets/'][0], 200)
+        self.assertEqual([budget['id'] for budget in results['GET /api/budgets/'][1]], [self.budget.id])
+        self.assertEqual(sorted(Decimal(expense['amount']) for expense in results['GET /api/expenses/'][1]),
+                         [Decimal('3.50'), Decimal('12.00')])
+        self.assertEqual(results['GET /api/dashboard/'][0], 200)
+        self.assertEqual(results['POST /api/budgets/'][0], 405)
+        self.assertEqual(results['GET /api/sync/'][0], 404)
+
+
+class EdgeMiddlewareTests(TestCase):
+    def process_view(self, method, path):
+        request = RequestFactory().generic(method, path)
+        request.resolver_match = resolve(path)
+        return EdgeServingMiddleware(lambda request: HttpResponse()).process_view(request, None, (), {})
+
+    def test_only_served_reads(self):
+        self.assertIsNone(self.process_view('GET', '/api/budgets/'))
+        self.assertEqual(self.process_view('POST', '/api/budgets/').status_code, 405)
+        self.assertEqual(self.process_view('GET', '/api/export/').status_code, 404)
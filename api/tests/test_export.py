@@ -0,0 +1,51 @@
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from openpyxl import load_workbook
+from rest_framework.test import APIClient
+
+from api.columnar import ExpenseColumns
+from api.models import Budget, Category, Expense, Income
+from api.tests import unthrottled
+
+
+@unthrottled
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('export', password='export-password')
+        self.budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'))
+        self.food = Category.objects.get(name='Food')
+        Expense.objects.create(budget=self.budget, name='Lunch', amount=Decimal('12.34'), category=self.food,
+                               created_at=datetime(2024, 3, 5, 12, tzinfo=dt_timezone.utc))
+        Expense.objects.create(budget=self.budget, name='Gift', amount=Decimal('0.29'), category=None,
+                               created_at=datetime(2024, 3, 1, 12, tzinfo=dt_timezone.utc))
+        Income.objects.create(user=self.user, name='Allowance', amount=Decimal('800.00'),
+                              created_at=datetime(2024, 3, 1, 9, tzinfo=dt_timezone.utc))
+
+    def test_columns(self):
+        columns = ExpenseColumns.from_queryset(Expense.objects.filter(user=self.user), with_names=True)
+        self.assertEqual(list(columns.rows()), [
+            (date(2024, 3, 1), None, Decimal('0.29'), 'Gift'),
+            (date(2024, 3, 5), self.food.id, Decimal('12.34'), 'Lunch'),
+        ])
+        self.assertEqual(len(columns), 2)
+
+    def test_workbook(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/export/')
+        self.assertEqual(response.status_code, 200)
+        workbook = load_workbook(BytesIO(response.content))
+        self.assertEqual(workbook.sheetnames, ['Expenses', 'Income'])
+        self.assertEqual([list(row) for row in workbook['Expenses'].values], [
+            ['Date', 'Category', 'Amount', 'Description'],
+            ['2024-03-01', None, 0.29, 'Gift'],
+            ['2024-03-05', 'Food', 12.34, 'Lunch'],
+        ])
+        self.assertEqual([list(row) for row in workbook['Income'].values], [
+            ['Date', 'Source', 'Amount'],
+            ['2024-03-01', 'Allowance', 800],
+        ])
@@ -0,0 +1,125 @@
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api.imports import StatementError, import_statement, read_ofx
+from api.models import Budget, Expense, ImportProgress, Income
+from api.tests import unthrottled
+
+STATEMENT = '''Date,Description,Amount
+2024-03-01,Allowance,800.00
+2024-03-01,Kopi,-1.80
+2024-03-01,Kopi,-1.80
+2024-03-02,Bus fare,-0.99
+'''
+
+
+def statement(text=STATEMENT, name='statement.csv'):
+    file = BytesIO(text.encode())
+    file.name = name
+    return file
+
+
+class StatementImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('imports', password='imports-password')
+        self.budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'))
+
+    def run_import(self, text=STATEMENT, batch_size=None):
+        return import_statement(statement(text), self.user, self.budget, batch_size=batch_size)
+
+    def test_import_and_reimport(self):
+        summary = self.run_import()
+        self.assertEqual((summary['rows'], summary['expenses'], summary['income'], summary['duplicates']), (4, 3, 1, 0))
+        self.assertEqual(sorted(Expense.objects.filter(user=self.user).values_list('name', 'amount')), [
+            ('Bus fare', Decimal('0.99')), ('Kopi', Decimal('1.80')), ('Kopi', Decimal('1.80')),
+        ])
+        self.assertEqual(Income.objects.get(user=self.user).amount, Decimal('800.00'))
+
+        # One more coffee on the overlapping day: only that one is new
+        summary = self.run_import(STATEMENT + '2024-03-01,Kopi,-1.80\n', batch_size=2)
+        self.assertEqual((summary['expenses'], summary['income'], summary['duplicates']), (1, 0, 4))
+        self.assertEqual(Expense.objects.filter(user=self.user, name='Kopi').count(), 3)
+
+    def test_rows_entered_by_hand(self):
+        Expense.objects.create(budget=self.budget, name='kopi!', amount=Decimal('1.80'),
+                               created_at=datetime(2024, 3, 1, 8, 30, tzinfo=dt_timezone.utc))
+        Expense.objects.create(budget=self.budget, name='Bus fare', amount=Decimal('0.99'),
+                               created_at=datetime(2024, 3, 3, 8, 30, tzinfo=dt_timezone.utc))  # another day
+        Income.objects.create(user=self.user, name='ALLOWANCE', amount=Decimal('800.00'),
+                              created_at=datetime(2024, 3, 1, 20, tzinfo=dt_timezone.utc))
+        summary = self.run_import()
+        self.assertEqual((summary['expenses'], summary['income'], summary['duplicates']), (2, 0, 2))
+        self.assertEqual(Expense.objects.filter(user=self.user, name='Kopi').count(), 1)
+        self.assertEqual(Expense.objects.filter(user=self.user, name='Bus fare').count(), 2)
+
+        # The second import skips the imported coffee by its hash and the other by the hand-entered one
+        summary = self.run_import()
+        self.assertEqual((summary['expenses'], summary['income'], summary['duplicates']), (0, 0, 4))
+
+    def test_other_users_rows_are_not_duplicates(self):
+        other = User.objects.create_user('other', password='other-password')
+        other_budget = Budget.objects.create(user=other, name='Budget', amount=Decimal('500.00'))
+        import_statement(statement(), other, other_budget)
+        Expense.objects.create(budget=other_budget, name='Bus fare', amount=Decimal('0.99'),
+                               created_at=datetime(2024, 3, 2, 12, tzinfo=dt_timezone.utc))
+        summary = self.run_import()
+        self.assertEqual((summary['expenses'], summary['income'], summary['duplicates']), (3, 1, 0))
+
+    def test_bad_rows_are_skipped(self):
+        summary = self.run_import(STATEMENT + '2024-13-01,Kopi,-1.80\n2024-03-04,Kopi,abc\n2024-03-04,Zero,0\n')
+        self.assertEqual((summary['rows'], summary['skipped'], len(summary['errors'])), (4, 3, 2))
+
+    def test_date_order(self):
+        # Days a few apart can come in any order, the occurrences of each are still counted from 1
+        lines = ['2024-03-02,Kopi,-1.80', '2024-03-01,Kopi,-1.80', '2024-03-02,Kopi,-1.80', '2024-03-01,Kopi,-1.80']
+        summary = self.run_import('Date,Description,Amount\n' + '\n'.join(lines) + '\n', batch_size=1)
+        self.assertEqual((summary['expenses'], summary['duplicates']), (4, 0))
+
+        # Counts of days far from the current lines are dropped, a line of one of those days can't be numbered
+        lines = ['2024-03-01,Kopi,-1.80', '2024-04-01,Kopi,-1.80', '2024-03-01,Kopi,-1.80']
+        with self.assertRaisesMessage(StatementError, 'line 4: the statement must be in date order'):
+            self.run_import('Date,Description,Amount\n' + '\n'.join(lines) + '\n', batch_size=1)
+
+    def test_ofx(self):
+        ofx = ('<OFX><BANKTRANLIST><STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240301120000<TRNAMT>-1.80<NAME>Kopi'
+               '</STMTTRN><STMTTRN><DTPOSTED>20240302<TRNAMT>800.00<NAME>Allowance</STMTTRN></BANKTRANLIST></OFX>')
+        rows = list(read_ofx(StringIO(ofx)))
+        self.assertEqual([(row.day.isoformat(), row.amount, row.name) for row in rows],
+                         [('2024-03-01', Decimal('-1.80'), 'Kopi'), ('2024-03-02', Decimal('800.00'), 'Allowance')])
+
+
+@unthrottled
+class ImportEndpointTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('upload', password='upload-password')
+        self.budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_progress(self):
+        self.assertEqual(self.client.get('/api/imports/progress/').json(), {})
+        upload = SimpleUploadedFile('statement.csv', STATEMENT.encode(), content_type='text/csv')
+        response = self.client.post('/api/imports/', {'file': upload, 'budget': self.budget.id}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        # Stored in the database, so any worker process answers the polls
+        self.assertTrue(ImportProgress.objects.get(user=self.user).done)
+        progress = self.client.get('/api/imports/progress/').json()
+        self.assertEqual((progress['done'], progress['expenses'], progress['percent']), (True, 3, 100.0))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.post('/api/imports/', {'budget': self.budget.id}).status_code, 400)
+        upload = SimpleUploadedFile('statement.txt', STATEMENT.encode())
+        response = self.client.post('/api/imports/', {'file': upload, 'budget': self.budget.id}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        for columns in ('[1]', '3', '{"date": 1}', '{"date"'):
+            upload = SimpleUploadedFile('statement.csv', STATEMENT.encode(), content_type='text/csv')
+            response = self.client.post('/api/imports/', {'file': upload, 'budget': self.budget.id, 'columns': columns},
+                                        format='multipart')
+            self.assertEqual(response.status_code, 400, columns)
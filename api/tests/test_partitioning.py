@@ -0,0 +1,99 @@
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+import re
+from types import SimpleNamespace
+from unittest import skipUnless
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+
+from api.models import Budget, Expense
+from api.partitioning import add_month_partitions, add_months, month_starts, partition_counts, partition_expenses, partition_scheme, partition_table
+
+migrate_partitioning = import_module('api.migrations.0013_expense_partitioning').partition_expenses
+
+
+class MonthTests(TestCase):
+    def test_month_arithmetic(self):
+        self.assertEqual(add_months(date(2024, 11, 15), 2), date(2025, 1, 1))
+        self.assertEqual(add_months(date(2024, 1, 31), -1), date(2023, 12, 1))
+        self.assertEqual(list(month_starts(date(2024, 11, 15), date(2025, 1, 1))),
+                         [date(2024, 11, 1), date(2024, 12, 1), date(2025, 1, 1)])
+
+
+# The conversion is DDL in the test's transaction, rolled back with it
+@skipUnless(connection.vendor == 'postgresql', "partitioning needs PostgreSQL")
+class PartitioningTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(f'partition{i}', password='partition-password') for i in range(3)]
+        self.budgets = [Budget.objects.create(user=user, name='Budget', amount=Decimal('500.00')) for user in self.users]
+        self.expenses = [Expense.objects.create(budget=self.budgets[i % 3], name=f'expense {i}', amount=Decimal('2.00'),
+                                                created_at=datetime(2023, i % 12 + 1, 5, tzinfo=dt_timezone.utc))
+                         for i in range(30)]
+        # The foreign key checks of these inserts would otherwise still be pending on the table being replaced
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def assert_rows_kept(self):
+        for user in self.users:
+            self.assertEqual(sorted(Expense.objects.filter(user=user).values_list('id', flat=True)),
+                             sorted(e.id for e in self.expenses if e.user_id == user.id))
+        # New rows carry on after the copied ids
+        added = Expense.objects.create(budget=self.budgets[0], name='new', amount=Decimal('1.00'))
+        self.assertGreater(added.id, max(e.id for e in self.expenses))
+        self.assertEqual(Expense.objects.get(id=added.id).name, 'new')
+        self.expenses.append(added)
+
+    def test_migration(self):
+        # The test database went through 0013: by user, with the indexes and foreign keys of the model
+        self.assertEqual(partition_scheme(), 'user')
+        self.assertEqual(len(partition_counts()), 16)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Expense._meta.db_table)
+        # The names in the SQL Django would create the table with
+        with connection.schema_editor(collect_sql=True) as editor:
+            editor.create_model(Expense)
+        expected = set(re.findall(r'(?:CREATE INDEX|ADD CONSTRAINT) "(\w+)"', '\n'.join(editor.collected_sql)))
+        self.assertEqual(set(constraints), expected | {'api_expense_pkey'})
+        self.assert_rows_kept()
+        with connection.schema_editor() as editor:
+            migrate_partitioning(apps, editor)  # already partitioned: left alone
+        self.assertEqual(len(partition_counts()), 16)
+
+    def test_by_user(self):
+        partition_expenses('user', partitions=4)
+        self.assertEqual(partition_scheme(), 'user')
+        self.assertEqual(len(partition_counts()), 4)
+        self.assert_rows_kept()
+        # One partition per user's query
+        plan = Expense.objects.filter(user=self.users[0]).explain()
+        self.assertEqual(plan.count(' on api_expense_p'), 1, plan)
+        with self.assertRaises(ValueError):
+            partition_expenses('user', partitions=4)
+
+    def test_by_month(self):
+        partition_expenses('month', months_ahead=1)
+        self.assertEqual(partition_scheme(), 'month')
+        self.assertIn('api_expense_2023_01', partition_counts())
+        self.assert_rows_kept()
+        with self.assertRaises(ValueError):
+            partition_expenses('month')
+
+        self.assertEqual(add_month_partitions(months_ahead=2), 3)
+        # And back
+        partition_expenses('user', partitions=2)
+        self.assertEqual(len(partition_counts()), 2)
+        self.assert_rows_kept()
+
+
+@skipUnless(connection.vendor != 'postgresql', "the fallback of other databases")
+class UnpartitionedTests(TestCase):
+    def test_migration_is_a_no_op(self):
+        # The SQLite schema editor can't be opened in the test's transaction, and isn't used
+        migrate_partitioning(apps, SimpleNamespace(connection=connection))
+        self.assertIsNone(partition_scheme())
+        with self.assertRaises(ValueError):
+            partition_table(SimpleNamespace(connection=connection), Expense, 'user', 2, 12)
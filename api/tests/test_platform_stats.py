@@ -0,0 +1,82 @@
+import random
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from api.models import Budget, Category, Expense, Goal
+from api.platform_stats import QuantileSketch, compute_platform_stats
+
+
+def sketch_of(values):
+    sketch = QuantileSketch()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+class QuantileSketchTests(TestCase):
+    def test_relative_accuracy(self):
+        rng = random.Random(42)
+        values = [round(rng.lognormvariate(8, 2)) for _ in range(100000)] + [0] * 100
+        sketch = sketch_of(values)
+        values.sort()
+        for q in (0.01, 0.25, 0.5, 0.9, 0.99, 0.999):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), exact * sketch.relative_accuracy, q)
+        self.assertEqual(sketch.quantile(0), 0)
+        self.assertEqual((sketch.count, sketch.total), (len(values), sum(values)))
+
+    def test_bounded_by_the_range_of_the_values(self):
+        # 1 cent to 100 million dollars, however many values
+        sketch = sketch_of(int(10 ** (i / 1000)) for i in range(10001))
+        self.assertLess(len(sketch.buckets), 1200)
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+        self.assertEqual(QuantileSketch().summary(), {'count': 0})
+
+    def test_merge(self):
+        rng = random.Random(7)
+        values = [rng.randint(0, 10 ** 6) for _ in range(10000)]
+        merged = sketch_of(values[:3000])
+        merged.merge(sketch_of(values[3000:]))
+        whole = sketch_of(values)
+        self.assertEqual((merged.count, merged.total, merged.zero_count), (whole.count, whole.total, whole.zero_count))
+        self.assertEqual(dict(merged.buckets), dict(whole.buckets))
+        self.assertEqual(merged.summary(), whole.summary())
+
+
+class PlatformStatsTests(TestCase):
+    def setUp(self):
+        self.food, self.transport = Category.objects.get(name='Food'), Category.objects.get(name='Transport')
+        users = [User.objects.create_user(f'platform{i}', password='platform-password') for i in range(3)]
+        User.objects.create_user('no-spend', password='platform-password')
+        budgets = [Budget.objects.create(user=user, name='Budget', amount=Decimal('50.00')) for user in users]
+        # user 0: 40 food + 20 transport (budget overrun), user 1: 10 food, user 2: 30 uncategorised
+        for budget, amount, category, month in [(budgets[0], '15.00', self.food, 1), (budgets[0], '25.00', self.food, 2),
+                                                (budgets[0], '20.00', self.transport, 2), (budgets[1], '10.00', self.food, 1),
+                                                (budgets[2], '30.00', None, 3)]:
+            Expense.objects.create(budget=budget, name='expense', amount=Decimal(amount), category=category,
+                                   created_at=datetime(2024, month, 10, tzinfo=dt_timezone.utc))
+        Goal.objects.create(user=users[0], name='Laptop', target_amount=Decimal('100.00'), current_amount=Decimal('100.00'))
+        Goal.objects.create(user=users[1], name='Bike', target_amount=Decimal('100.00'))
+
+    def test_stats(self):
+        stats = compute_platform_stats()
+        self.assertEqual({key: stats[key] for key in ('users', 'users_with_spend', 'expenses', 'budgets', 'goals')},
+                         {'users': 4, 'users_with_spend': 3, 'expenses': 5, 'budgets': 3, 'goals': 2})
+        self.assertEqual((stats['budget_overrun_rate'], stats['goal_completion_rate']), (0.3333, 0.5))
+        per_user = stats['spend_per_user']
+        self.assertEqual((per_user['count'], per_user['total'], per_user['mean']), (3, 100.0, 33.33))
+        self.assertAlmostEqual(per_user['p50'], 30.0, delta=0.3)
+        self.assertEqual(sorted(stats['spend_per_category']), ['Food', 'Transport', 'Uncategorised'])
+        food = stats['spend_per_category']['Food']
+        self.assertEqual((food['count'], food['total']), (2, 50.0))
+
+    def test_partitions_and_date_range(self):
+        stats = compute_platform_stats()
+        self.assertEqual(compute_platform_stats(partitions=3), stats)
+        february = compute_platform_stats(start=datetime(2024, 2, 1, tzinfo=dt_timezone.utc),
+                                          end=datetime(2024, 3, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual((february['users_with_spend'], february['expenses'], february['spend_per_user']['total']),
+                         (1, 2, 45.0))
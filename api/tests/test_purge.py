@@ -0,0 +1,36 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from api.models import Budget, Expense, SyncTombstone
+from api.purge import pending_budget_ids, purge_budget, soft_delete_budget
+
+
+@override_settings(BUDGET_PURGE_ASYNC=False)
+class PurgeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('purge', password='purge-password')
+        self.budget = Budget.objects.create(user=self.user, name='Deleted', amount=Decimal('500.00'))
+        self.kept = Budget.objects.create(user=self.user, name='Kept', amount=Decimal('500.00'))
+        Expense.objects.bulk_create([Expense(budget=self.budget, name=f'expense {i}', amount=Decimal('1.00')) for i in range(5)])
+        self.kept_expense = Expense.objects.create(budget=self.kept, name='kept', amount=Decimal('1.00'))
+
+    def test_soft_delete_hides_the_budget_and_its_expenses(self):
+        soft_delete_budget(self.budget)
+        self.assertFalse(Budget.objects.filter(pk=self.budget.pk).exists())
+        self.assertEqual(list(Expense.objects.filter(user=self.user)), [self.kept_expense])
+        self.assertEqual(Expense.all_objects.filter(budget_id=self.budget.pk).count(), 5)
+        self.assertTrue(SyncTombstone.objects.filter(model='budgets', object_id=self.budget.pk).exists())
+        self.assertEqual(pending_budget_ids(), [self.budget.pk])
+        # On the expenses' own flag, without joining the budget
+        self.assertNotIn('api_budget', str(Expense.objects.filter(user=self.user).query))
+
+    def test_purge_in_batches(self):
+        soft_delete_budget(self.budget)
+        self.assertEqual(purge_budget(self.budget.pk, batch_size=2), 5)
+        self.assertFalse(Budget.all_objects.filter(pk=self.budget.pk).exists())
+        self.assertFalse(Expense.all_objects.filter(budget_id=self.budget.pk).exists())
+        self.assertEqual(list(Expense.objects.all()), [self.kept_expense])
+        self.assertEqual(pending_budget_ids(), [])
+
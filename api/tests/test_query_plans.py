@@ -0,0 +1,53 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from api.models import Budget, ExchangeRate, Expense, Goal, Income
+from api.query_plans import collect_plans, compare, create_fixture, load_expectations
+
+
+def facts(scans=(), indexes=()):
+    return {'scans': list(scans), 'indexes': list(indexes), 'queries': []}
+
+
+class CompareTests(TestCase):
+    def test_same_plans(self):
+        expected = {'budget-list': facts(indexes=['api_budget_user_id'])}
+        self.assertEqual(compare(expected, {'budget-list': facts(indexes=['api_budget_user_id'])}), ([], []))
+
+    def test_new_scan_is_a_regression(self):
+        regressions, changes = compare({'budget-list': facts()}, {'budget-list': facts(scans=['api_budget'])})
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('now reads all of api_budget', regressions[0])
+        self.assertEqual(changes, [])
+
+    def test_lost_index_is_a_regression(self):
+        regressions, _changes = compare({'budget-list': facts(indexes=['api_budget_user_id'])}, {'budget-list': facts()})
+        self.assertIn('no longer uses index api_budget_user_id', regressions[0])
+
+    def test_improvements_and_new_endpoints_are_changes(self):
+        regressions, changes = compare(
+            {'budget-list': facts(scans=['api_budget'])},
+            {'budget-list': facts(indexes=['api_budget_user_id']), 'income-list': facts()},
+        )
+        self.assertEqual(regressions, [])
+        self.assertEqual(len(changes), 2)
+
+
+# A private cache, so which lookups are cached doesn't depend on the other tests
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'query-plans'}})
+class QueryPlanTests(TestCase):
+    # The hot endpoints' plans against api/query_plans.json; after an intended change, store the new ones
+    # with `manage.py check_query_plans --update`
+    def test_no_plan_regressed(self):
+        expected = load_expectations().get(connection.vendor)
+        if expected is None:
+            self.skipTest(f"no {connection.vendor} expectations in api/query_plans.json")
+        if connection.vendor == 'postgresql':
+            # The planner sizes never analyzed tables by their pages, which the earlier tests' rolled back rows
+            # still take up (until autovacuum, if it gets to them, truncates or analyzes them). Emptied
+            # in the test's transaction, the tables are as fresh as in `manage.py check_query_plans`.
+            tables = [model._meta.db_table for model in (Budget, Expense, Income, Goal, ExchangeRate)]
+            with connection.cursor() as cursor:
+                cursor.execute('TRUNCATE ' + ', '.join(connection.ops.quote_name(table) for table in tables))
+        regressions, _changes = compare(expected, collect_plans(create_fixture()))
+        self.assertFalse(regressions, '\n\n'.join(regressions))
@@ -0,0 +1,92 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api import snapshots
+from api.dashboard import compute_dashboard
+from api.models import Budget, DashboardSnapshot, Expense
+from api.snapshots import get_snapshot, mark_stale, refresh_snapshot
+from api.tests import unthrottled
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('snapshots', password='snapshots-password')
+        self.budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'))
+
+    def snapshot(self):
+        return DashboardSnapshot.objects.get(user=self.user)
+
+    def test_refresh_clears_stale(self):
+        refresh_snapshot(self.user.id)
+        mark_stale(self.user.id)
+        self.assertTrue(self.snapshot().is_stale())
+        refresh_snapshot(self.user.id)
+        self.assertFalse(self.snapshot().is_stale())
+
+    def test_first_write_time_is_kept(self):
+        refresh_snapshot(self.user.id)
+        mark_stale(self.user.id)
+        stale_since = self.snapshot().stale_since
+        mark_stale(self.user.id)
+        self.assertEqual(self.snapshot().stale_since, stale_since)
+        self.assertEqual(self.snapshot().write_count, 2)
+
+    def test_write_during_refresh_keeps_it_stale(self):
+        refresh_snapshot(self.user.id)
+        mark_stale(self.user.id)  # already stale when the refresh starts
+
+        def compute_then_write(user):
+            payload = compute_dashboard(user)
+            Expense.objects.create(budget=self.budget, name='late', amount=Decimal('5.00'))  # not in the payload
+            return payload
+
+        with mock.patch.object(snapshots, 'compute_dashboard', compute_then_write):
+            refresh_snapshot(self.user.id)
+        self.assertTrue(self.snapshot().is_stale())
+        refresh_snapshot(self.user.id)
+        self.assertFalse(self.snapshot().is_stale())
+
+    def test_get_snapshot(self):
+        self.assertEqual(get_snapshot(self.user), (None, None))
+        refresh_snapshot(self.user.id)
+        payload, snapshot = get_snapshot(self.user)
+        self.assertEqual(payload, snapshot.payload)
+
+        # Stale for longer than the refresh should take
+        DashboardSnapshot.objects.filter(user=self.user).update(stale_since=timezone.now() - timedelta(minutes=5))
+        with override_settings(DASHBOARD_SNAPSHOT_MAX_STALENESS_SECONDS=60):
+            self.assertEqual(get_snapshot(self.user), (None, None))
+
+        # Computed for another month
+        DashboardSnapshot.objects.filter(user=self.user).update(stale_since=None, payload={'month': 0, 'year': 0})
+        self.assertEqual(get_snapshot(self.user), (None, None))
+
+
+@unthrottled
+class SnapshotResponseTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('responses', password='responses-password')
+        budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'))
+        for amount in ('12.00', '1.75'):
+            Expense.objects.create(budget=budget, name='Lunch', amount=Decimal(amount))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, path):
+        data = self.client.get(path).json()
+        data.pop('snapshot', None)
+        return data
+
+    def test_same_as_computed(self):
+        refresh_snapshot(self.user.id)
+        served = self.get('/api/dashboard/'), self.get('/api/analytics/')
+        with override_settings(DASHBOARD_SNAPSHOTS_ENABLED=False):
+            computed = self.get('/api/dashboard/'), self.get('/api/analytics/')
+        self.assertEqual(served, computed)
+        self.assertEqual(served[1]['most_spent_category']['total_spent'], 13.75)
@@ -0,0 +1,87 @@
+from decimal import Decimal
+from importlib import import_module
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api.models import Budget, Expense, Goal, SyncCounter
+from api.sync import changes_since
+from api.tests import unthrottled
+
+number_unsynced_rows = import_module('api.migrations.0015_number_unsynced_rows').number_unsynced_rows
+
+
+def ids(payload, table):
+    index = payload[table]['fields'].index('id')
+    return [row[index] for row in payload[table]['rows']]
+
+
+@unthrottled
+class SyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sync', password='sync-password')
+        self.budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'))
+
+    def expense(self, name='expense'):
+        return Expense.objects.create(budget=self.budget, name=name, amount=Decimal('5.00'))
+
+    def test_changes_after_the_cursor(self):
+        first = self.expense()
+        payload = changes_since(self.user, 0)
+        self.assertEqual(ids(payload, 'budgets'), [self.budget.id])
+        self.assertEqual(ids(payload, 'expenses'), [first.id])
+
+        second = self.expense()
+        first.name = 'renamed'
+        first.save()
+        later = changes_since(self.user, payload['cursor'])
+        self.assertEqual(ids(later, 'expenses'), [second.id, first.id])
+        self.assertEqual(ids(later, 'budgets'), [])
+
+    def test_deletes_leave_tombstones(self):
+        expense = self.expense()
+        expense_id = expense.id
+        cursor = changes_since(self.user, 0)['cursor']
+        expense.delete()
+        self.assertEqual(changes_since(self.user, cursor)['deleted']['expenses'], [expense_id])
+
+    def test_limit_pages_through_the_changes(self):
+        created = [self.expense().id for _ in range(5)]
+        seen, cursor, has_more = [], 0, True
+        while has_more:
+            payload = changes_since(self.user, cursor, limit=2)
+            seen += ids(payload, 'expenses')
+            cursor, has_more = payload['cursor'], payload['has_more']
+        self.assertEqual(seen, created)
+
+    def test_rows_from_before_change_tracking(self):
+        # As left by migration 0005: change_seq 0 and no counter
+        expense = self.expense()
+        goal = Goal.objects.create(user=self.user, name='Laptop', target_amount=Decimal('1500.00'))
+        other = User.objects.create_user('other', password='other-password')
+        other_goal = Goal.objects.create(user=other, name='Bike', target_amount=Decimal('300.00'))
+        for model in (Budget, Expense, Goal):
+            model._base_manager.update(change_seq=0)
+        SyncCounter.objects.filter(user=self.user).delete()
+        SyncCounter.objects.filter(user=other).update(value=7)
+        self.assertEqual(ids(changes_since(self.user, 0), 'expenses'), [])
+
+        number_unsynced_rows(apps, None)
+        payload = changes_since(self.user, 0)
+        self.assertEqual(ids(payload, 'budgets'), [self.budget.id])
+        self.assertEqual(ids(payload, 'expenses'), [expense.id])
+        self.assertEqual(ids(payload, 'goals'), [goal.id])
+        self.assertEqual(payload['cursor'], 3)
+        self.assertEqual(ids(changes_since(other, 7), 'goals'), [other_goal.id])
+
+        # New writes carry on after the numbered rows
+        later = self.expense()
+        self.assertEqual(ids(changes_since(self.user, payload['cursor']), 'expenses'), [later.id])
+
+    def test_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/sync/', {'since': 0}).json()['cursor'], 1)
+        self.assertEqual(client.get('/api/sync/', {'since': -1}).status_code, 400)
@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+
+class MetricsEndpointTests(TestCase):
+    @override_settings(METRICS_TOKEN=None)
+    def test_without_a_token_only_staff(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.client.force_login(User.objects.create_user('user', password='user-password'))
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.client.force_login(User.objects.create_user('staff', password='staff-password', is_staff=True))
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'pennywise_http_request_duration_seconds', response.content)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_with_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token').status_code, 200)
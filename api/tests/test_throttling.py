@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from rest_framework.exceptions import Throttled
+
+from api import throttling
+from api.throttling import LocalBucketStore, concurrency_slot
+
+
+class LocalBucketStoreTests(SimpleTestCase):
+    def test_take_and_refill(self):
+        store = LocalBucketStore()
+        self.assertEqual(store.take('user:1', 8, capacity=10, rate=2, now=0), 0)
+        self.assertEqual(store.take('user:1', 4, capacity=10, rate=2, now=0), 1.0)  # 2 tokens left, 2 more in 1s
+        self.assertEqual(store.take('user:1', 4, capacity=10, rate=2, now=1), 0)
+        self.assertEqual(store.take('user:2', 10, capacity=10, rate=2, now=1), 0)
+
+    def test_full_buckets_are_dropped(self):
+        store = LocalBucketStore()
+        store.SWEEP_EVERY = 4
+        for ip in range(3):
+            store.take(f'ip:{ip}', 1, capacity=10, rate=2, now=0)
+        # At 0.5s the first three are full again, the one taking now isn't
+        self.assertEqual(store.take('ip:3', 4, capacity=10, rate=2, now=0.5), 0)
+        self.assertEqual(list(store._buckets), ['ip:3'])
+        self.assertEqual(store.take('ip:3', 8, capacity=10, rate=2, now=0.5), 1.0)
+
+
+class ExpiringOnceCache:
+    # The default cache, with the key expiring right before the first incr()
+    expired = False
+
+    def __getattr__(self, name):
+        return getattr(cache, name)
+
+    def incr(self, key, *args):
+        if not self.expired:
+            self.expired = True
+            cache.delete(key)
+        return cache.incr(key, *args)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'slots'}})
+class ConcurrencySlotTests(SimpleTestCase):
+    request = SimpleNamespace(user=SimpleNamespace(pk=1))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_cap(self):
+        for backend in ('local', 'cache'):
+            with self.subTest(backend=backend), override_settings(THROTTLE_BACKEND=backend):
+                with concurrency_slot(self.request, 'export', 1):
+                    with self.assertRaises(Throttled):
+                        with concurrency_slot(self.request, 'export', 1):
+                            pass
+                with concurrency_slot(self.request, 'export', 1):
+                    pass
+
+    def test_in_flight(self):
+        for backend in ('local', 'cache'):
+            with self.subTest(backend=backend), override_settings(THROTTLE_BACKEND=backend):
+                with concurrency_slot(self.request, 'export', 2):
+                    self.assertEqual(throttling.throttle_metrics()['in_flight'], 1)
+                self.assertEqual(throttling.throttle_metrics()['in_flight'], 0)
+
+    @override_settings(THROTTLE_BACKEND='cache')
+    def test_slot_expiring_between_add_and_incr(self):
+        cache.set('throttle:in-flight:export:1', 0)
+        with mock.patch.object(throttling, 'cache', ExpiringOnceCache()):
+            with concurrency_slot(self.request, 'export', 1):
+                self.assertEqual(cache.get('throttle:in-flight:export:1'), 1)
+        self.assertEqual(cache.get('throttle:in-flight:export:1'), 0)
+
+    @override_settings(THROTTLE_BACKEND='cache')
+    def test_slot_expiring_while_held(self):
+        with concurrency_slot(self.request, 'export', 1):
+            cache.delete('throttle:in-flight:export:1')
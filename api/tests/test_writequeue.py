@@ -0,0 +1,97 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from api.models import Budget, Category, DashboardSnapshot, Expense, Goal, QueuedWrite
+from api.snapshots import refresh_snapshot
+from api.sync import changes_since
+from api.tests import unthrottled
+from api.writequeue import flush, queue_expense, queue_savings, queued_expense_rows, queued_savings
+
+
+@unthrottled
+@override_settings(WRITE_COALESCING_ENABLED=True)
+class WriteQueueTests(TestCase):
+    # The flusher thread is scheduled on commit, which never comes in a TestCase: the tests flush themselves
+    def setUp(self):
+        self.user = User.objects.create_user('coalescing', password='coalescing-password')
+        self.budget = Budget.objects.create(user=self.user, name='Budget', amount=Decimal('500.00'))
+        self.goal = Goal.objects.create(user=self.user, name='Laptop', target_amount=Decimal('1500.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def expense(self, name, amount, budget=None, **fields):
+        return queue_expense(self.user.id, {'budget': budget or self.budget, 'name': name, 'amount': Decimal(amount), **fields})
+
+    def test_flush_applies_grouped_writes(self):
+        refresh_snapshot(self.user.id)
+        cursor = changes_since(self.user, 0)['cursor']
+        for amount in ('10.00', '15.50', '4.50'):
+            queue_savings(self.goal, Decimal(amount))
+        food = Category.objects.get(name='Food')
+        self.expense('Lunch', '12.00', category=food)
+        self.expense('Kopi', '1.80')
+        self.assertEqual(queued_savings(self.user.id), {self.goal.id: Decimal('30.00')})
+        self.assertEqual([row['name'] for row in queued_expense_rows(self.user.id)], ['Lunch', 'Kopi'])
+
+        self.assertEqual(flush(self.user.id), 5)
+        self.assertFalse(QueuedWrite.objects.exists())
+        self.goal.refresh_from_db()
+        self.assertEqual(self.goal.current_amount, Decimal('30.00'))
+        expenses = Expense.objects.filter(user=self.user).order_by('id')
+        self.assertEqual([(e.name, e.amount, e.category_id) for e in expenses],
+                         [('Lunch', Decimal('12.00'), food.id), ('Kopi', Decimal('1.80'), expenses[1].category_id)])
+        self.assertTrue(DashboardSnapshot.objects.get(user=self.user).is_stale())
+
+        # One change_seq per goal and per expense, after the ones before
+        payload = changes_since(self.user, cursor)
+        self.assertEqual(len(payload['goals']['rows']), 1)
+        self.assertEqual(len(payload['expenses']['rows']), 2)
+        self.assertEqual(payload['cursor'], cursor + 3)
+
+    def test_batches_and_other_users(self):
+        other = User.objects.create_user('other', password='other-password')
+        other_goal = Goal.objects.create(user=other, name='Bike', target_amount=Decimal('300.00'))
+        for _ in range(5):
+            queue_savings(self.goal, Decimal('1.00'))
+        queue_savings(other_goal, Decimal('2.00'))
+
+        self.assertEqual(flush(self.user.id, batch_size=2), 5)
+        self.assertEqual(list(QueuedWrite.objects.values_list('user_id', flat=True)), [other.id])
+        self.assertEqual(flush(), 1)
+        other_goal.refresh_from_db()
+        self.assertEqual(other_goal.current_amount, Decimal('2.00'))
+
+    def test_writes_to_deleted_targets_are_dropped(self):
+        other_budget = Budget.objects.create(user=self.user, name='Trip', amount=Decimal('100.00'))
+        self.expense('Hostel', '30.00', budget=other_budget)
+        self.expense('Kopi', '1.80')
+        other_budget.delete()
+        self.assertEqual(flush(self.user.id), 2)
+        self.assertEqual(list(Expense.objects.filter(user=self.user).values_list('name', flat=True)), ['Kopi'])
+
+    def test_reads_see_queued_writes(self):
+        response = self.client.post(f'/api/goals/{self.goal.id}/add-savings/', {'amount': '25.00'})
+        self.assertEqual(Decimal(response.json()['current_amount']), Decimal('25.00'))
+        self.assertEqual(Decimal(self.client.get(f'/api/goals/{self.goal.id}/').json()['current_amount']), Decimal('25.00'))
+
+        response = self.client.post('/api/expenses/', {'budget': self.budget.id, 'name': 'Lunch', 'amount': '12.00'})
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(response.json()['id'])
+        self.assertEqual([row['name'] for row in self.client.get('/api/expenses/').json()], ['Lunch'])
+        self.assertEqual(Goal.objects.get(pk=self.goal.pk).current_amount, Decimal('0'))
+
+        # The reads that aggregate apply the queue first
+        self.assertEqual(self.client.get('/api/sync/', {'since': 0}).status_code, 200)
+        self.assertFalse(QueuedWrite.objects.exists())
+        self.assertEqual(Goal.objects.get(pk=self.goal.pk).current_amount, Decimal('25.00'))
+        self.assertEqual([row['id'] is not None for row in self.client.get('/api/expenses/').json()], [True])
+
+    def test_expense_to_another_users_budget(self):
+        other = User.objects.create_user('other', password='other-password')
+        budget = Budget.objects.create(user=other, name='Budget', amount=Decimal('500.00'))
+        response = self.client.post('/api/expenses/', {'budget': budget.id, 'name': 'Lunch', 'amount': '12.00'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(QueuedWrite.objects.exists())
@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+from .telemetry import registry
+
+# Per-user token-bucket throttling with per-endpoint costs.
+# Every user (or client IP when anonymous) gets a bucket of THROTTLE_BUCKET_CAPACITY tokens refilled at
+# THROTTLE_REFILL_PER_SECOND; a request costs THROTTLE_COSTS[url name] tokens (default 1), so the
+# expensive endpoints drain the bucket much faster than the CRUD ones. When the bucket is short DRF
+# answers 429 with a Retry-After of the time until enough tokens are back.
+#
+# THROTTLE_BACKEND = 'local' keeps the buckets in process memory (per gunicorn worker), 'cache' keeps
+# them in the default Django cache so all workers share them when that cache is shared (Redis, memcached).
+
+
+def throttle_setting(name, default):
+    return getattr(settings, name, default)
+
+
+_metrics_lock = threading.Lock()
+_metrics = Counter()
+
+
+def record(name, amount=1):
+    with _metrics_lock:
+        _metrics[name] += amount
+    registry.inc('pennywise_throttle_requests_total', (('result', name),), amount)
+
+
+def throttle_metrics():
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    # The requests of this process holding a concurrency slot, whichever the backend: with the cache one
+    # the shared counts are kept per user and scope, and can't be summed across workers
+    with _local_slots_lock:
+        metrics['in_flight'] = sum(_in_flight.values())
+    return metrics
+
+
+class LocalBucketStore:
+    # A bucket refilled to full is the same as no bucket, so those are dropped every SWEEP_EVERY takes:
+    # memory follows the clients seen within the time a bucket takes to refill, not every IP ever seen
+    SWEEP_EVERY = 1000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._takes = 0
+
+    def take(self, key, cost, capacity, rate, now):
+        # Returns 0 if `cost` tokens were taken, otherwise the seconds until they will be available
+        with self._lock:
+            self._takes += 1
+            if self._takes % self.SWEEP_EVERY == 0:
+                self._buckets = {bucket: (tokens, updated_at) for bucket, (tokens, updated_at) in self._buckets.items()
+                                 if tokens + (now - updated_at) * rate < capacity}
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate
+
+
+class CacheBucketStore:
+    # Read-modify-write without a lock: concurrent requests from the same user can occasionally both
+    # see the same token count, which errs on the side of letting a request through.
+    def take(self, key, cost, capacity, rate, now):
+        cache_key = f'throttle:bucket:{key}'
+        tokens, updated_at = cache.get(cache_key) or (capacity, now)
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+        wait = 0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        # Keep the entry around until the bucket would be full again anyway
+        cache.set(cache_key, (tokens, now), int((capacity - tokens) / rate) + 1)
+        return wait
+
+
+_stores = {'local': LocalBucketStore(), 'cache': CacheBucketStore()}
+
+
+class TokenBucketThrottle(BaseThrottle):
+    def get_ident_key(self, request):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+    def get_cost(self, request, view):
+        costs = throttle_setting('THROTTLE_COSTS', {})
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        return getattr(view, 'throttle_cost', costs.get(url_name, 1))
+
+    def allow_request(self, request, view):
+        capacity = throttle_setting('THROTTLE_BUCKET_CAPACITY', 60)
+        rate = throttle_setting('THROTTLE_REFILL_PER_SECOND', 1.0)
+        cost = min(self.get_cost(request, view), capacity)
+        store = _stores[throttle_setting('THROTTLE_BACKEND', 'local')]
+
+        self._wait = store.take(self.get_ident_key(request), cost, capacity, rate, time.time())
+        if self._wait:
+            record('throttled')
+            return False
+        record('allowed')
+        return True
+
+    def wait(self):
+        return self._wait
+
+
+_local_slots = Counter()
+_in_flight = Counter()  # scope -> this process's requests holding a slot
+_local_slots_lock = threading.Lock()
+
+
+@contextmanager
+def concurrency_slot(request, scope, limit, retry_after=5):
+    """
+    Cap the number of requests of `scope` a user can have in flight at once (e.g. exports),
+    raising Throttled (429 with Retry-After) when the cap is reached.
+    """
+    key = f'throttle:in-flight:{scope}:{request.user.pk}'
+    if throttle_setting('THROTTLE_BACKEND', 'local') == 'cache':
+        def acquire():
+            while True:
+                # The timeout bounds how long a crashed worker can hold a slot
+                if cache.add(key, 1, timeout=600):
+                    return 1
+                try:
+                    return cache.incr(key)
+                except ValueError:
+                    pass  # expired between add() and incr(), start it again
+
+        def release():
+            try:
+                cache.decr(key)
+            except ValueError:
+                pass  # expired while the request ran: nothing left to release
+    else:
+        def acquire():
+            with _local_slots_lock:
+                _local_slots[key] += 1
+                return _local_slots[key]
+
+        def release():
+            with _local_slots_lock:
+                _local_slots[key] -= 1
+                if not _local_slots[key]:
+                    del _local_slots[key]
+
+    if acquire() > limit:
+        release()
+        record(f'{scope}_rejected')
+        raise Throttled(wait=retry_after, detail=f"Too many {scope} requests in progress.")
+    with _local_slots_lock:
+        _in_flight[scope] += 1
+    try:
+        yield
+    finally:
+        release()
+        with _local_slots_lock:
+            _in_flight[scope] -= 1
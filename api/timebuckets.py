@@ -0,0 +1,147 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek, TruncYear
+from django.utils import timezone
+
+# Time-bucket aggregation over Expense / Income.
+# Every call compiles to a single grouped query (GROUP BY the truncated date),
+# gap filling and period-over-period deltas are then done on the (small) list of buckets.
+
+TRUNC_FUNCTIONS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'year': TruncYear,
+}
+
+# Upper bound on the number of buckets a single request may ask for
+# (10 years of daily buckets), so a bad range can't build a huge response.
+MAX_BUCKETS = 3660
+
+
+def get_timezone(name=None):
+    if not name:
+        return timezone.get_current_timezone()
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {name}")
+
+
+def bucket_start(day, period):
+    # Align a date to the start of the bucket it falls in
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())  # ISO weeks start on Monday, same as TruncWeek
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'year':
+        return day.replace(month=1, day=1)
+    raise ValueError(f"Invalid period: {period}")
+
+
+def next_bucket(day, period):
+    try:
+        if period == 'day':
+            return day + timedelta(days=1)
+        if period == 'week':
+            return day + timedelta(weeks=1)
+        if period == 'month':
+            return date(day.year + 1, 1, 1) if day.month == 12 else date(day.year, day.month + 1, 1)
+        if period == 'year':
+            return date(day.year + 1, 1, 1)
+    except (OverflowError, ValueError):
+        raise ValueError(f"No {period} after {day}: dates end at {date.max}")
+    raise ValueError(f"Invalid period: {period}")
+
+
+def previous_bucket(day, period):
+    try:
+        if period == 'day':
+            return day - timedelta(days=1)
+        if period == 'week':
+            return day - timedelta(weeks=1)
+        if period == 'month':
+            return date(day.year - 1, 12, 1) if day.month == 1 else date(day.year, day.month - 1, 1)
+        if period == 'year':
+            return date(day.year - 1, 1, 1)
+    except (OverflowError, ValueError):
+        raise ValueError(f"No {period} before {day}: dates start at {date.min}")
+    raise ValueError(f"Invalid period: {period}")
+
+
+def local_midnight(day, tz):
+    return datetime.combine(day, time.min, tzinfo=tz)
+
+
+def bucket_totals(queryset, period, start, end, tz=None, date_field='created_at', amount_field='amount', fill_gaps=True):
+    """
+    Sum `amount_field` of `queryset` into `period` buckets covering the dates start..end (inclusive),
+    with bucket boundaries taken in timezone `tz`.
+
+    Returns a list of dicts: {'bucket', 'total', 'count', 'change', 'change_pct'} where `change` is the
+    difference from the previous bucket (the bucket before `start` is fetched in the same query,
+    so the first row has a delta too).
+    """
+    if period not in TRUNC_FUNCTIONS:
+        raise ValueError(f"Invalid period: {period}")
+    if end < start:
+        raise ValueError("end must not be before start")
+    tz = tz or timezone.get_current_timezone()
+
+    first = bucket_start(start, period)
+    last = bucket_start(end, period)
+    buckets = [first]
+    while buckets[-1] < last:
+        buckets.append(next_bucket(buckets[-1], period))
+        if len(buckets) > MAX_BUCKETS:
+            raise ValueError(f"Too many buckets requested (max {MAX_BUCKETS})")
+
+    # One extra bucket in front of the range gives us the delta for the first bucket
+    query_start = previous_bucket(first, period)
+    query_end = next_bucket(last, period)
+
+    trunc = TRUNC_FUNCTIONS[period](date_field, tzinfo=tz, output_field=DateField())
+    rows = queryset.filter(**{
+        f'{date_field}__gte': local_midnight(query_start, tz),
+        f'{date_field}__lt': local_midnight(query_end, tz),
+    }).annotate(bucket=trunc) \
+        .values('bucket') \
+        .annotate(total=Sum(amount_field), count=Count('pk')) \
+        .order_by('bucket')
+
+    totals = {row['bucket']: row for row in rows}
+
+    previous = totals.get(query_start)
+    previous_total = previous['total'] if previous else Decimal('0')
+    results = []
+    for bucket in buckets:
+        row = totals.get(bucket)
+        if row is None and not fill_gaps:
+            previous_total = Decimal('0')
+            continue
+        total = row['total'] if row else Decimal('0')
+        change = total - previous_total
+        results.append({
+            'bucket': bucket,
+            'total': total,
+            'count': row['count'] if row else 0,
+            'change': change,
+            'change_pct': round(change / previous_total * 100, 2) if previous_total else None,
+        })
+        previous_total = total
+    return results
+
+
+def average_per_bucket(buckets):
+    # Average of the bucket totals, ignoring the empty buckets before the first one with data
+    # (so a user who started two months ago isn't averaged over a whole year)
+    for index, bucket in enumerate(buckets):
+        if bucket['count']:
+            active = buckets[index:]
+            return round(sum((b['total'] for b in active), Decimal('0')) / len(active), 2)
+    return None
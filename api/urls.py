@@ -2,7 +2,7 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 from . import views
 from .views import ExpenseViewSet
-from .views import analytics
+from .views import analytics, time_buckets, dashboard, dashboard_metrics, throttling_metrics, write_queue_metrics, sync, platform_stats
 from .views import ExportDataView
 
 router = DefaultRouter()
@@ -16,17 +16,29 @@ urlpatterns = [
     path("expenses/", views.ExpenseListCreateView.as_view(), name="expense-list"),
     path("expenses/<int:pk>/", views.ExpenseDetailView.as_view(), name="expense-detail"),
     path("expenses/delete/<int:pk>/", views.ExpenseDeleteView.as_view(), name="delete-expense"),
+    path("expenses/categorise/", views.categorise_expenses, name="categorise-expenses"),
     path("income/", views.IncomeListCreateView.as_view(), name="income-list"),
     path("income/delete/<int:pk>/", views.IncomeDeleteView.as_view(), name="delete-income"),
     path("category/", views.CategoryListView.as_view(), name="category-list"),
     path('analytics/', analytics, name="analytics"),
+    path('analytics/buckets/', time_buckets, name="analytics-buckets"),
+    path('currency/', views.currency_settings, name="currency-settings"),
+    path('dashboard/', dashboard, name="dashboard"),
+    path('dashboard/metrics/', dashboard_metrics, name="dashboard-metrics"),
+    path('throttling/metrics/', throttling_metrics, name="throttling-metrics"),
+    path('write-queue/metrics/', write_queue_metrics, name="write-queue-metrics"),
     path("student-discount/", views.StudentDiscountListView.as_view(), name="student-discount-list"),
+    path("student-discount/facets/", views.student_discount_facets, name="student-discount-facets"),
     path('goals/', views.GoalListCreateView.as_view(), name='goal-list-create'),
     path('goals/<int:pk>/', views.GoalDetailView.as_view(), name='goal-detail'),
     path('goals/delete/<int:pk>/', views.GoalDeleteView.as_view(), name='goal-delete'),
     path('goals/<int:pk>/add-savings/', views.AddSavingsToGoalView.as_view(), name='add-savings-to-goal'),
     path('goals/<int:pk>/redeem/', views.RedeemGoalView.as_view(), name='redeem-goal'),
     path('export/', ExportDataView.as_view(), name='export-data'),
+    path('imports/', views.ImportStatementView.as_view(), name='import-statement'),
+    path('imports/progress/', views.import_progress, name='import-progress'),
+    path('sync/', sync, name='sync'),
+    path('platform-stats/', platform_stats, name='platform-stats'),
     path('', include(router.urls)),
 
 ]
@@ -1,22 +1,63 @@
 
+import json
+import logging
 from django.contrib.auth.models import User
 from decimal import Decimal, InvalidOperation
 from django.db.models import Sum, Avg, F, OuterRef, Subquery,IntegerField,Case,When
 from django.db.models.functions import ExtractMonth, ExtractYear, ExtractWeek, Coalesce
 from django.utils.timezone import now
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, viewsets, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.exceptions import NotFound
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.exceptions import NotFound, ValidationError
 from .serializers import UserSerializer, BudgetSerializer, ExpenseSerializer, IncomeSerializer, CategorySerializer, StudentDiscountSerializer, GoalSerializer
-from .models import Budget, Expense, Income, Category, StudentDiscount, Goal
-from openpyxl import Workbook
+from .serializers import BudgetValuesSerializer, ExpenseValuesSerializer, IncomeValuesSerializer, GoalValuesSerializer
+from .models import Budget, Expense, Income, Category, StudentDiscount, Goal, ImportProgress
+from .timebuckets import bucket_totals, get_timezone, TRUNC_FUNCTIONS
+from .dashboard import compute_analytics, compute_dashboard
+from .snapshots import scheduler, snapshots_enabled, get_snapshot, refresh_snapshot, mark_stale
+from .throttling import concurrency_slot, throttle_metrics
+from .sync import changes_since
+from .columnar import ExpenseColumns
+from .platform_stats import compute_platform_stats
+from .telemetry import record_cache_access
+from .purge import soft_delete_budget
+from .archive import archived_expenses
+from .edge import edge_serving
+from .discounts import cached_feed, parse_feed_filters
+from .categorisation import categorise_names
+from .imports import StatementError, import_statement
+from .currency import home_currency, in_home_currency, rate_table, set_home_currency
+from .writequeue import coalescing_enabled, expense_row, flush_for_read, flusher, queue_expense, queue_savings, queued_expense_rows, queued_savings, read_snapshot
 from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework.views import APIView
 
+logger = logging.getLogger(__name__)
+
+
+# List straight from .values() rows with a read-only ValuesSerializer instead of
+# instantiating a model object and a ModelSerializer per row (see api/serializers.py)
+class ValuesListMixin:
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.values_serializer_class(queryset, home_currency(request.user.id))
+        if not coalescing_enabled():
+            return Response(serializer.data)
+        # With the writes still queued merged in (see api/writequeue.py)
+        with read_snapshot():
+            return Response(self.with_queued_writes(serializer))
+
+    def with_queued_writes(self, serializer):
+        return serializer.data
+
 
 class CreateUserView(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -35,7 +76,8 @@ class BudgetDetailView(generics.RetrieveAPIView):
         return budget
 
 # Create a viewset for all budgets  
-class BudgetListCreateView(generics.ListCreateAPIView):
+class BudgetListCreateView(ValuesListMixin, generics.ListCreateAPIView):
+    values_serializer_class = BudgetValuesSerializer
     serializer_class = BudgetSerializer
     permission_classes = [IsAuthenticated]
 
@@ -49,7 +91,7 @@ class BudgetListCreateView(generics.ListCreateAPIView):
         if serializer.is_valid():
             serializer.save(user=self.request.user) # have to manually pass in the user, cause it is a read-only field
         else: 
-            print(serializer.errors)
+            logger.warning("Invalid budget", extra={'errors': serializer.errors})
 
 class BudgetDeleteView(generics.DestroyAPIView):
     serializer_class = BudgetSerializer
@@ -59,20 +101,30 @@ class BudgetDeleteView(generics.DestroyAPIView):
         userName = self.request.user
         return Budget.objects.filter(user=userName) 
 
+    # Soft delete: constant time however many expenses the budget has, the rows are purged in the background
+    def perform_destroy(self, instance):
+        soft_delete_budget(instance)
+
 # Create a filtered viewset for expenses on BudgetPage.jsx
 # This viewset is beneficial if we need a full set of create, read, update, and delete operations 
 # for expense objects that are accessible via API, 
 # while maintaining the ability to filter based on the fields specified.
-class ExpenseViewSet(viewsets.ModelViewSet):
+class ExpenseViewSet(ValuesListMixin, viewsets.ModelViewSet):
+    values_serializer_class = ExpenseValuesSerializer
     serializer_class = ExpenseSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['id', 'name', 'amount', 'created_at', 'category']
     def get_queryset(self):
-        queryset = Expense.objects.filter(budget__user=self.request.user)
+        queryset = Expense.objects.filter(user=self.request.user)
         budget_id = self.request.query_params.get('id', None)
         if budget_id is not None:
             queryset = queryset.filter(budget__id=budget_id)
         return queryset
+
+    def with_queued_writes(self, serializer):
+        if any(field in self.request.query_params for field in self.filterset_fields if field != 'id'):
+            return serializer.data  # queued expenses are only listed unfiltered (or by budget)
+        return serializer.data + serializer.represent(queued_expense_rows(self.request.user.id, self.request.query_params.get('id')))
     
 class ExpenseDetailView(generics.RetrieveAPIView):
     queryset = Expense.objects.all()
@@ -81,28 +133,57 @@ class ExpenseDetailView(generics.RetrieveAPIView):
 
     def get_queryset(self):
         userName = self.request.user
-        return Expense.objects.filter(budget__user=userName)
+        return Expense.objects.filter(user=userName)
     
-class ExpenseListCreateView(generics.ListCreateAPIView):
+class ExpenseListCreateView(ValuesListMixin, generics.ListCreateAPIView):
+    values_serializer_class = ExpenseValuesSerializer
     serializer_class = ExpenseSerializer
     permission_classes = [IsAuthenticated]
 
     # override get_queryset() to return only budgets for the authenticated user
     def get_queryset(self):
         # This allows us to filter based on query parameters passed in the URL 
-        queryset = Expense.objects.filter(budget__user=self.request.user)  # Ensure expenses are for the authenticated user
+        queryset = Expense.objects.filter(user=self.request.user)  # Ensure expenses are for the authenticated user
         budget_id = self.request.query_params.get('id', None)
     
         if budget_id is not None:
             queryset = queryset.filter(budget__id=budget_id)  # Further filter by budget_id if provided
         return queryset
 
+    def with_queued_writes(self, serializer):
+        return serializer.data + serializer.represent(queued_expense_rows(self.request.user.id, self.request.query_params.get('id')))
+
+    def create(self, request, *args, **kwargs):
+        if not coalescing_enabled():
+            return super().create(request, *args, **kwargs)
+        # Acknowledged once queued: the expense has no id until the queue is applied
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data['budget'].user_id != request.user.id:
+            raise ValidationError("This budget does not belong to the authenticated user.")
+        row = expense_row(queue_expense(request.user.id, serializer.validated_data))
+        return Response(ExpenseValuesSerializer(None, home_currency(request.user.id)).represent([row])[0], status=status.HTTP_202_ACCEPTED)
+
     # override perform_create() to add the budget to the user
     def perform_create(self, serializer):
         if serializer.is_valid():
             serializer.save() 
         else: 
-            print(serializer.errors)
+            logger.warning("Invalid expense", extra={'errors': serializer.errors})
+
+# Category suggestions for expense names, e.g. POST /expenses/categorise/ {"names": ["Grab to school", "Kopi"]}
+@api_view(['POST'])
+def categorise_expenses(request):
+    names = request.data.get('names')
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        return Response({'error': 'names must be a list of strings'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(names) > settings.EXPENSE_CATEGORISE_MAX_NAMES:
+        return Response({'error': f'At most {settings.EXPENSE_CATEGORISE_MAX_NAMES} names per request'}, status=status.HTTP_400_BAD_REQUEST)
+    suggestions = categorise_names(request.user.id, names)
+    return Response({'suggestions': [
+        {'name': name, 'category': category_id, 'source': source}
+        for name, (category_id, source) in zip(names, suggestions)
+    ]})
 
 class ExpenseDeleteView(generics.DestroyAPIView):
     serializer_class = ExpenseSerializer
@@ -110,9 +191,10 @@ class ExpenseDeleteView(generics.DestroyAPIView):
 
     def get_queryset(self):
         userName = self.request.user
-        return Expense.objects.filter(budget__user=self.request.user) 
+        return Expense.objects.filter(user=self.request.user) 
 
-class IncomeListCreateView(generics.ListCreateAPIView):
+class IncomeListCreateView(ValuesListMixin, generics.ListCreateAPIView):
+    values_serializer_class = IncomeValuesSerializer
     serializer_class = IncomeSerializer
     permission_classes = [IsAuthenticated]
 
@@ -123,11 +205,10 @@ class IncomeListCreateView(generics.ListCreateAPIView):
 
     # override perform_create() to add the income to the user
     def perform_create(self, serializer):
-        print (self.request.data)
         if serializer.is_valid():
             serializer.save(user=self.request.user) # have to manually pass in the user, cause it is a read-only field
         else: 
-            print(serializer.errors)
+            logger.warning("Invalid income", extra={'errors': serializer.errors})
 
 class IncomeDeleteView(generics.DestroyAPIView):
     serializer_class = IncomeSerializer
@@ -149,7 +230,7 @@ class CategoryListView(generics.ListCreateAPIView):
         if serializer.is_valid():
             serializer.save()
         else:
-            print(serializer.errors)
+            logger.warning("Invalid category", extra={'errors': serializer.errors})
 
 
 
@@ -157,127 +238,177 @@ class CategoryListView(generics.ListCreateAPIView):
 @api_view(['GET'])
 def analytics(request):
     user = request.user
+    flush_for_read(user.id)
     current_year = datetime.now().year
     current_month = datetime.now().month
 
     # Get month parameter from request
     month_param = request.query_params.get('month', str(current_month))
     try:
-        month = datetime.strptime(month_param, '%B').month  # Convert month name to month number
+        try:
+            month = datetime.strptime(month_param, '%B').month  # Convert month name to month number
+        except ValueError:
+            month = int(month_param)  # Try to convert directly to an integer if parsing fails
+
+        # Get year parameter from request, so e.g. January can be compared against the previous December
+        year = int(request.query_params.get('year', current_year))
     except ValueError:
-        month = int(month_param)  # Try to convert directly to an integer if parsing fails
+        return Response({'error': 'month and year must be numbers (or month a month name)'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= month <= 12:
+        return Response({'error': 'month must be between 1 and 12'}, status=status.HTTP_400_BAD_REQUEST)
+    # Not year 1: the comparison reads the month before
+    if not date.min.year < year <= date.max.year:
+        return Response({'error': f'year must be between {date.min.year + 1} and {date.max.year}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # The current month is served from the precomputed snapshot when there is one
+    if snapshots_enabled() and month == current_month and year == current_year:
+        payload, snapshot = get_snapshot(user)
+        record_cache_access('dashboard_snapshot', payload is not None)
+        if payload is not None:
+            data = dict(payload['analytics'])
+            data['snapshot'] = {'computed_at': snapshot.computed_at, 'stale': snapshot.is_stale()}
+            return Response(data)
+        # No usable snapshot: compute synchronously below and have one built for next time (not on an edge
+        # server, whose files are read-only: their rollups come with the next export)
+        if not edge_serving():
+            scheduler.schedule(user.id)
+
+    data = compute_analytics(user, month, year)
+    return Response(data)
 
+# Whole dashboard payload (analytics, budget utilisation, goal progress) for the current month
+@api_view(['GET'])
+def dashboard(request):
+    flush_for_read(request.user.id)
+    payload, snapshot = get_snapshot(request.user) if snapshots_enabled() else (None, None)
+    if payload is None:
+        payload = refresh_snapshot(request.user.id) if snapshots_enabled() and not edge_serving() else compute_dashboard(request.user)
+        return Response(dict(payload, snapshot={'computed_at': now(), 'stale': False}))
+    return Response(dict(payload, snapshot={'computed_at': snapshot.computed_at, 'stale': snapshot.is_stale()}))
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def dashboard_metrics(request):
+    return Response(scheduler.metrics())
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def throttling_metrics(request):
+    return Response(throttle_metrics())
 
-    # 1. Most spent on category for the selected month
-    most_spent_category = Expense.objects.filter(budget__user=user, created_at__year=current_year, created_at__month=month) \
-        .values('category__name') \
-        .annotate(total_spent=Sum('amount')) \
-        .order_by('-total_spent') \
-        .first()
-    
-    # 2. Least spent on category for the selected month
-    least_spent_category = Expense.objects.filter(budget__user=user, created_at__year=current_year, created_at__month=month, category__isnull=False) \
-        .values('category__name') \
-        .annotate(total_spent=Sum('amount')) \
-        .order_by('total_spent') \
-        .first()
-
-    # 3. Average monthly spent
-    start_date = datetime.now() - timedelta(days=30)
-    average_monthly_spent = Expense.objects.filter(budget__user=user, created_at__gte=start_date) \
-        .aggregate(average_monthly_spent=Avg('amount'))['average_monthly_spent']
-
-    # 4. Net income (total income - total expenses) for the selected month
-    total_income_selected_month = Income.objects.filter(user=user, created_at__year=current_year, created_at__month=month) \
-        .aggregate(total_income=Sum('amount'))['total_income'] or 0
-
-    total_expenses_selected_month = Expense.objects.filter(budget__user=user, created_at__year=current_year, created_at__month=month) \
-        .aggregate(total_expenses=Sum('amount'))['total_expenses'] or 0
-
-    net_income_selected_month = total_income_selected_month - total_expenses_selected_month
-
-    # Additional Statistics
-    # 5. Spending per Month
-    spending_per_month = Expense.objects.filter(budget__user=user) \
-        .annotate(month=ExtractMonth('created_at')) \
-        .values('month') \
-        .annotate(total_spent=Sum('amount')) \
-        .order_by('month')
-
-    # 4a. Net income (total income - total expenses) per month
-    total_income_per_month = Income.objects.filter(user=user) \
-        .annotate(month=ExtractMonth('created_at')) \
-        .values('month') \
-        .annotate(total_income=Sum('amount')) \
-        .order_by('month')
-
-    # Create a dictionary for easy lookup of expenses by month
-    expenses_dict = {expense['month']: expense['total_spent'] for expense in spending_per_month}
-
-    net_income_per_month = []
-    for income in total_income_per_month:
-        month_income = income['month']
-        total_income = income['total_income']
-        total_expenses = expenses_dict.get(month_income, 0)
-        net_income_per_month.append({
-            'month': month_income,
-            'net_income': total_income - total_expenses
-        })
-
-    # 6. Spending by Category for the selected month
-    spending_by_category = Expense.objects.filter(budget__user=user, created_at__year=current_year, created_at__month=month) \
-        .values('category__name') \
-        .annotate(total_spent=Sum('amount')) \
-        .order_by('-total_spent')
-    
-    # 7. Total spending for the selected month
-    total_spent_selected_month = Expense.objects.filter(
-        budget__user=user, 
-        created_at__year=current_year, 
-        created_at__month=month
-    ).aggregate(total_spent=Sum('amount'))['total_spent']
-
-    # 8. Spending by Category per Month
-    spending_by_category_per_month = Expense.objects.filter(budget__user=user) \
-        .annotate(month=ExtractMonth('created_at')) \
-        .values('category__name', 'month') \
-        .annotate(total_spent=Sum('amount')) \
-        .order_by('category__name', 'month')
-    
-    # 9. Number of Budgets Exceeded for the Selected Month
-    budgets_exceeded = Budget.objects.filter(user=user, created_at__year=current_year, created_at__month=month) \
-        .annotate(total_spent=Sum('expense__amount')) \
-        .filter(total_spent__gt=F('amount')) \
-        .count()
-
-    # 10. Weekly Expenses for the Selected Month
-    weekly_expenses = Expense.objects.filter(budget__user=user, created_at__year=current_year, created_at__month=month) \
-        .annotate(week=ExtractWeek('created_at')) \
-        .values('week') \
-        .annotate(total_spent=Sum('amount')) \
-        .order_by('week')
-
-    data = {
-        'most_spent_category': most_spent_category,
-        'least_spent_category': least_spent_category,
-        'average_monthly_spent': average_monthly_spent,
-        'net_income_current_month': net_income_selected_month,
-        'net_income_per_month': list(net_income_per_month),
-        'spending_per_month': list(spending_per_month),
-        'spending_by_category': list(spending_by_category),
-        'total_spent_current_month': total_spent_selected_month,
-        'spending_by_category_per_month': list(spending_by_category_per_month),
-        'budgets_exceeded': budgets_exceeded,
-        'weekly_expenses': list(weekly_expenses)
-    }
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def write_queue_metrics(request):
+    return Response(flusher.metrics())
 
-    return Response(data)
+# Generic time-bucket aggregation, e.g. /analytics/buckets/?source=expense&period=month&start=2020-01-01&end=2024-12-31
+@api_view(['GET'])
+def time_buckets(request):
+    user = request.user
+    flush_for_read(user.id)
+    source = request.query_params.get('source', 'expense')
+    period = request.query_params.get('period', 'month')
+
+    if source == 'expense':
+        queryset = Expense.objects.filter(user=user)
+    elif source == 'income':
+        queryset = Income.objects.filter(user=user)
+    else:
+        return Response({'error': 'source must be expense or income'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if period not in TRUNC_FUNCTIONS:
+        return Response({'error': f"period must be one of {', '.join(TRUNC_FUNCTIONS)}"}, status=status.HTTP_400_BAD_REQUEST)
 
+    try:
+        tz = get_timezone(request.query_params.get('tz'))
+        end_param = request.query_params.get('end')
+        end = datetime.strptime(end_param, '%Y-%m-%d').date() if end_param else now().astimezone(tz).date()
+        start_param = request.query_params.get('start')
+        start = datetime.strptime(start_param, '%Y-%m-%d').date() if start_param else end - timedelta(days=365)
+        fill_gaps = request.query_params.get('fill_gaps', 'true').lower() != 'false'
+        currency = home_currency(user.id)
+        buckets = bucket_totals(queryset, period, start, end, tz, amount_field=in_home_currency(currency), fill_gaps=fill_gaps)
+    except OverflowError:  # the default start, a year before an end in year 1
+        return Response({'error': f'start must not be before {date.min}'}, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'source': source,
+        'period': period,
+        'timezone': str(tz),
+        'currency': currency,
+        'buckets': buckets,
+    })
+
+# The currency analytics are shown in: GET the current one and the ones with exchange rates, PUT {"currency": "EUR"}
+@api_view(['GET', 'PUT'])
+def currency_settings(request):
+    if request.method == 'PUT':
+        try:
+            set_home_currency(request.user.id, request.data.get('currency'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        mark_stale(request.user.id)
+    return Response({
+        'home_currency': home_currency(request.user.id),
+        'currencies': sorted(rate_table().currencies() | {settings.DEFAULT_CURRENCY}),
+    })
+
+# Platform-wide statistics for staff (see api/platform_stats.py); expensive, so cached for a while
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def platform_stats(request):
+    stats = cache.get('platform-stats')
+    record_cache_access('platform_stats', stats is not None)
+    if stats is None:
+        stats = compute_platform_stats(workers=settings.PLATFORM_STATS_WORKERS)
+        cache.set('platform-stats', stats, settings.PLATFORM_STATS_CACHE_SECONDS)
+    return Response(stats)
+
+# Delta sync for offline clients: /sync/?since=<cursor> returns what changed after the cursor (see api/sync.py)
+@api_view(['GET'])
+def sync(request):
+    try:
+        cursor = int(request.query_params.get('since', 0))
+        limit = min(int(request.query_params.get('limit', 1000)), 5000)
+    except ValueError:
+        return Response({'error': 'since and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    if cursor < 0 or limit < 1:
+        return Response({'error': 'since must be >= 0 and limit >= 1'}, status=status.HTTP_400_BAD_REQUEST)
+    flush_for_read(request.user.id)
+    return Response(changes_since(request.user, cursor, limit))
+
+def public_feed_response(data):
+    response = Response(data)
+    patch_cache_control(response, public=True, max_age=settings.DISCOUNT_FEED_CACHE_SECONDS)
+    return response
+
+# The discount feed is public and the same for every user: filtered and cached server-side, and
+# cacheable by a CDN / reverse proxy (see api/discounts.py)
 class StudentDiscountListView(generics.ListAPIView):
     queryset = StudentDiscount.objects.all()
     serializer_class = StudentDiscountSerializer
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def list(self, request, *args, **kwargs):
+        try:
+            filters = parse_feed_filters(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return public_feed_response(cached_feed('page', filters))
+
+# Counts per channel for the discount feed filters, e.g. /student-discount/facets/?since=2024-07-01&has_link=true
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def student_discount_facets(request):
+    try:
+        filters = parse_feed_filters(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return public_feed_response(cached_feed('facets', filters))
 
 
 class GoalDetailView(generics.RetrieveAPIView):
@@ -285,18 +416,32 @@ class GoalDetailView(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        goal = Goal.objects.filter(user=self.request.user, id=self.kwargs['pk']).first()
+        if not coalescing_enabled():
+            goal = Goal.objects.filter(user=self.request.user, id=self.kwargs['pk']).first()
+        else:
+            with read_snapshot():
+                goal = Goal.objects.filter(user=self.request.user, id=self.kwargs['pk']).first()
+                if goal:
+                    goal.current_amount += queued_savings(goal.user_id, goal.pk).get(goal.pk, 0)
         if not goal:
             raise NotFound("Goal not found")
         return goal
 
-class GoalListCreateView(generics.ListCreateAPIView):
+class GoalListCreateView(ValuesListMixin, generics.ListCreateAPIView):
+    values_serializer_class = GoalValuesSerializer
     serializer_class = GoalSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         return Goal.objects.filter(user=self.request.user)
 
+    def with_queued_writes(self, serializer):
+        savings = queued_savings(self.request.user.id)
+        rows = serializer.rows()
+        if savings:
+            rows = (dict(row, current_amount=row['current_amount'] + savings.get(row['id'], 0)) for row in rows)
+        return serializer.represent(rows)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
@@ -311,7 +456,7 @@ class GoalDeleteView(generics.DestroyAPIView):
         instance = self.get_object()
         self.perform_destroy(instance)
         response_data = {'success': 'Goal deleted', 'message': 'Goal deleted successfully'}
-        print("Delete Response Data:", response_data)
+        logger.info("Goal deleted", extra={'user_id': request.user.id, 'goal_id': kwargs.get('pk')})
         return Response(response_data, status=status.HTTP_200_OK)
 
 class AddSavingsToGoalView(generics.GenericAPIView):
@@ -329,7 +474,12 @@ class AddSavingsToGoalView(generics.GenericAPIView):
 
         try:
             amount = Decimal(amount)
-            goal.add_savings(amount)
+            if coalescing_enabled():
+                # Acknowledged once queued, answered with the savings still queued included
+                queue_savings(goal, amount)
+                goal.current_amount += queued_savings(goal.user_id, goal.pk).get(goal.pk, 0)
+            else:
+                goal.add_savings(amount)
             return Response(self.get_serializer(goal).data, status=status.HTTP_200_OK)
         except InvalidOperation:
             return Response({'error': 'Invalid amount'}, status=status.HTTP_400_BAD_REQUEST)
@@ -339,20 +489,21 @@ class RedeemGoalView(generics.GenericAPIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
+        flush_for_read(request.user.id)  # savings still queued count towards the goal
         goal = Goal.objects.filter(user=self.request.user, id=self.kwargs['pk']).first()
         if not goal:
             response_data = {'error': 'Goal not found'}
-            print("Redeem Response Data:", response_data)
+            logger.info("Redeem failed: goal not found", extra={'user_id': request.user.id, 'goal_id': kwargs.get('pk')})
             return Response(response_data, status=status.HTTP_404_NOT_FOUND)
 
         if goal.is_goal_achieved():
             goal.redeem()
             response_data = {'success': 'Goal redeemed', 'message': 'Goal redeemed successfully'}
-            print("Redeem Response Data:", response_data)
+            logger.info("Goal redeemed", extra={'user_id': request.user.id, 'goal_id': goal.id})
             return Response(response_data, status=status.HTTP_200_OK)
         else:
             response_data = {'error': 'Goal not achieved yet'}
-            print("Redeem Response Data:", response_data)
+            logger.info("Redeem failed: goal not achieved", extra={'user_id': request.user.id, 'goal_id': goal.id})
             return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
         
 
@@ -362,28 +513,43 @@ class ExportDataView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
+        # Exports are expensive, only allow a few in flight per user
+        with concurrency_slot(request, 'export', settings.EXPORT_MAX_IN_FLIGHT):
+            flush_for_read(request.user.id)
+            return self.export(request)
+
+    def export(self, request):
+        # openpyxl is only needed here, importing it lazily keeps it out of every worker's boot time and memory
+        from openpyxl import Workbook
+
         user = request.user
 
-        # Fetch the user's expenses and income data
-        budgets = Budget.objects.filter(user=user)
-        expenses = Expense.objects.filter(budget__in=budgets)
-        income = Income.objects.filter(user=user)
+        # Fetch the user's expenses (as compact columns, streamed from the database) and income data
+        expenses = ExpenseColumns.from_queryset(Expense.objects.filter(user=user), with_names=True)
+        category_names = dict(Category.objects.values_list('id', 'name'))
+        income = Income.objects.filter(user=user).values_list('created_at', 'name', 'amount').iterator()
 
-        # Create a new Excel workbook
-        wb = Workbook()
-        ws_expenses = wb.active
-        ws_expenses.title = "Expenses"
+        # Create a new Excel workbook; write-only, so rows go out to a temporary file as they are appended
+        # rather than each becoming a cell object kept until the save (this needs lxml: without it,
+        # openpyxl's fallback writer keeps them in memory anyway)
+        wb = Workbook(write_only=True)
+        ws_expenses = wb.create_sheet(title="Expenses")
 
-        # Write the expenses data to the workbook
+        # Write the expenses data to the workbook, the archived ones first (they are the oldest, see api/archive.py)
         ws_expenses.append(["Date", "Category", "Amount", "Description"])
-        for expense in expenses:
-            ws_expenses.append([expense.created_at.strftime('%Y-%m-%d'), expense.category.name, expense.amount, expense.name])
+        archived_ids = set()
+        for expense_id, day, category_id, amount, name in archived_expenses(user.id):
+            archived_ids.add(expense_id)
+            ws_expenses.append([day.strftime('%Y-%m-%d'), category_names.get(category_id), amount, name])
+        for expense_id, (day, category_id, amount, name) in zip(expenses.ids, expenses.rows()):
+            if expense_id not in archived_ids:
+                ws_expenses.append([day.strftime('%Y-%m-%d'), category_names.get(category_id), amount, name])
 
         # Create a new sheet for income data
         ws_income = wb.create_sheet(title="Income")
         ws_income.append(["Date", "Source", "Amount"])
-        for inc in income:
-            ws_income.append([inc.created_at.strftime('%Y-%m-%d'), inc.name, inc.amount])
+        for created_at, name, amount in income:
+            ws_income.append([created_at.strftime('%Y-%m-%d'), name, amount])
 
         # Prepare the response
         response = HttpResponse(content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
@@ -391,3 +557,43 @@ class ExportDataView(APIView):
         wb.save(response)
 
         return response
+
+
+# Bank statement import: POST /imports/ (multipart) with file, budget (debits become its expenses, credits
+# income), optional format (csv / ofx), columns (JSON column mapping) and date_format (see api/imports.py)
+class ImportStatementView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+        budget = Budget.objects.filter(user=request.user, id=request.data.get('budget') or 0).first()
+        if budget is None:
+            return Response({'error': 'budget must be one of your budgets'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            columns = json.loads(request.data['columns']) if request.data.get('columns') else None
+        except ValueError:
+            columns = False
+        if columns is False or columns is not None and not (
+                isinstance(columns, dict) and all(isinstance(value, str) for value in columns.values())):
+            return Response({'error': 'columns must be a JSON object of column names'}, status=status.HTTP_400_BAD_REQUEST)
+
+        def progress(summary, done=False):
+            ImportProgress.objects.update_or_create(user=request.user, defaults={'summary': summary, 'done': done})
+
+        with concurrency_slot(request, 'import', settings.IMPORT_MAX_IN_FLIGHT):
+            try:
+                summary = import_statement(upload, request.user, budget, request.data.get('format'), columns,
+                                           request.data.get('date_format'), progress)
+            except StatementError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        progress(summary, done=True)
+        logger.info("Statement imported", extra={'user_id': request.user.id, **{k: v for k, v in summary.items() if k != 'errors'}})
+        return Response(summary, status=status.HTTP_201_CREATED)
+
+# Progress of the user's running (or last) statement import
+@api_view(['GET'])
+def import_progress(request):
+    progress = ImportProgress.objects.filter(user=request.user).first()
+    return Response({**progress.summary, 'done': progress.done} if progress else {})
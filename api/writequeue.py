@@ -0,0 +1,223 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, router, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .categorisation import categorise_names
+from .models import Budget, Expense, Goal, QueuedWrite
+from .snapshots import mark_stale
+from .sync import reserve_change_seqs
+
+logger = logging.getLogger(__name__)
+
+# Write coalescing for bursty writes (WRITE_COALESCING_ENABLED).
+#
+# Adding savings to a goal and creating an expense normally write the row, bump the user's sync counter
+# and mark the dashboard snapshot stale, all in the request, and a burst of savings on one goal queues up
+# on that goal's and the counter's row locks. With coalescing the request only appends a QueuedWrite row
+# (a plain INSERT that locks nothing shared) and answers; a background thread applies the queue in grouped
+# transactions: one UPDATE ... SET current_amount = current_amount + total per goal, one bulk_create for
+# the expenses, one counter bump and one snapshot invalidation per user.
+#
+# Reads see their writes through the queue: goal and expense lists merge in the writes still queued
+# (read in one snapshot with the table, so a flush committing in between can't drop or double a write),
+# and the reads that aggregate (analytics, dashboard, export, sync) flush the user's queue first.
+
+
+def coalescing_enabled():
+    return getattr(settings, 'WRITE_COALESCING_ENABLED', False)
+
+
+def queue_savings(goal, amount):
+    write = QueuedWrite.objects.create(user_id=goal.user_id, kind=QueuedWrite.SAVINGS, target_id=goal.pk, amount=amount)
+    transaction.on_commit(flusher.schedule)
+    return write
+
+
+def queue_expense(user_id, validated_data):
+    # validated_data of an ExpenseSerializer; the category is suggested when applied, in batch, if not given
+    budget = validated_data['budget']
+    payload = {'name': validated_data['name'], 'currency': validated_data.get('currency') or budget.currency}
+    if 'category' in validated_data:
+        payload['category'] = validated_data['category'].pk if validated_data['category'] else None
+    write = QueuedWrite.objects.create(user_id=user_id, kind=QueuedWrite.EXPENSE, target_id=budget.pk,
+                                       amount=validated_data['amount'], payload=payload)
+    transaction.on_commit(flusher.schedule)
+    return write
+
+
+def queued_savings(user_id, goal_id=None):
+    # goal id -> savings still in the queue (of all the user's goals, or just `goal_id`)
+    writes = QueuedWrite.objects.filter(user_id=user_id, kind=QueuedWrite.SAVINGS)
+    if goal_id is not None:
+        writes = writes.filter(target_id=goal_id)
+    totals = writes.values('target_id').annotate(total=Sum('amount')).values_list('target_id', 'total')
+    return {goal_id: Decimal(total) for goal_id, total in totals}
+
+
+def queued_expense_rows(user_id, budget_id=None):
+    # The queued expenses as ExpenseValuesSerializer rows; id is None until they are applied
+    writes = QueuedWrite.objects.filter(user_id=user_id, kind=QueuedWrite.EXPENSE).order_by('id')
+    if budget_id is not None:
+        writes = writes.filter(target_id=budget_id)
+    return [expense_row(write) for write in writes]
+
+
+def expense_row(write):
+    return {
+        'id': None, 'budget': write.target_id, 'name': write.payload['name'], 'amount': write.amount,
+        'currency': write.payload['currency'], 'created_at': write.created_at,
+        'category': write.payload.get('category'), 'queued': True,
+    }
+
+
+@contextmanager
+def read_snapshot(using=DEFAULT_DB_ALIAS):
+    # The table and the queue read in one transaction. On PostgreSQL that takes REPEATABLE READ (read
+    # committed gives each statement its own snapshot); SQLite holds its read lock until the end anyway.
+    connection = connections[using]
+    with transaction.atomic(using=using):
+        if connection.vendor == 'postgresql' and len(connection.atomic_blocks) == 1:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        yield
+
+
+def flush_for_read(user_id):
+    # Before reads that aggregate: apply the user's queued writes rather than merging them in
+    if coalescing_enabled() and QueuedWrite.objects.filter(user_id=user_id).exists():
+        flush(user_id)
+
+
+_flush_lock = threading.Lock()  # a request flushing its user's writes and the flusher thread take turns
+
+
+def flush(user_id=None, batch_size=None):
+    # Applies the queue (or one user's part of it) in batches of WRITE_QUEUE_BATCH_SIZE writes, each its own
+    # transaction; returns the number of writes applied
+    batch_size = batch_size or getattr(settings, 'WRITE_QUEUE_BATCH_SIZE', 5000)
+    applied = 0
+    with _flush_lock:
+        while True:
+            count = flush_batch(user_id, batch_size)
+            if count is None:
+                continue  # another process took some of the batch, read it again
+            if not count:
+                return applied
+            applied += count
+
+
+def flush_batch(user_id, batch_size):
+    using = router.db_for_write(QueuedWrite)
+    with transaction.atomic(using=using):
+        # Claimed by deleting them in the transaction that applies them, rows locked by another flusher
+        # are skipped (on databases without row locks the delete count tells)
+        queued = QueuedWrite.objects.select_for_update(skip_locked=True).order_by('id')
+        if user_id is not None:
+            queued = queued.filter(user_id=user_id)
+        writes = list(queued[:batch_size])
+        if not writes:
+            return 0
+        deleted, _ = QueuedWrite.objects.filter(pk__in=[write.pk for write in writes]).delete()
+        if deleted != len(writes):
+            transaction.set_rollback(True, using=using)
+            return None
+        by_user = defaultdict(list)
+        for write in writes:
+            by_user[write.user_id].append(write)
+        for owner_id, user_writes in sorted(by_user.items()):
+            apply_writes(owner_id, user_writes)
+    return len(writes)
+
+
+def apply_writes(user_id, writes):
+    # Writes to goals or budgets deleted since they were queued are dropped with them
+    savings = defaultdict(Decimal)
+    expenses = []
+    for write in writes:
+        if write.kind == QueuedWrite.SAVINGS:
+            savings[write.target_id] += write.amount
+        else:
+            expenses.append(write)
+    budget_ids = set(Budget.objects.filter(user_id=user_id, pk__in={write.target_id for write in expenses}).values_list('pk', flat=True))
+    expenses = [write for write in expenses if write.target_id in budget_ids]
+
+    # bulk_create and update() skip the pre_save signal, so change_seq is stamped here
+    change_seq = reserve_change_seqs(user_id, len(savings) + len(expenses))
+    now = timezone.now()
+    for goal_id, total in savings.items():
+        Goal.objects.filter(pk=goal_id, user_id=user_id).update(
+            current_amount=F('current_amount') + total, change_seq=change_seq, updated_at=now,
+        )
+        change_seq += 1
+
+    uncategorised = [write for write in expenses if 'category' not in write.payload]
+    suggestions = dict(zip((write.pk for write in uncategorised),
+                           categorise_names(user_id, [write.payload['name'] for write in uncategorised])))
+    Expense.objects.bulk_create([
+        Expense(budget_id=write.target_id, user_id=user_id, name=write.payload['name'], amount=write.amount,
+                currency=write.payload['currency'], created_at=write.created_at, change_seq=change_seq + offset,
+                category_id=suggestions[write.pk][0] if write.pk in suggestions else write.payload['category'])
+        for offset, write in enumerate(expenses)
+    ], batch_size=1000)
+    mark_stale(user_id)
+
+
+class WriteFlusher:
+    def __init__(self):
+        self._executor = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self._stats = {'queued': 0, 'applied': 0, 'flushes': 0, 'failed': 0, 'flush_ms_max': 0.0}
+
+    def _get_executor(self):
+        # One thread (created lazily, see SnapshotScheduler): flushes are serial anyway
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='write-flush')
+        return self._executor
+
+    def schedule(self):
+        # The first write of a burst starts the timer, the writes queued before it fires go out with it
+        with self._lock:
+            self._stats['queued'] += 1
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(getattr(settings, 'WRITE_QUEUE_FLUSH_SECONDS', 0.5), self._submit)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _submit(self):
+        with self._lock:
+            self._timer = None
+        self._get_executor().submit(self._run)
+
+    def _run(self):
+        try:
+            start = time.perf_counter()
+            applied = flush()
+            flush_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._stats['applied'] += applied
+                self._stats['flushes'] += 1
+                self._stats['flush_ms_max'] = max(self._stats['flush_ms_max'], round(flush_ms, 2))
+        except Exception:
+            with self._lock:
+                self._stats['failed'] += 1
+            logger.exception("Flushing the write queue failed")
+        finally:
+            close_old_connections()
+
+    def metrics(self):
+        with self._lock:
+            return {'timer_pending': self._timer is not None, **self._stats}
+
+
+flusher = WriteFlusher()
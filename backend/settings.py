@@ -16,11 +16,13 @@ import dj_database_url
 from dotenv import load_dotenv
 import os
 
-load_dotenv() # Load environment variables from .env file for credentials like database
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Load environment variables from .env file for credentials like database
+# (an explicit path skips python-dotenv's search up the directory tree on every boot)
+load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
@@ -35,11 +37,24 @@ ALLOWED_HOSTS = os.environ.get("ALLOWED_HOSTS").split(" ")
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentication.ClaimsJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    "DEFAULT_THROTTLE_CLASSES": [
+        "api.throttling.TokenBucketThrottle",
+    ],
+    # orjson-backed, falls back to the stdlib json implementation when orjson isn't installed
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "api.renderers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
 SIMPLE_JWT = {
@@ -47,6 +62,104 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
 
+# Token-bucket throttling (api/throttling.py): each user gets THROTTLE_BUCKET_CAPACITY tokens,
+# refilled at THROTTLE_REFILL_PER_SECOND, and a request costs THROTTLE_COSTS[url name] (default 1)
+THROTTLE_BACKEND = os.environ.get("THROTTLE_BACKEND", "local")  # "local" or "cache"
+THROTTLE_BUCKET_CAPACITY = int(os.environ.get("THROTTLE_BUCKET_CAPACITY", "120"))
+THROTTLE_REFILL_PER_SECOND = float(os.environ.get("THROTTLE_REFILL_PER_SECOND", "2"))
+THROTTLE_COSTS = {
+    "analytics": 10,
+    "analytics-buckets": 5,
+    "dashboard": 10,
+    "export-data": 30,
+    "import-statement": 30,
+}
+EXPORT_MAX_IN_FLIGHT = int(os.environ.get("EXPORT_MAX_IN_FLIGHT", "1"))
+IMPORT_MAX_IN_FLIGHT = int(os.environ.get("IMPORT_MAX_IN_FLIGHT", "1"))
+
+# Bank statement imports (api/imports.py): rows per bulk insert, and the default CSV column mapping
+# (statement field -> header in the file; use "debit" / "credit" instead of "amount" for two-column files)
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "2000"))
+IMPORT_CSV_COLUMNS = {"date": "Date", "name": "Description", "amount": "Amount"}
+IMPORT_CSV_DATE_FORMAT = "%Y-%m-%d"
+
+# Multi-currency (api/currency.py): amounts are stored in their own currency (DEFAULT_CURRENCY when not
+# given) and aggregated in each user's home currency at the FX rate of their date. Rates are units of a
+# currency per one FX_BASE_CURRENCY, loaded from a file with `manage.py load_fx_rates` (no live service).
+DEFAULT_CURRENCY = os.environ.get("DEFAULT_CURRENCY", "SGD")
+FX_BASE_CURRENCY = os.environ.get("FX_BASE_CURRENCY", "EUR")
+FX_RATES_FILE = os.environ.get("FX_RATES_FILE") or None
+# How often a worker checks the ExchangeRate table for rates loaded since it read them
+FX_RATES_CHECK_SECONDS = float(os.environ.get("FX_RATES_CHECK_SECONDS", "5"))
+
+# Deleted budgets are hidden at once and their expenses purged in batches (api/purge.py), in a background
+# thread unless BUDGET_PURGE_ASYNC is off, in which case run `manage.py purge_deleted_budgets` from cron
+BUDGET_PURGE_ASYNC = os.environ.get("BUDGET_PURGE_ASYNC", "True").lower() == "true"
+BUDGET_PURGE_BATCH_SIZE = int(os.environ.get("BUDGET_PURGE_BATCH_SIZE", "1000"))
+
+# Write coalescing (api/writequeue.py): when enabled, goal savings and new expenses are acknowledged once
+# they are in the QueuedWrite table and applied in grouped transactions by a background thread, at most
+# WRITE_QUEUE_FLUSH_SECONDS after the first write of a burst. `manage.py flush_write_queue` applies what a
+# restarted worker left behind.
+WRITE_COALESCING_ENABLED = os.environ.get("WRITE_COALESCING_ENABLED", "False").lower() == "true"
+WRITE_QUEUE_FLUSH_SECONDS = float(os.environ.get("WRITE_QUEUE_FLUSH_SECONDS", "0.5"))
+WRITE_QUEUE_BATCH_SIZE = int(os.environ.get("WRITE_QUEUE_BATCH_SIZE", "5000"))
+
+# Public student discount feed (api/discounts.py): shared-cache TTL, also sent as Cache-Control max-age,
+# the page size without a limit and the largest page a client can ask for
+DISCOUNT_FEED_CACHE_SECONDS = int(os.environ.get("DISCOUNT_FEED_CACHE_SECONDS", "60"))
+DISCOUNT_FEED_PAGE_SIZE = int(os.environ.get("DISCOUNT_FEED_PAGE_SIZE", "50"))
+DISCOUNT_FEED_MAX_LIMIT = int(os.environ.get("DISCOUNT_FEED_MAX_LIMIT", "200"))
+
+# Expense category suggestions (api/categorisation.py): matchers asked in order, keyword lists per
+# category name (None = the built-in ones), users whose learned mapping each worker keeps in memory
+EXPENSE_CATEGORY_MATCHERS = [
+    "api.categorisation.UserHistoryMatcher",
+    "api.categorisation.KeywordMatcher",
+]
+EXPENSE_CATEGORY_KEYWORDS = None
+EXPENSE_CATEGORY_USER_CACHE_SIZE = int(os.environ.get("EXPENSE_CATEGORY_USER_CACHE_SIZE", "1000"))
+EXPENSE_CATEGORISE_MAX_NAMES = 1000
+
+# Platform-wide statistics (api/platform_stats.py); the staff endpoint computes in-process by default,
+# the platform_stats management command can use a process pool
+PLATFORM_STATS_WORKERS = int(os.environ.get("PLATFORM_STATS_WORKERS", "1"))
+PLATFORM_STATS_CACHE_SECONDS = int(os.environ.get("PLATFORM_STATS_CACHE_SECONDS", "600"))
+
+# Telemetry (api/telemetry.py), served in Prometheus format at /metrics. Set TELEMETRY_MULTIPROC_DIR to a
+# directory writable by all gunicorn workers to aggregate across them. Scrapers send METRICS_TOKEN as a bearer
+# token; without one set, only staff logged in to the admin can read it.
+TELEMETRY_MULTIPROC_DIR = os.environ.get("TELEMETRY_MULTIPROC_DIR") or None
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN") or None
+
+# Structured JSON logs, written to stdout by a background thread (api/logs.py)
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "queue": {
+            "class": "api.logs.NonBlockingQueueHandler",
+        },
+    },
+    "loggers": {
+        "api": {
+            "handlers": ["queue"],
+            "level": os.environ.get("LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
+
+# How long ClaimsJWTAuthentication caches whether a user is still active (None = trust the token alone);
+# without a shared cache (CACHES), also how long a deactivated user can go on in the other workers
+JWT_USER_STATUS_CACHE_TTL = int(os.environ.get("JWT_USER_STATUS_CACHE_TTL", "60")) or None
+
+# Precomputed dashboard snapshots (api/snapshots.py)
+DASHBOARD_SNAPSHOTS_ENABLED = os.environ.get("DASHBOARD_SNAPSHOTS_ENABLED", "True").lower() == "true"
+DASHBOARD_SNAPSHOT_DEBOUNCE_SECONDS = float(os.environ.get("DASHBOARD_SNAPSHOT_DEBOUNCE_SECONDS", "5"))
+DASHBOARD_SNAPSHOT_WORKERS = int(os.environ.get("DASHBOARD_SNAPSHOT_WORKERS", "2"))
+DASHBOARD_SNAPSHOT_MAX_STALENESS_SECONDS = int(os.environ.get("DASHBOARD_SNAPSHOT_MAX_STALENESS_SECONDS", "60"))
+
 
 # Application definition
 
@@ -65,6 +178,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.telemetry.TelemetryMiddleware',  # first, so it times the whole request
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -107,8 +221,51 @@ DATABASES = {
     # }
 }
 
+# Per-user SQLite files for read-only edge servers (api/edge.py): `manage.py export_edge_files` writes each
+# user's budgets, expenses, income, goals and dashboard rollup into EDGE_FILES_DIR, over EDGE_EXPORT_WORKERS
+# processes. A server started with EDGE_SERVING=true has no main database: it answers the analytics,
+# budget and list GETs from those files (each memory-mapped up to EDGE_MMAP_BYTES) and refuses the rest.
+EDGE_FILES_DIR = os.environ.get("EDGE_FILES_DIR", str(BASE_DIR / "edge"))
+EDGE_EXPORT_WORKERS = int(os.environ.get("EDGE_EXPORT_WORKERS", str(os.cpu_count() or 1)))
+EDGE_MMAP_BYTES = int(os.environ.get("EDGE_MMAP_BYTES", str(64 * 1024 * 1024)))
+EDGE_SERVING = os.environ.get("EDGE_SERVING", "False").lower() == "true"
+
 database_url = os.environ.get("DATABASE_URL")
-DATABASES["default"] = dj_database_url.parse(database_url)
+if EDGE_SERVING:
+    # The shared file; each request then switches to its user's file
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": f"file:{Path(EDGE_FILES_DIR) / 'common.sqlite3'}?mode=ro&immutable=1",
+    }
+    MIDDLEWARE.insert(1, "api.edge.EdgeServingMiddleware")
+    WRITE_COALESCING_ENABLED = False
+else:
+    DATABASES["default"] = dj_database_url.parse(database_url)
+
+# The default cache is local to each process. With several workers, point it at a shared one (e.g.
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache and CACHE_LOCATION=redis://host:6379) so the
+# JWT user status, the discount feed, the platform stats and the "cache" throttling store are shared too
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
+    }
+}
+
+# On PostgreSQL migration 0013 partitions the expense table by user into 16 partitions; the default
+# number of hash partitions of `manage.py partition_expenses --by user`, which converts it (api/partitioning.py)
+EXPENSE_PARTITIONS = int(os.environ.get("EXPENSE_PARTITIONS", "16"))
+
+# Expenses older than EXPENSE_ARCHIVE_AFTER_YEARS are moved to compressed ExpenseArchive chunks by
+# `manage.py archive_expenses` (api/archive.py), kept in a database of their own when
+# EXPENSE_ARCHIVE_DATABASE_URL is set (api/routers.py)
+EXPENSE_ARCHIVE_AFTER_YEARS = int(os.environ.get("EXPENSE_ARCHIVE_AFTER_YEARS", "5"))
+EXPENSE_ARCHIVE_CHUNK_SIZE = int(os.environ.get("EXPENSE_ARCHIVE_CHUNK_SIZE", "5000"))
+EXPENSE_ARCHIVE_DATABASE = None
+if os.environ.get("EXPENSE_ARCHIVE_DATABASE_URL"):
+    EXPENSE_ARCHIVE_DATABASE = "archive"
+    DATABASES["archive"] = dj_database_url.parse(os.environ["EXPENSE_ARCHIVE_DATABASE_URL"])
+DATABASE_ROUTERS = ["api.routers.ExpenseArchiveRouter"]
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -0,0 +1,95 @@
+# Benchmark: expense category suggestions for 100k expense names, batch mode (categorise_names) against
+# a keyword-by-keyword scan, plus the one-off costs (compiling the automaton, loading a learned mapping).
+#
+# Usage: python benchmarks/categorise.py [--names 100000] [--history 5000]
+# Uses a throwaway test database, so it can be run against any settings.
+
+import argparse
+import random
+import time
+from decimal import Decimal
+
+from common import setup_django, test_database
+
+setup_django()
+
+from django.contrib.auth.models import User
+
+from api import categorisation
+from api.categorisation import DEFAULT_KEYWORDS, categorise_names, compiled_keywords, get_matchers, normalise_name
+from api.models import Budget, Category, Expense, SyncCounter
+
+WORDS = ['lunch', 'with', 'friends', 'grab', 'to', 'school', 'kopi', 'shopee', 'order', 'uniqlo', 'shirt',
+         'mrt', 'top', 'up', 'birthday', 'present', 'dinner', 'at', 'hawker', 'books', 'for', 'module',
+         'misc', 'laundry', 'haircut', 'printing', 'foodpanda', 'ntuc', 'groceries', 'movie', 'ticket']
+
+
+def random_names(count, rng):
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 5))) + f' #{rng.randint(1, 999)}'
+            for _ in range(count)]
+
+
+def naive_categorise(names, category_ids):
+    # The straightforward version: test every keyword of every category against every name
+    keywords = [(f' {normalise_name(keyword)} ', category_ids[name.lower()])
+                for name, words in DEFAULT_KEYWORDS.items() for keyword in words]
+    results = []
+    for name in names:
+        padded = f' {normalise_name(name)} '
+        scores = {}
+        for keyword, category_id in keywords:
+            if keyword in padded:
+                scores[category_id] = scores.get(category_id, 0) + len(keyword) - 2
+        results.append(max(scores, key=scores.get) if scores else None)
+    return results
+
+
+def timed(label, count, run):
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    per_name = f"{elapsed / count * 1e6:>12.2f} us/name" if count > 1 else ''
+    print(f"{label:<36}{elapsed:>10.3f} s{per_name}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--names', type=int, default=100000)
+    parser.add_argument('--history', type=int, default=5000, help="Categorised past expenses of the user")
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    with test_database():
+        user = User.objects.create_user('benchmark', password='benchmark-password')
+        categories = list(Category.objects.all())
+        category_ids = {category.name.lower(): category.id for category in categories}
+        budget = Budget.objects.create(user=user, name='Benchmark', amount=Decimal('1000.00'))
+        # bulk_create skips the change_seq signal, stamp the rows like an import would
+        Expense.objects.bulk_create([
+            Expense(budget=budget, name=name, amount=Decimal('1.00'), category=rng.choice(categories), change_seq=i + 1)
+            for i, name in enumerate(random_names(args.history, rng))
+        ])
+        SyncCounter.objects.update_or_create(user=user, defaults={'value': args.history})
+        names = random_names(args.names, rng)
+
+        print(f"{args.names} names, {args.history} expenses of history\n")
+        categorisation.reset_keywords()
+        timed("compile keyword automaton", 1, compiled_keywords)
+        history = get_matchers()[0]
+        timed("load learned mapping", 1, lambda: history.mapping(user.id))
+        print()
+        timed("naive keyword scan", args.names, lambda: naive_categorise(names, category_ids))
+        suggestions = timed("categorise_names (batch)", args.names, lambda: categorise_names(user.id, names))
+        sample = names[:2000]
+        timed("categorise_names (one at a time)", len(sample),
+              lambda: [categorise_names(user.id, [name]) for name in sample])
+
+        sources = {}
+        for _category_id, source in suggestions:
+            sources[source] = sources.get(source, 0) + 1
+        print(f"\nsuggestion sources: {sources}")
+
+
+if __name__ == '__main__':
+    main()
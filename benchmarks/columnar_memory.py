@@ -0,0 +1,68 @@
+# Benchmark: memory per expense row for model instances, values() dicts and ExpenseColumns,
+# extrapolated to a user with 1M expenses.
+#
+# Usage: python benchmarks/columnar_memory.py [--rows 200000]
+# Uses a throwaway test database, so it can be run against any settings.
+
+import argparse
+import gc
+import time
+import tracemalloc
+from decimal import Decimal
+
+from common import setup_django, test_database
+
+setup_django()
+
+from django.contrib.auth.models import User
+
+from api.columnar import ExpenseColumns
+from api.models import Budget, Category, Expense
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    with test_database():
+        user = User.objects.create_user('benchmark', password='benchmark-password')
+        categories = [Category.objects.get_or_create(id=i, defaults={'name': f'Category {i}'})[0] for i in range(1, 5)]
+        budget = Budget.objects.create(user=user, name='Benchmark', amount=Decimal('1000.00'), category=categories[0])
+        batch = []
+        for i in range(args.rows):
+            batch.append(Expense(budget=budget, name=f'Expense {i % 1000}', amount=Decimal(i % 5000) / 100,
+                                 category=categories[i % 4]))
+            if len(batch) == 10000:
+                Expense.objects.bulk_create(batch)
+                batch = []
+        Expense.objects.bulk_create(batch)
+        queryset = Expense.objects.filter(user=user)
+
+        scenarios = [
+            ('model instances', lambda: list(queryset.all())),
+            ('values() dicts', lambda: list(queryset.values('id', 'amount', 'created_at', 'category_id'))),
+            ('ExpenseColumns', lambda: ExpenseColumns.from_queryset(queryset.all())),
+            ('ExpenseColumns + names', lambda: ExpenseColumns.from_queryset(queryset.all(), with_names=True)),
+        ]
+        print(f"{'representation':<24}{'bytes/row':>12}{'MB @ 1M rows':>15}{'load s':>10}")
+        for name, build in scenarios:
+            size, elapsed = measure(build)
+            per_row = size / args.rows
+            print(f"{name:<24}{per_row:>12.0f}{per_row * 1_000_000 / 2 ** 20:>15.0f}{elapsed:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
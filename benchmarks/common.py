@@ -0,0 +1,38 @@
+# What every benchmark script starts with: `from common import setup_django, test_database` before
+# anything Django (this directory is on sys.path when a script is run as `python benchmarks/<name>.py`).
+
+import contextlib
+import os
+import sys
+import tempfile
+
+import django
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django(**environ):
+    # `environ`: defaults for environment variables the settings read. Dashboard snapshots are off unless
+    # asked for, so no background refreshes compete with the benchmark for the test database.
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    for name, value in {'DASHBOARD_SNAPSHOTS_ENABLED': 'False', **environ}.items():
+        os.environ.setdefault(name, value)
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database(in_file=False):
+    # A throwaway test database for the block, so a benchmark can be run against any settings. With SQLite
+    # and `in_file`, in a temporary file rather than in memory: forked processes can read it too.
+    from django.db import connection
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases
+
+    setup_test_environment()
+    if in_file and connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'test.sqlite3')
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
@@ -0,0 +1,107 @@
+# Benchmark: analytics over a mixed-currency expense history. Totals per budget and per month converted
+# into the home currency by the database (in_home_currency) against the unconverted sums and against
+# streaming the rows and converting them in Python, then the whole dashboard and the expense list with
+# home_amount. Run with --foreign 0 for the single-currency baseline.
+#
+# Usage: python benchmarks/currency_analytics.py [--expenses 200000] [--foreign 0.3]
+# Uses a throwaway test database, so it can be run against any settings.
+
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from common import setup_django, test_database
+
+setup_django()
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+from api.currency import in_home_currency, load_rates, rate_table
+from api.dashboard import compute_dashboard
+from api.models import Budget, Category, Expense, SyncCounter
+from api.serializers import ExpenseValuesSerializer
+
+CURRENCIES = {'USD': 1.08, 'GBP': 0.86, 'JPY': 160.0, 'AUD': 1.65, 'MYR': 5.1, 'KRW': 1450.0, 'THB': 39.0}
+DAYS = 3 * 365
+
+
+def rates(rng, home):
+    first = date.today() - timedelta(days=DAYS)
+    for currency, rate in {**CURRENCIES, home: 1.46}.items():
+        for offset in range(DAYS):
+            day = first + timedelta(days=offset)
+            if day.weekday() < 5:  # no rates on weekends, like a real feed
+                yield currency, day, Decimal(str(round(rate * rng.uniform(0.95, 1.05), 6)))
+
+
+def timed(label, run, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<44}{best * 1000:>10.1f} ms")
+    return result
+
+
+def python_totals(expenses, home):
+    # Row by row: stream every expense and convert it with the memoised rate table
+    convert = rate_table().convert
+    totals = {}
+    for amount, currency, created_at in expenses.values_list('amount', 'currency', 'created_at').iterator(chunk_size=5000):
+        month = created_at.date().replace(day=1)
+        totals[month] = totals.get(month, 0) + convert(amount, currency, home, created_at.astimezone(dt_timezone.utc).date())
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--expenses', type=int, default=200000)
+    parser.add_argument('--foreign', type=float, default=0.3, help="Share of expenses not in the home currency")
+    args = parser.parse_args()
+    rng = random.Random(42)
+    home = settings.DEFAULT_CURRENCY
+
+    with test_database():
+        load_rates(rates(rng, home))
+        user = User.objects.create_user('benchmark', password='benchmark-password')
+        categories = list(Category.objects.all())
+        budgets = [Budget.objects.create(user=user, name=f'Budget {i}', amount=Decimal('500.00'),
+                                         currency=rng.choice([home, 'USD'])) for i in range(10)]
+        now = datetime.now(dt_timezone.utc)
+        foreign = list(CURRENCIES)
+        # bulk_create skips the change_seq signal, stamp the rows like an import would
+        for start in range(0, args.expenses, 10000):
+            Expense.objects.bulk_create([
+                Expense(budget=rng.choice(budgets), name='expense', amount=Decimal(rng.randint(100, 10000)) / 100,
+                        currency=rng.choice(foreign) if rng.random() < args.foreign else home,
+                        created_at=now - timedelta(minutes=rng.randint(0, (DAYS - 30) * 1440)),
+                        category=rng.choice(categories), change_seq=start + i + 1)
+                for i in range(min(10000, args.expenses - start))
+            ])
+        SyncCounter.objects.update_or_create(user=user, defaults={'value': args.expenses})
+
+        expenses = Expense.objects.filter(user=user)
+        print(f"{args.expenses} expenses, {args.foreign:.0%} in {len(foreign)} foreign currencies, home {home}\n")
+        for label, grouping in (('budget', expenses.values('budget_id').order_by('budget_id')),
+                                ('month', expenses.annotate(month=TruncMonth('created_at')).values('month').order_by('month'))):
+            timed(f"totals per {label}, unconverted Sum", lambda: list(grouping.annotate(total=Sum('amount'))))
+            sql = timed(f"totals per {label}, converted in SQL", lambda: list(grouping.annotate(total=Sum(in_home_currency(home)))))
+            print()
+        python = timed("totals per month, converted row by row", lambda: python_totals(expenses, home), repeat=1)
+        drift = max(abs(row['total'] - python.get(row['month'].date(), 0)) for row in sql)
+        print(f"{'largest difference SQL vs Python':<44}{drift:>13}\n")
+        timed("compute_dashboard", lambda: compute_dashboard(user))
+        recent = expenses.order_by('-created_at')[:20000]
+        timed("expense list (20k rows)", lambda: ExpenseValuesSerializer(recent).data)
+        timed("expense list (20k rows) with home_amount", lambda: ExpenseValuesSerializer(recent, home).data)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# Benchmark: the per-user SQLite files of the edge servers (api/edge.py). Exports --users users with
+# --expenses expenses each with 1 and with --workers processes, then times the served GETs (lists,
+# analytics, dashboard) for random users against the primary and against an edge server: a child process
+# started with EDGE_SERVING, which has no main database at all. Both go through JWT authentication and the
+# whole middleware stack; on the primary the dashboard snapshots are computed beforehand, so both serve
+# the current month's analytics from a precomputed rollup.
+#
+# Usage: python benchmarks/edge_files.py [--users 500] [--expenses 300] [--workers 4] [--requests 300]
+# Uses a throwaway test database, so it can be run against any settings.
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from common import setup_django, test_database
+
+# Snapshots on, for the primary to serve the dashboard from them; a few users send all the requests
+setup_django(DASHBOARD_SNAPSHOTS_ENABLED='True', THROTTLE_BUCKET_CAPACITY='1000000000')
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+ENDPOINTS = ['budgets/', 'expenses/', 'income/', 'goals/', 'analytics/', 'analytics/?month=1', 'dashboard/']
+DAYS = 2 * 365
+
+
+def latencies(user_ids, requests):
+    # endpoint -> (p50, p99) in ms, each request as a random user
+    rng = random.Random(7)
+    clients = {}
+    results = {}
+    for endpoint in ENDPOINTS:
+        times = []
+        for _ in range(requests):
+            user_id = rng.choice(user_ids)
+            if user_id not in clients:
+                clients[user_id] = APIClient()
+                clients[user_id].credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(User(id=user_id))}')
+            start = time.perf_counter()
+            response = clients[user_id].get('/api/' + endpoint)
+            times.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise SystemExit(f"{endpoint} answered {response.status_code}: {response.content[:200]}")
+        times.sort()
+        results[endpoint] = (statistics.median(times), times[int(len(times) * 0.99)])
+    return results
+
+
+def serve(args):
+    # In the child process: an edge server, its only database being the export's common.sqlite3
+    if not settings.EDGE_SERVING or set(settings.DATABASES) != {'default'}:
+        raise SystemExit("the child must run with EDGE_SERVING")
+    user_ids = list(range(args.first_user, args.first_user + args.users))
+    print(json.dumps(latencies(user_ids, args.requests)))
+
+
+def create_data(rng, users, expenses):
+    from api.models import Budget, Category, Expense, Goal, Income
+
+    categories = list(Category.objects.values_list('id', flat=True))
+    User.objects.bulk_create([User(username=f'user{i}', password='!') for i in range(users)])
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    Budget.objects.bulk_create([Budget(user_id=user_id, name=f'Budget {i}', amount=Decimal('300.00'), change_seq=i + 1)
+                                for user_id in user_ids for i in range(3)])
+    budgets = {}
+    for budget_id, user_id in Budget.objects.values_list('id', 'user_id'):
+        budgets.setdefault(user_id, []).append(budget_id)
+    now = datetime.now(dt_timezone.utc)
+    for user_id in user_ids:
+        Expense.objects.bulk_create([
+            Expense(budget_id=rng.choice(budgets[user_id]), user_id=user_id, name='expense',
+                    amount=Decimal(rng.randint(100, 5000)) / 100, category_id=rng.choice(categories),
+                    created_at=now - timedelta(minutes=rng.randint(0, DAYS * 1440)), change_seq=i + 10)
+            for i in range(expenses)
+        ])
+    Income.objects.bulk_create([Income(user_id=user_id, name='Allowance', amount=Decimal('800.00'),
+                                       created_at=now - timedelta(days=30 * month))
+                                for user_id in user_ids for month in range(24)])
+    Goal.objects.bulk_create([Goal(user_id=user_id, name='Laptop', target_amount=Decimal('1500.00'),
+                                   current_amount=Decimal(rng.randint(0, 1500))) for user_id in user_ids])
+    return user_ids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--expenses', type=int, default=300, help="Expenses per user")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=300, help="Requests per endpoint")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--first-user', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args)
+
+    from api.edge import export_edge_files
+    from api.snapshots import refresh_snapshot
+
+    with test_database(in_file=True):
+        user_ids = create_data(random.Random(42), args.users, args.expenses)
+        for user_id in user_ids:
+            refresh_snapshot(user_id)
+
+        print(f"{args.users} users with {args.expenses} expenses each\n")
+        directory = tempfile.mkdtemp()
+        for workers in sorted({1, args.workers}):
+            start = time.perf_counter()
+            users, size = export_edge_files(directory, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"export with {workers} worker(s): {elapsed:.1f}s, {users / elapsed:.0f} users/s, "
+                  f"{size / 1024 / 1024:.1f} MB ({size / users / 1024:.0f} KB per user)")
+
+        primary = latencies(user_ids, args.requests)
+        child = subprocess.run(
+            [sys.executable, __file__, '--serve', '--first-user', str(user_ids[0]), '--users', str(len(user_ids)),
+             '--requests', str(args.requests)],
+            env={**os.environ, 'EDGE_SERVING': 'true', 'EDGE_FILES_DIR': directory},
+            capture_output=True, text=True,
+        )
+        if child.returncode:
+            raise SystemExit(child.stderr)
+        edge = json.loads(child.stdout)
+
+        print(f"\n{'':<22}{'primary p50':>12}{'p99':>9}{'edge p50':>12}{'p99':>9}")
+        for endpoint in ENDPOINTS:
+            print(f"{endpoint:<22}{primary[endpoint][0]:>9.2f} ms{primary[endpoint][1]:>9.2f}"
+                  f"{edge[endpoint][0]:>9.2f} ms{edge[endpoint][1]:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Benchmark: latency of the per-user endpoints as the expense table grows around one user. The measured
+# user keeps the same --user-expenses expenses while other users are added until the table holds each of
+# --sizes rows (10k to 1M by default, 100x), and every size times the expense list, the month's analytics,
+# the time buckets, the dashboard and a full sync for that user. On PostgreSQL the table is partitioned by
+# user (migration 0013), --partition month converts it first (api/partitioning.py), and the partitions each
+# query reads are counted from its plan: with user partitioning, one.
+#
+# Usage: python benchmarks/expense_partitioning.py [--sizes 10000,100000,1000000] [--user-expenses 1000]
+#        [--repeat 20] [--partition user|month]
+# Uses a throwaway test database, so it can be run against any settings.
+
+import argparse
+import random
+import re
+import statistics
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from common import setup_django, test_database
+
+setup_django(THROTTLE_BUCKET_CAPACITY='1000000000')  # one user sending all the requests
+
+from django.contrib.auth.models import User
+from django.db import connection
+from rest_framework.test import APIClient
+
+from api.models import Budget, Category, Expense, SyncCounter
+from api.partitioning import partition_expenses, partition_scheme
+
+ENDPOINTS = ['expenses/', 'analytics/', 'analytics/buckets/', 'dashboard/', 'sync/']
+DAYS = 3 * 365
+
+
+def add_users(first, count, user):
+    # `count` more users, each with a copy of the measured user's expenses in a budget of their own
+    User.objects.bulk_create([User(username=f'other{first + i}', password='!') for i in range(count)])
+    others = User.objects.filter(username__in=[f'other{first + i}' for i in range(count)])
+    Budget.objects.bulk_create([Budget(user=other, name='Budget', amount=Decimal('500.00')) for other in others])
+    columns = [field.column for field in Expense._meta.concrete_fields if not field.primary_key]
+    copied = ', '.join({'budget_id': 'b.id', 'user_id': 'b.user_id'}.get(column, f'e.{column}') for column in columns)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO api_expense ({', '.join(columns)}) SELECT {copied} FROM api_expense e, api_budget b "
+            f"WHERE e.user_id = %s AND b.user_id IN (SELECT id FROM auth_user WHERE username LIKE 'other%%' AND id >= %s)",
+            [user.pk, others.order_by('id').values_list('id', flat=True).first()],
+        )
+        cursor.execute('ANALYZE' if connection.vendor != 'sqlite' else 'ANALYZE api_expense')
+
+
+def partitions_read(user):
+    # The expense partitions in the plan of the user's expense list (PostgreSQL only)
+    plan = Expense.objects.filter(user=user).order_by('-created_at').explain()
+    return len(set(re.findall(r' on (api_expense_(?:p\d+|\d{4}_\d{2}|default))\b', plan)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="Total expense rows to measure at")
+    parser.add_argument('--user-expenses', type=int, default=1000, help="Expenses of the measured user, and of every other user")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--partition', choices=['user', 'month'], help="Convert the table first (PostgreSQL)")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    rng = random.Random(42)
+
+    with test_database():
+        user = User.objects.create_user('benchmark', password='benchmark-password')
+        categories = list(Category.objects.all())
+        budgets = [Budget.objects.create(user=user, name=f'Budget {i}', amount=Decimal('500.00')) for i in range(5)]
+        now = datetime.now(dt_timezone.utc)
+        Expense.objects.bulk_create([
+            Expense(budget=rng.choice(budgets), name='expense', amount=Decimal(rng.randint(100, 5000)) / 100,
+                    created_at=now - timedelta(minutes=rng.randint(0, DAYS * 1440)),
+                    category=rng.choice(categories), change_seq=i + 1)
+            for i in range(args.user_expenses)
+        ])
+        SyncCounter.objects.update_or_create(user=user, defaults={'value': args.user_expenses})
+        if args.partition and args.partition != partition_scheme():
+            # With only the measured user's rows, which span the months the copies will
+            partition_expenses(args.partition, months_ahead=1)
+
+        client = APIClient()
+        client.force_authenticate(user)
+        print(f"{args.user_expenses} expenses for the measured user, table partitioned by {partition_scheme() or 'nothing'}\n")
+        print(f"{'rows':>10}" + ''.join(f"{endpoint:>20}" for endpoint in ENDPOINTS) + f"{'partitions read':>17}")
+        others = 0
+        for size in sizes:
+            missing = size // args.user_expenses - 1 - others
+            if missing > 0:
+                add_users(others, missing, user)
+                others += missing
+            medians = []
+            for endpoint in ENDPOINTS:
+                latencies = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    response = client.get('/api/' + endpoint)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    if response.status_code != 200:
+                        raise SystemExit(f"{endpoint} answered {response.status_code}")
+                medians.append(statistics.median(latencies))
+            partitions = partitions_read(user) if partition_scheme() else '-'
+            print(f"{Expense.all_objects.count():>10}" + ''.join(f"{median:>17.1f} ms" for median in medians) + f"{partitions:>17}")
+
+
+if __name__ == '__main__':
+    main()
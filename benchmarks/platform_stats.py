@@ -0,0 +1,103 @@
+# Benchmark: compute_platform_stats (api/platform_stats.py) as the expense table grows to each of --sizes rows
+# (up to 10M by default) over --users users: wall time in-process and, on SQLite, over --workers processes;
+# the peak Python memory of the in-process run (tracemalloc, a separate slower run), which the fixed-size
+# sketches keep flat as the rows grow; and the error of the per-user spend quantiles against the exact ones.
+#
+# Usage: python benchmarks/platform_stats.py [--sizes 100000,1000000,10000000] [--users 100000] [--workers 4]
+# Uses a throwaway test database, so it can be run against any settings (on SQLite in a temporary file,
+# which the worker processes read too; 10M rows take a few GB of disk).
+
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from common import setup_django, test_database
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Sum
+
+from api.models import Budget, Category, Expense
+from api.platform_stats import compute_platform_stats
+
+SEED_ROWS = 100000
+QUANTILES = [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]
+
+
+def create_users(count, rng):
+    User.objects.bulk_create([User(username=f'platform{i}', password='!') for i in range(count)], batch_size=10000)
+    users = User.objects.filter(username__startswith='platform').values_list('id', flat=True)
+    Budget.objects.bulk_create([Budget(user_id=user_id, name='Budget', amount=Decimal(rng.randint(100, 2000)))
+                                for user_id in users], batch_size=10000)
+    return list(Budget.objects.values_list('id', 'user_id'))
+
+
+def seed_expenses(budgets, rng):
+    categories = list(Category.objects.values_list('id', flat=True)) + [None]
+    now = datetime.now(dt_timezone.utc)
+    Expense.objects.bulk_create([
+        Expense(budget_id=budget_id, user_id=user_id, name='expense', amount=Decimal(rng.randint(50, 20000)) / 100,
+                category_id=rng.choice(categories), created_at=now - timedelta(minutes=rng.randint(0, 365 * 1440)))
+        for budget_id, user_id in (rng.choice(budgets) for _ in range(SEED_ROWS))
+    ], batch_size=10000)
+
+
+def grow_expenses(size):
+    # Copies of the rows already there (same users, budgets and categories) until the table holds `size`
+    columns = ', '.join(field.column for field in Expense._meta.concrete_fields if not field.primary_key)
+    with connection.cursor() as cursor:
+        while (count := Expense.all_objects.count()) < size:
+            cursor.execute(f'INSERT INTO api_expense ({columns}) SELECT {columns} FROM api_expense ORDER BY id LIMIT %s',
+                           [min(count, size - count)])
+        cursor.execute('ANALYZE')
+
+
+def exact_quantiles():
+    totals = sorted(total * 100 for total in Expense.all_objects.values('user_id').annotate(total=Sum('amount'))
+                    .values_list('total', flat=True))
+    return {name: float(totals[int(q * (len(totals) - 1))]) / 100 for name, q in QUANTILES}
+
+
+def timed(**options):
+    start = time.perf_counter()
+    stats = compute_platform_stats(**options)
+    return stats, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100000,1000000,10000000', help="Total expense rows to measure at")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=4, help="Processes for the SQLite run")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    rng = random.Random(42)
+
+    with test_database(in_file=True):
+        seed_expenses(create_users(args.users, rng), rng)
+        pooled = connection.vendor == 'sqlite' and args.workers > 1
+        print(f"{args.users} users on {connection.vendor}\n")
+        print(f"{'rows':>10}{'1 process s':>13}{f'{args.workers} processes s' if pooled else '':>15}{'peak MB':>9}"
+              + ''.join(f"{name + ' error':>11}" for name, _q in QUANTILES))
+        for size in sizes:
+            grow_expenses(size)
+            stats, elapsed = timed()
+            pooled_elapsed = f'{timed(workers=args.workers)[1]:>15.1f}' if pooled else f"{'':>15}"
+
+            tracemalloc.start()
+            compute_platform_stats()
+            _size, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            exact = exact_quantiles()
+            errors = ''.join(f"{abs(stats['spend_per_user'][name] - exact[name]) / exact[name]:>11.2%}" for name, _q in QUANTILES)
+            print(f"{size:>10}{elapsed:>13.1f}{pooled_elapsed}{peak / 2 ** 20:>9.1f}{errors}")
+
+
+if __name__ == '__main__':
+    main()
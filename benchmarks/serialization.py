@@ -0,0 +1,66 @@
+# Benchmark: serialization time per 10k expenses, before (ModelSerializer + default JSONRenderer)
+# and after (ExpenseValuesSerializer on .values() rows + FastJSONRenderer).
+#
+# Usage: python benchmarks/serialization.py [--rows 10000] [--repeat 5]
+# Uses a throwaway test database, so it can be run against any settings.
+
+import argparse
+import time
+from decimal import Decimal
+
+from common import setup_django, test_database
+
+setup_django()
+
+from django.contrib.auth.models import User
+from rest_framework.renderers import JSONRenderer
+
+from api.models import Budget, Category, Expense
+from api.renderers import FastJSONRenderer, orjson
+from api.serializers import ExpenseSerializer, ExpenseValuesSerializer
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with test_database():
+        user = User.objects.create_user('benchmark', password='benchmark-password')
+        category = Category.objects.get_or_create(id=1, defaults={'name': 'Food'})[0]
+        budget = Budget.objects.create(user=user, name='Benchmark', amount=Decimal('1000.00'), category=category)
+        Expense.objects.bulk_create(
+            Expense(budget=budget, name=f'Expense {i}', amount=Decimal(i % 5000) / 100, category=category)
+            for i in range(args.rows)
+        )
+        queryset = Expense.objects.filter(user=user)
+
+        def before():
+            return JSONRenderer().render(ExpenseSerializer(queryset.all(), many=True).data)
+
+        def after():
+            return FastJSONRenderer().render(ExpenseValuesSerializer(queryset.all()).data)
+
+        assert before() == after(), "fast path output differs from the ModelSerializer output"
+
+        per_10k = 10000 / args.rows
+        before_s = best_of(args.repeat, before) * per_10k
+        after_s = best_of(args.repeat, after) * per_10k
+        print(f"orjson available: {orjson is not None}")
+        print(f"ModelSerializer + JSONRenderer:       {before_s * 1000:8.1f} ms / 10k expenses")
+        print(f"ValuesSerializer + FastJSONRenderer:  {after_s * 1000:8.1f} ms / 10k expenses")
+        print(f"speedup: {before_s / after_s:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
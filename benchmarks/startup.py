@@ -0,0 +1,58 @@
+# Benchmark: gunicorn worker cold start, i.e. the time and memory to boot Django and load the urlconf
+# (and with it every view module) in a fresh interpreter, checked against targets.
+#
+# Usage: python benchmarks/startup.py [--repeat 10]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Targets for a worker without --preload (with --preload workers are forked and skip all of this)
+TARGET_COLD_START_MS = 1000
+TARGET_RSS_MB = 80
+
+BOOT_SNIPPET = """
+import json, os, resource, time
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application; get_wsgi_application()
+from django.urls import get_resolver; get_resolver().url_patterns
+boot_ms = (time.perf_counter() - start) * 1000
+rss_kb = next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmRSS'))
+print(json.dumps({'boot_ms': boot_ms, 'rss_mb': rss_kb / 1024}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    wall, boot, rss = [], [], []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', BOOT_SNIPPET], cwd=BASE_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        wall.append((time.perf_counter() - start) * 1000)
+        result = json.loads(output.strip().splitlines()[-1])
+        boot.append(result['boot_ms'])
+        rss.append(result['rss_mb'])
+
+    cold_start = statistics.median(wall)
+    memory = statistics.median(rss)
+    print(f"interpreter + Django boot (median of {args.repeat}): {cold_start:7.0f} ms   (target {TARGET_COLD_START_MS} ms)  "
+          f"{'OK' if cold_start <= TARGET_COLD_START_MS else 'OVER'}")
+    print(f"Django boot only:                      {statistics.median(boot):7.0f} ms")
+    print(f"RSS per worker after boot:             {memory:7.1f} MB   (target {TARGET_RSS_MB} MB)  "
+          f"{'OK' if memory <= TARGET_RSS_MB else 'OVER'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# Benchmark: importing a large bank statement (CSV and OFX) with api/imports.py: wall time of a first
+# import and of a second import of the same file (everything is a duplicate). With --memory, also the peak
+# Python memory of a CSV import of rows/10 and of rows rows (tracemalloc makes those runs much slower).
+#
+# Usage: python benchmarks/statement_import.py [--rows 200000] [--memory]
+# Uses a throwaway test database, so it can be run against any settings.
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+from common import setup_django, test_database
+
+setup_django()
+
+from django.contrib.auth.models import User
+
+from api.imports import import_statement
+from api.models import Budget, Expense, Income
+
+PAYEES = ['GRAB *TRIP', 'NTUC FAIRPRICE', 'STARBUCKS', 'SHOPEE SINGAPORE', 'EZ-LINK TOP UP', 'KOPITIAM',
+          'UNIQLO', 'SALARY', 'TRANSFER FROM MUM', 'DAISO', 'MCDONALDS', 'POPULAR BOOKSTORE']
+
+
+def statement_rows(count, rng):
+    day = date(2020, 1, 1)
+    for i in range(count):
+        if i % 50 == 0:
+            day += timedelta(days=1)
+        payee = rng.choice(PAYEES)
+        amount = Decimal(rng.randint(100, 500000)) / 100
+        yield day, (amount if payee in ('SALARY', 'TRANSFER FROM MUM') else -amount), f'{payee} {i % 97}'
+
+
+def write_csv(path, count, rng):
+    with open(path, 'w') as file:
+        file.write('Date,Description,Amount\n')
+        for day, amount, name in statement_rows(count, rng):
+            file.write(f'{day.isoformat()},{name},{amount}\n')
+
+
+def write_ofx(path, count, rng):
+    with open(path, 'w') as file:
+        file.write('OFXHEADER:100\nDATA:OFXSGML\n\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\n')
+        for i, (day, amount, name) in enumerate(statement_rows(count, rng)):
+            file.write(f'<STMTTRN><TRNTYPE>{"CREDIT" if amount > 0 else "DEBIT"}<DTPOSTED>{day:%Y%m%d}120000'
+                       f'<TRNAMT>{amount}<FITID>{i}<NAME>{name}</STMTTRN>\n')
+        file.write('</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n')
+
+
+def run_import(path, user, budget):
+    start = time.perf_counter()
+    with open(path, 'rb') as file:
+        summary = import_statement(file, user, budget)
+    return summary, time.perf_counter() - start
+
+
+def peak_memory(path, user, budget):
+    tracemalloc.start()
+    with open(path, 'rb') as file:
+        import_statement(file, user, budget)
+    _size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def new_budget(name):
+    user = User.objects.create_user(name, password='benchmark-password')
+    return user, Budget.objects.create(user=user, name='Benchmark', amount=Decimal('1000.00'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--memory', action='store_true')
+    args = parser.parse_args()
+
+    with test_database():
+        with tempfile.TemporaryDirectory() as directory:
+            print(f"{'file':<8}{'import':<8}{'rows':>9}{'created':>9}{'dupes':>9}{'seconds':>9}{'rows/s':>10}")
+            for file_format, write in (('csv', write_csv), ('ofx', write_ofx)):
+                path = os.path.join(directory, f'statement.{file_format}')
+                write(path, args.rows, random.Random(42))
+                user, budget = new_budget(f'benchmark-{file_format}')
+                for label in ('first', 'again'):
+                    summary, elapsed = run_import(path, user, budget)
+                    created = summary['expenses'] + summary['income']
+                    print(f"{file_format:<8}{label:<8}{summary['rows']:>9}{created:>9}{summary['duplicates']:>9}"
+                          f"{elapsed:>9.2f}{summary['rows'] / elapsed:>10.0f}")
+                assert Expense.objects.filter(budget=budget).count() + Income.objects.filter(user=user).count() == args.rows
+
+            if args.memory:
+                print(f"\n{'rows':>9}{'peak MB':>9}")
+                for rows in (args.rows // 10, args.rows):
+                    path = os.path.join(directory, f'memory-{rows}.csv')
+                    write_csv(path, rows, random.Random(7))
+                    user, budget = new_budget(f'memory-{rows}')
+                    print(f"{rows:>9}{peak_memory(path, user, budget) / 2 ** 20:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Load test: latency seen by normal users while one abusive client hammers /api/export/,
+# with the token-bucket throttle and export concurrency cap switched off and on.
+#
+# Usage: python benchmarks/throttle_load.py [--seconds 10] [--normal-users 4] [--abusive-threads 4]
+# Uses a throwaway test database, so it can be run against any settings.
+
+import argparse
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from common import setup_django, test_database
+
+setup_django()
+
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from api.models import Budget, Category, Expense, Income
+
+
+def make_user(username, expenses):
+    user = User.objects.create_user(username, password='benchmark-password')
+    category = Category.objects.get_or_create(id=1, defaults={'name': 'Food'})[0]
+    budget = Budget.objects.create(user=user, name='Benchmark', amount=Decimal('1000.00'), category=category)
+    Expense.objects.bulk_create(
+        Expense(budget=budget, name=f'Expense {i}', amount=Decimal('4.50'), category=category) for i in range(expenses)
+    )
+    Income.objects.create(user=user, name='Salary', amount=Decimal('2000.00'))
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float('nan')
+
+
+def run(normal_clients, abusive_client, seconds, abusive_threads):
+    stop = threading.Event()
+    latencies = []
+    abusive_statuses = []
+    lock = threading.Lock()
+
+    def normal(client):
+        while not stop.is_set():
+            start = time.perf_counter()
+            client.get('/api/budgets/')
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed * 1000)
+            time.sleep(0.05)
+        close_old_connections()
+
+    def abusive():
+        while not stop.is_set():
+            response = abusive_client.get('/api/export/')
+            with lock:
+                abusive_statuses.append(response.status_code)
+        close_old_connections()
+
+    threads = [threading.Thread(target=normal, args=(client,)) for client in normal_clients]
+    threads += [threading.Thread(target=abusive) for _ in range(abusive_threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, abusive_statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--normal-users', type=int, default=4)
+    parser.add_argument('--abusive-threads', type=int, default=4)
+    parser.add_argument('--export-rows', type=int, default=3000)
+    args = parser.parse_args()
+
+    logging.getLogger('django.request').setLevel(logging.ERROR)  # don't log every 429
+    with test_database():
+        normal_clients = [make_user(f'normal{i}', 50) for i in range(args.normal_users)]
+        abusive_client = make_user('abusive', args.export_rows)
+
+        scenarios = [
+            ('throttling off', dict(THROTTLE_BUCKET_CAPACITY=10 ** 9, THROTTLE_REFILL_PER_SECOND=10 ** 9, EXPORT_MAX_IN_FLIGHT=10 ** 9)),
+            ('throttling on', dict(THROTTLE_BACKEND='local')),
+        ]
+        print(f"{'scenario':<16}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'exports ok':>12}{'exports 429':>13}")
+        for name, overrides in scenarios:
+            with override_settings(**overrides):
+                latencies, statuses = run(normal_clients, abusive_client, args.seconds, args.abusive_threads)
+            print(f"{name:<16}{len(latencies):>10}{percentile(latencies, 50):>10.1f}{percentile(latencies, 95):>10.1f}"
+                  f"{percentile(latencies, 99):>10.1f}{statuses.count(200):>12}{statuses.count(429):>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# Benchmark: a burst of goal savings and expense creates through the views, written directly against
+# queued with write coalescing (api/writequeue.py). Reports the acknowledged writes per second, the
+# latency of the acknowledgements, the throughput until everything is applied, and the SQL statements
+# per write. The queue is flushed every --flush-seconds during the burst, like the flusher thread would
+# (here in the same thread, so the flushes count towards "applied/s" but not towards the acks).
+#
+# Usage: python benchmarks/write_coalescing.py [--writes 5000] [--goals 3] [--budgets 3] [--flush-seconds 0.5]
+# Uses a throwaway test database, so it can be run against any settings.
+
+import argparse
+import random
+import time
+from decimal import Decimal
+
+from common import setup_django, test_database
+
+setup_django(THROTTLE_BUCKET_CAPACITY='1000000000')  # one user sending the whole burst
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.models import Budget, Category, Expense, Goal
+from api.views import AddSavingsToGoalView, ExpenseListCreateView
+from api.writequeue import flush
+
+NAMES = ['Kopi', 'Grab to school', 'Chicken rice', 'Textbook', 'MRT top-up', 'Bubble tea', 'Netflix', 'Haircut']
+
+
+def burst(user, requests, flush_seconds=None):
+    # Sends the requests one after the other, flushing the queue every `flush_seconds` when given;
+    # returns the acknowledgement latencies in ms
+    latencies = []
+    last_flush = time.perf_counter()
+    for view, request, kwargs, expected in requests:
+        force_authenticate(request, user=user)
+        start = time.perf_counter()
+        response = view(request, **kwargs)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code != expected:
+            raise SystemExit(f"{request.path} answered {response.status_code}: {response.data}")
+        if flush_seconds is not None and start - last_flush >= flush_seconds:
+            flush()
+            last_flush = time.perf_counter()
+    return latencies
+
+
+def requests(rng, goals, budgets, categories, writes, coalesced):
+    factory = APIRequestFactory()
+    savings, create = AddSavingsToGoalView.as_view(), ExpenseListCreateView.as_view()
+    for i in range(writes):
+        if i % 2:
+            goal = rng.choice(goals)
+            yield savings, factory.post('/', {'amount': str(rng.randint(1, 50))}, format='json'), {'pk': goal.pk}, 200
+        else:
+            data = {'budget': rng.choice(budgets).pk, 'name': rng.choice(NAMES), 'amount': f'{rng.randint(100, 3000) / 100:.2f}'}
+            if rng.random() < 0.5:
+                data['category'] = rng.choice(categories).pk
+            yield create, factory.post('/', data, format='json'), {}, 202 if coalesced else 201
+
+
+def report(label, latencies, applied_seconds, statements):
+    latencies = sorted(latencies)
+    ack_seconds = sum(latencies) / 1000
+    p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+    print(f"{label:<12}{len(latencies) / ack_seconds:>10.0f}{p50:>10.2f}{p99:>10.2f}"
+          f"{len(latencies) / applied_seconds:>12.0f}{statements / len(latencies):>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writes', type=int, default=5000, help="Writes per burst, half savings and half expenses")
+    parser.add_argument('--goals', type=int, default=3)
+    parser.add_argument('--budgets', type=int, default=3)
+    parser.add_argument('--flush-seconds', type=float, default=settings.WRITE_QUEUE_FLUSH_SECONDS)
+    args = parser.parse_args()
+
+    with test_database():
+        user = User.objects.create_user('benchmark', password='benchmark-password')
+        categories = list(Category.objects.all())
+        goals = [Goal.objects.create(user=user, name=f'Goal {i}', target_amount=Decimal('100000.00')) for i in range(args.goals)]
+        budgets = [Budget.objects.create(user=user, name=f'Budget {i}', amount=Decimal('500.00')) for i in range(args.budgets)]
+
+        print(f"{args.writes} writes per burst over {args.goals} goals and {args.budgets} budgets\n")
+        print(f"{'':<12}{'acks/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'applied/s':>12}{'SQL / write':>14}")
+        totals = {}
+        for label, coalesced in (('direct', False), ('coalesced', True)):
+            rng = random.Random(42)  # the same burst for both
+            statements = 0
+
+            def count(execute, sql, params, many, context):
+                nonlocal statements
+                statements += len(params) if many else 1
+                return execute(sql, params, many, context)
+            # The flusher thread never starts: the burst flushes by itself, then applies what is left
+            with override_settings(WRITE_COALESCING_ENABLED=coalesced, WRITE_QUEUE_FLUSH_SECONDS=3600), \
+                    connection.execute_wrapper(count):
+                start = time.perf_counter()
+                latencies = burst(user, requests(rng, goals, budgets, categories, args.writes, coalesced),
+                                  args.flush_seconds if coalesced else None)
+                flush()
+                report(label, latencies, time.perf_counter() - start, statements)
+            totals[label] = (sum(Goal.objects.filter(user=user).values_list('current_amount', flat=True)),
+                             Expense.objects.filter(user=user).count())
+        # Both bursts applied the same savings and expenses
+        savings = totals['coalesced'][0] - totals['direct'][0]
+        expenses = totals['coalesced'][1] - totals['direct'][1]
+        print(f"\nsecond burst added {savings} in savings and {expenses} expenses, same as the first: "
+              f"{savings == totals['direct'][0] and expenses == totals['direct'][1]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# Gunicorn configuration, picked up automatically when gunicorn is started from this directory:
+#   gunicorn backend.wsgi
+#
+# With GUNICORN_PRELOAD=true the Django app (settings, models, urlconf and views) is loaded once in the
+# master and the workers are forked from it, so they start almost instantly and share those pages
+# copy-on-write instead of each importing everything again.
+
+import gc
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "False").lower() == "true"
+
+
+def on_starting(server):
+    # Per-worker telemetry files from a previous run would otherwise be summed into /metrics forever
+    directory = os.environ.get("TELEMETRY_MULTIPROC_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(".json") or name.endswith(".json.tmp"):
+                os.remove(os.path.join(directory, name))
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    # The urlconf (and with it api.views and everything it imports) is otherwise only loaded on the
+    # first request, i.e. separately in every worker
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+
+    # Move everything loaded so far out of the garbage collector's generations; a collection in a
+    # worker would otherwise touch (and so copy) every shared page that holds a Python object header
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return  # Django is only set up in the worker, after this hook
+    # Nothing in the master should have opened a database connection, but never share one with a worker
+    from django.db import connections
+    connections.close_all()